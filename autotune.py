@@ -0,0 +1,246 @@
+import argparse
+import json
+import os
+import random
+import time
+import numpy as np
+from rag_system import RAGSystem
+
+
+# 各索引类型默认扫描的搜索参数及取值（从小到大，越大召回率越高、越慢）
+DEFAULT_SWEEPS = {
+    'HNSW': ('ef', [16, 32, 64, 128, 256, 512]),
+    'IVF_FLAT': ('nprobe', [1, 2, 4, 8, 16, 32, 64, 128]),
+    'IVF_SQ8': ('nprobe', [1, 2, 4, 8, 16, 32, 64, 128]),
+    'IVF_PQ': ('nprobe', [1, 2, 4, 8, 16, 32, 64, 128]),
+    'SCANN': ('nprobe', [1, 2, 4, 8, 16, 32, 64, 128]),
+    'DISKANN': ('search_list', [16, 32, 64, 128, 256]),
+}
+
+
+def load_config(config_path='config.json'):
+    """加载配置文件"""
+    try:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"警告: 无法加载配置文件 {config_path}: {str(e)}")
+        return {}
+
+
+def save_config(config, config_path):
+    """原子地写入配置文件：先写临时文件再替换，中断时原配置文件保持完整"""
+    tmp_path = config_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(config, f, indent=4, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, config_path)
+
+
+def _scores(metric_type, queries, vectors):
+    """计算查询与向量的相似度得分（越大越相似）"""
+    if metric_type == 'COSINE':
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    if metric_type == 'L2':
+        return 2 * queries @ vectors.T - (vectors * vectors).sum(axis=1)[None, :]
+    return queries @ vectors.T
+
+
+def detect_index_type(rag_system):
+    """返回集合实际使用的向量索引类型，无法获取时使用配置中的值"""
+    if rag_system.vector_backend != 'milvus':
+        return rag_system.config.get('rag', {}).get('local_index', {}).get('index_type', 'FLAT').upper()
+    try:
+        index = rag_system.vector_store.describe_index(rag_system.collection_name, index_name="vector")
+        return str(index.get('index_type', rag_system.index_type)).upper()
+    except Exception:
+        return rag_system.index_type
+
+
+def sample_queries(rag_system, count, seed=0, questions=None):
+    """
+    准备测试查询向量
+
+    Args:
+        rag_system: RAGSystem实例
+        count: 查询数
+        seed: 随机种子
+        questions: 可选的问题文本列表（提供时对其生成嵌入，否则从集合中随机抽取块向量作为查询）
+
+    Returns:
+        np.ndarray: 查询向量矩阵
+    """
+    if questions:
+        return np.asarray(rag_system.emb_texts(questions[:count]), dtype=np.float32)
+
+    # 蓄水池抽样，只需遍历一次集合
+    rng = random.Random(seed)
+    sample = []
+    seen = 0
+    for rows in rag_system._iter_rows("id >= 0", ["vector"]):
+        for row in rows:
+            seen += 1
+            if len(sample) < count:
+                sample.append(row["vector"])
+            else:
+                j = rng.randrange(seen)
+                if j < count:
+                    sample[j] = row["vector"]
+    return np.asarray(sample, dtype=np.float32)
+
+
+def exact_top_k(rag_system, queries, k):
+    """
+    遍历集合中的所有向量，精确计算每个查询的top-k（作为召回率的基准）
+
+    Returns:
+        list[set]: 每个查询的top-k块ID集合
+    """
+    best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+    best_ids = np.zeros((len(queries), 0), dtype=np.int64)
+    for rows in rag_system._iter_rows("id >= 0", ["id", "vector"]):
+        if not rows:
+            continue
+        vectors = np.asarray([row["vector"] for row in rows], dtype=np.float32)
+        ids = np.asarray([row["id"] for row in rows], dtype=np.int64)
+        scores = np.concatenate([best_scores, _scores(rag_system.metric_type, queries, vectors)], axis=1)
+        all_ids = np.concatenate([best_ids, np.broadcast_to(ids, (len(queries), len(ids)))], axis=1)
+        keep = min(k, scores.shape[1])
+        top = np.argpartition(-scores, keep - 1, axis=1)[:, :keep]
+        best_scores = np.take_along_axis(scores, top, axis=1)
+        best_ids = np.take_along_axis(all_ids, top, axis=1)
+    return [set(row.tolist()) for row in best_ids]
+
+
+def measure(rag_system, queries, truth, k, search_params):
+    """
+    用指定搜索参数逐条执行查询，统计recall@k和延迟
+
+    Returns:
+        dict: recall、p50_ms、p95_ms和mean_ms
+    """
+    # 预热一次，避免首次加载索引的耗时计入结果
+    rag_system.vector_store.search(**rag_system._search_kwargs([queries[0].tolist()], k, search_params))
+
+    latencies = []
+    recalls = []
+    for query, expected in zip(queries, truth):
+        kwargs = rag_system._search_kwargs([query.tolist()], k, search_params)
+        kwargs["output_fields"] = []
+        start = time.perf_counter()
+        results = rag_system.vector_store.search(**kwargs)
+        latencies.append(time.perf_counter() - start)
+        found = {hit["id"] for hit in results[0]}
+        recalls.append(len(found & expected) / max(1, len(expected)))
+    latencies = np.asarray(latencies) * 1000
+    return {
+        "recall": float(np.mean(recalls)),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "mean_ms": float(latencies.mean()),
+    }
+
+
+def autotune(rag_system, param, values, k=10, num_queries=200, target_recall=0.95, questions=None, seed=0):
+    """
+    扫描搜索参数，返回各取值的召回率和延迟，以及满足目标召回率的最快设置
+
+    Returns:
+        tuple: (结果列表, 推荐的search_params或None)
+    """
+    queries = sample_queries(rag_system, num_queries, seed, questions)
+    if not len(queries):
+        raise ValueError(f"集合 {rag_system.collection_name} 中没有数据")
+    print(f"计算 {len(queries)} 个查询的精确top-{k}...")
+    truth = exact_top_k(rag_system, queries, k)
+
+    results = []
+    print(f"\n{param:>12} {'recall@' + str(k):>10} {'p50(ms)':>9} {'p95(ms)':>9} {'mean(ms)':>9}")
+    for value in values:
+        search_params = {**rag_system.search_params, param: value}
+        result = {"params": search_params, **measure(rag_system, queries, truth, k, search_params)}
+        results.append(result)
+        print(f"{value:>12} {result['recall']:>10.4f} {result['p50_ms']:>9.2f} "
+              f"{result['p95_ms']:>9.2f} {result['mean_ms']:>9.2f}")
+
+    passing = [result for result in results if result["recall"] >= target_recall]
+    best = min(passing, key=lambda result: result["mean_ms"]) if passing else None
+    return results, best["params"] if best else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="按召回率和延迟自动选择向量搜索参数")
+    parser.add_argument("--config", type=str, default='config.json', help="配置文件路径")
+    parser.add_argument("--k", type=int, default=10, help="计算recall@k的k")
+    parser.add_argument("--queries", type=int, default=200, help="测试查询数")
+    parser.add_argument("--questions", type=str, help="问题文件（每行一个），不指定时从集合中抽取块向量作为查询")
+    parser.add_argument("--target-recall", type=float, default=0.95, help="目标召回率")
+    parser.add_argument("--param", type=str, help="要扫描的搜索参数（默认按索引类型选择，如ef或nprobe）")
+    parser.add_argument("--values", type=int, nargs='+', help="搜索参数的取值")
+    parser.add_argument("--seed", type=int, default=0, help="抽样随机种子")
+    parser.add_argument("--output", type=str, help="结果输出文件（JSON）")
+    parser.add_argument("--apply", action="store_true", help="把推荐的搜索参数写入配置文件")
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    rag_system = RAGSystem(config=config)
+    try:
+        if not rag_system.vector_store.has_collection(rag_system.collection_name):
+            print(f"集合 {rag_system.collection_name} 不存在，请先加载数据")
+            return
+
+        index_type = detect_index_type(rag_system)
+        param, values = args.param, args.values
+        if not param or not values:
+            if index_type not in DEFAULT_SWEEPS:
+                print(f"索引类型 {index_type} 没有可扫描的搜索参数，请用 --param 和 --values 指定")
+                return
+            default_param, default_values = DEFAULT_SWEEPS[index_type]
+            param = param or default_param
+            values = values or default_values
+        if param == 'ef':
+            # HNSW要求ef不小于返回的结果数
+            values = sorted({max(value, args.k) for value in values})
+        print(f"集合: {rag_system.collection_name}，索引类型: {index_type}，扫描参数: {param} = {values}")
+
+        questions = None
+        if args.questions:
+            with open(args.questions, 'r', encoding='utf-8') as f:
+                questions = [line.strip() for line in f if line.strip()]
+
+        results, best = autotune(
+            rag_system, param, values, k=args.k, num_queries=args.queries,
+            target_recall=args.target_recall, questions=questions, seed=args.seed
+        )
+
+        if best is None:
+            print(f"\n没有设置能达到目标召回率 {args.target_recall}，请扩大取值范围")
+        else:
+            print(f"\n满足recall@{args.k} >= {args.target_recall}的最快设置: \"search_params\": {json.dumps(best)}")
+            if args.apply and not config:
+                # 配置文件未能加载时写入会覆盖掉其中的其他设置
+                print(f"配置文件 {args.config} 未能加载，不写入推荐设置")
+            elif args.apply:
+                config.setdefault('rag', {}).setdefault('milvus', {})['search_params'] = best
+                save_config(config, args.config)
+                print(f"已写入配置文件: {args.config}")
+
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump({
+                    "collection": rag_system.collection_name,
+                    "index_type": index_type,
+                    "k": args.k,
+                    "target_recall": args.target_recall,
+                    "results": results,
+                    "recommended": best,
+                }, f, indent=2)
+            print(f"结果已保存到 {args.output}")
+    finally:
+        rag_system.close()
+
+
+if __name__ == "__main__":
+    main()
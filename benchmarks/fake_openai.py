@@ -0,0 +1,228 @@
+import argparse
+import hashlib
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+
+_WORD_RE = re.compile(r'\w+')
+
+
+def hashed_embedding(text, dimension):
+    """
+    特征哈希得到的确定性向量：每个词哈希到一个维度和符号，词重叠越多的文本越相似，
+    使检索结果有意义且不依赖任何模型
+    """
+    vector = np.zeros(dimension, dtype=np.float32)
+    for word in _WORD_RE.findall(text.lower()):
+        digest = hashlib.blake2b(word.encode('utf-8'), digest_size=8).digest()
+        value = int.from_bytes(digest, 'little')
+        vector[value % dimension] += 1.0 if value >> 63 else -1.0
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        vector[0] = 1.0
+        return vector
+    return vector / norm
+
+
+class FakeOpenAIServer:
+    """
+    本地的OpenAI兼容服务，提供 /v1/embeddings 和 /v1/chat/completions，
+    按配置的延迟返回确定性结果，用于在没有网络和费用的情况下压测
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, dimension=384, embed_latency_ms=20.0,
+                 embed_item_latency_ms=0.2, chat_latency_ms=200.0, token_latency_ms=10.0,
+                 completion_tokens=40):
+        """
+        Args:
+            host: 监听地址
+            port: 监听端口（0表示自动选择）
+            dimension: 嵌入向量维度
+            embed_latency_ms: 每个嵌入请求的固定延迟
+            embed_item_latency_ms: 请求中每条输入增加的延迟
+            chat_latency_ms: 对话请求的首token延迟
+            token_latency_ms: 流式响应中每个token的间隔
+            completion_tokens: 每次回答的token数
+        """
+        self.dimension = dimension
+        self.embed_latency_ms = embed_latency_ms
+        self.embed_item_latency_ms = embed_item_latency_ms
+        self.chat_latency_ms = chat_latency_ms
+        self.token_latency_ms = token_latency_ms
+        self.completion_tokens = completion_tokens
+        self.requests = {"embeddings": 0, "chat": 0}
+        self._lock = threading.Lock()
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # 响应头和响应体分两次写出，不关闭Nagle算法时keep-alive连接会多出约40ms的延迟确认
+            disable_nagle_algorithm = True
+
+            def do_POST(handler):
+                length = int(handler.headers.get('Content-Length', 0))
+                body = json.loads(handler.rfile.read(length) or b'{}')
+                path = handler.path.split('?', 1)[0].rstrip('/')
+                if path.endswith('/embeddings'):
+                    server._count('embeddings')
+                    handler._send_json(server.embeddings(body))
+                elif path.endswith('/chat/completions'):
+                    server._count('chat')
+                    if body.get('stream'):
+                        handler._send_stream(server.chat_stream(body))
+                    else:
+                        handler._send_json(server.chat(body))
+                else:
+                    handler._send_json({"error": {"message": f"unknown path {path}"}}, status=404)
+
+            def _send_json(handler, payload, status=200):
+                data = json.dumps(payload).encode('utf-8')
+                handler.send_response(status)
+                handler.send_header('Content-Type', 'application/json')
+                handler.send_header('Content-Length', str(len(data)))
+                handler.end_headers()
+                handler.wfile.write(data)
+
+            def _send_stream(handler, events):
+                handler.send_response(200)
+                handler.send_header('Content-Type', 'text/event-stream')
+                handler.send_header('Connection', 'close')
+                handler.end_headers()
+                for event in events:
+                    handler.wfile.write(f"data: {json.dumps(event)}\n\n".encode('utf-8'))
+                    handler.wfile.flush()
+                handler.wfile.write(b"data: [DONE]\n\n")
+                handler.close_connection = True
+
+            def log_message(handler, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    def _count(self, kind):
+        with self._lock:
+            self.requests[kind] += 1
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def embeddings(self, body):
+        inputs = body.get('input', [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        time.sleep((self.embed_latency_ms + self.embed_item_latency_ms * len(inputs)) / 1000)
+        tokens = sum(max(1, len(text) // 4) for text in inputs)
+        return {
+            "object": "list",
+            "model": body.get('model', 'fake-embedding'),
+            "data": [
+                {"object": "embedding", "index": i,
+                 "embedding": [round(float(x), 6) for x in hashed_embedding(text, self.dimension)]}
+                for i, text in enumerate(inputs)
+            ],
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }
+
+    def _answer_tokens(self, body):
+        max_tokens = body.get('max_tokens') or self.completion_tokens
+        return [f"token{i} " for i in range(min(self.completion_tokens, max_tokens))]
+
+    @staticmethod
+    def _prompt_tokens(body):
+        return sum(max(1, len(str(message.get('content', ''))) // 4) for message in body.get('messages', []))
+
+    def chat(self, body):
+        tokens = self._answer_tokens(body)
+        time.sleep((self.chat_latency_ms + self.token_latency_ms * len(tokens)) / 1000)
+        prompt_tokens = self._prompt_tokens(body)
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get('model', 'fake-chat'),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(tokens)},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": len(tokens),
+                "total_tokens": prompt_tokens + len(tokens),
+            },
+        }
+
+    def chat_stream(self, body):
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        model = body.get('model', 'fake-chat')
+        time.sleep(self.chat_latency_ms / 1000)
+        tokens = self._answer_tokens(body)
+        for i, token in enumerate(tokens):
+            if i:
+                time.sleep(self.token_latency_ms / 1000)
+            yield {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}],
+            }
+        yield {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地的OpenAI兼容压测服务")
+    parser.add_argument("--host", type=str, default='127.0.0.1', help="监听地址")
+    parser.add_argument("--port", type=int, default=8900, help="监听端口")
+    parser.add_argument("--dimension", type=int, default=384, help="嵌入向量维度")
+    parser.add_argument("--embed-latency-ms", type=float, default=20.0, help="每个嵌入请求的延迟")
+    parser.add_argument("--chat-latency-ms", type=float, default=200.0, help="对话请求的首token延迟")
+    parser.add_argument("--token-latency-ms", type=float, default=10.0, help="流式响应每个token的间隔")
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer(
+        host=args.host, port=args.port, dimension=args.dimension,
+        embed_latency_ms=args.embed_latency_ms, chat_latency_ms=args.chat_latency_ms,
+        token_latency_ms=args.token_latency_ms
+    )
+    print(f"模拟OpenAI服务地址: {server.base_url}")
+    try:
+        server.server.serve_forever()
+    except KeyboardInterrupt:
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from benchmarks.fake_openai import FakeOpenAIServer
+from benchmarks.synthetic_pdf import generate_pdf
+from llm_client import LLMClient
+from metrics import metrics
+
+
+def percentiles(values):
+    """计算延迟分布（毫秒）"""
+    if not values:
+        return {}
+    array = np.asarray(values) * 1000
+    return {
+        "p50_ms": float(np.percentile(array, 50)),
+        "p95_ms": float(np.percentile(array, 95)),
+        "p99_ms": float(np.percentile(array, 99)),
+        "mean_ms": float(array.mean()),
+        "max_ms": float(array.max()),
+    }
+
+
+def stage_summary():
+    """从指标注册表中提取各阶段的平均耗时"""
+    stages = {}
+    for name, histogram in metrics.snapshot()["histograms"].items():
+        if name.startswith('rag_stage_duration_seconds'):
+            stages[name[len('rag_stage_duration_seconds'):]] = {
+                "count": histogram["count"],
+                "avg_ms": histogram["avg"] * 1000,
+            }
+    return stages
+
+
+def build_config(workdir, base_url, args):
+    """构建指向本地模拟服务和本地向量存储的配置"""
+    return {
+        "api_key": "benchmark",
+        "base_url": base_url,
+        "model": "fake-chat",
+        "rag": {
+            "enabled": True,
+            "documents": {
+                "chunk_size": args.chunk_size,
+                "chunk_overlap": args.chunk_overlap,
+                "insert_batch_size": args.insert_batch_size,
+                "state_dir": os.path.join(workdir, "ingest_state"),
+            },
+            "vector_store": {"backend": args.backend},
+            "local_index": {
+                "path": os.path.join(workdir, "local_index"),
+                "index_type": args.index_type,
+            },
+            "milvus": {
+                "collection_name": "benchmark_collection",
+                "uri": args.milvus_uri or os.path.join(workdir, "milvus_lite.db"),
+            },
+            "embedding": {
+                "use_openai": True,
+                "openai_model": "fake-embedding",
+                "batch_size": args.embed_batch_size,
+                "concurrency": args.embed_concurrency,
+                "cache": {"enabled": False},
+            },
+            "retrieval": {
+                "top_k": args.top_k,
+                "cache": {"enabled": False},
+            },
+        },
+    }
+
+
+def make_queries(pages, count, seed=0):
+    """从文档中抽取句子片段作为查询，保证每个查询都不同"""
+    rng = random.Random(seed)
+    lines = [line for page in pages for line in page if len(line.split()) >= 6]
+    queries = []
+    seen = set()
+    for _ in range(count * 20):
+        if len(queries) >= count or not lines:
+            break
+        words = rng.choice(lines).split()
+        start = rng.randrange(0, len(words) - 5)
+        query = " ".join(words[start:start + rng.randint(4, 8)])
+        if query not in seen:
+            seen.add(query)
+            queries.append(query)
+    return queries
+
+
+def bench_ingestion(client, workdir, sizes, server):
+    """测试不同页数的合成PDF的导入吞吐量"""
+    results = []
+    pages_by_size = {}
+    for num_pages in sizes:
+        pdf_path = os.path.join(workdir, f"synthetic_{num_pages}.pdf")
+        pages_by_size[num_pages] = generate_pdf(pdf_path, num_pages, seed=num_pages)
+
+        requests_before = server.requests["embeddings"]
+        start = time.perf_counter()
+        client.rag_system.load_data(pdf_path, force_rebuild=True)
+        elapsed = time.perf_counter() - start
+
+        stats = client.rag_system.vector_store.get_collection_stats(client.rag_system.collection_name)
+        chunks = int(stats.get('row_count', 0))
+        results.append({
+            "pages": num_pages,
+            "chunks": chunks,
+            "seconds": elapsed,
+            "chunks_per_second": chunks / elapsed if elapsed else 0.0,
+            "embedding_requests": server.requests["embeddings"] - requests_before,
+        })
+        print(f"导入 {num_pages} 页: {chunks} 个块，{elapsed:.2f} 秒，{results[-1]['chunks_per_second']:.1f} 块/秒")
+    return results, pages_by_size
+
+
+def bench_queries(client, queries, mode, concurrency):
+    """以指定并发数执行查询，返回延迟分布和QPS"""
+    first_token_latencies = []
+
+    def run(query):
+        start = time.perf_counter()
+        if mode == 'retrieve':
+            client.rag_system.retrieve(query)
+        elif mode == 'answer':
+            client.call_llm(query)
+        else:
+            for i, _ in enumerate(client.stream_llm(query)):
+                if i == 0:
+                    first_token_latencies.append(time.perf_counter() - start)
+        return time.perf_counter() - start
+
+    metrics.reset()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(run, queries))
+    elapsed = time.perf_counter() - start
+
+    result = {
+        "mode": mode,
+        "concurrency": concurrency,
+        "queries": len(queries),
+        "seconds": elapsed,
+        "qps": len(queries) / elapsed if elapsed else 0.0,
+        "latency": percentiles(latencies),
+        "stages": stage_summary(),
+    }
+    if first_token_latencies:
+        result["first_token_latency"] = percentiles(first_token_latencies)
+    latency = result["latency"]
+    print(f"{mode} 并发 {concurrency}: {result['qps']:.1f} QPS，"
+          f"p50 {latency['p50_ms']:.1f} ms，p95 {latency['p95_ms']:.1f} ms，p99 {latency['p99_ms']:.1f} ms")
+    return result
+
+
+def git_revision():
+    """当前代码的git提交，不在git仓库中时返回None"""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_results(baseline, current):
+    """打印与基线结果的对比（正数表示变大）"""
+    def change(old, new):
+        return f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+
+    print(f"\n与基线 {baseline.get('git_revision')} 对比:")
+    old_ingest = {item["pages"]: item for item in baseline.get("ingestion", [])}
+    for item in current["ingestion"]:
+        old = old_ingest.get(item["pages"])
+        if old:
+            print(f"  导入 {item['pages']} 页 块/秒: {old['chunks_per_second']:.1f} -> "
+                  f"{item['chunks_per_second']:.1f} ({change(old['chunks_per_second'], item['chunks_per_second'])})")
+    old_queries = {(item["mode"], item["concurrency"]): item for item in baseline.get("queries", [])}
+    for item in current["queries"]:
+        old = old_queries.get((item["mode"], item["concurrency"]))
+        if old:
+            print(f"  {item['mode']} 并发 {item['concurrency']} "
+                  f"QPS {change(old['qps'], item['qps'])}，"
+                  f"p95 {change(old['latency']['p95_ms'], item['latency']['p95_ms'])}，"
+                  f"p99 {change(old['latency']['p99_ms'], item['latency']['p99_ms'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="导入和查询路径的性能基准测试")
+    parser.add_argument("--sizes", type=int, nargs='+', default=[10, 50, 200], help="合成PDF的页数")
+    parser.add_argument("--concurrency", type=int, nargs='+', default=[1, 4, 16], help="查询并发数")
+    parser.add_argument("--queries", type=int, default=200, help="每组测试的查询数")
+    parser.add_argument("--modes", type=str, nargs='+', default=['retrieve', 'answer'],
+                        choices=['retrieve', 'answer', 'stream'], help="查询路径")
+    parser.add_argument("--backend", type=str, default='local', choices=['local', 'milvus'],
+                        help="向量存储后端（milvus未指定URI时使用Milvus Lite）")
+    parser.add_argument("--milvus-uri", type=str, help="Milvus服务器URI")
+    parser.add_argument("--index-type", type=str, default='FLAT', help="本地索引类型")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="分块大小")
+    parser.add_argument("--chunk-overlap", type=int, default=200, help="分块重叠大小")
+    parser.add_argument("--insert-batch-size", type=int, default=256, help="每批插入的块数")
+    parser.add_argument("--embed-batch-size", type=int, default=64, help="每个嵌入请求的文本数")
+    parser.add_argument("--embed-concurrency", type=int, default=1, help="并发嵌入请求数")
+    parser.add_argument("--top-k", type=int, default=3, help="检索的块数")
+    parser.add_argument("--dimension", type=int, default=384, help="模拟嵌入的维度")
+    parser.add_argument("--embed-latency-ms", type=float, default=20.0, help="模拟嵌入请求的延迟")
+    parser.add_argument("--chat-latency-ms", type=float, default=200.0, help="模拟对话请求的首token延迟")
+    parser.add_argument("--token-latency-ms", type=float, default=10.0, help="模拟流式响应的token间隔")
+    parser.add_argument("--output", type=str, default='benchmark_results.json', help="结果输出文件（JSON）")
+    parser.add_argument("--compare", type=str, help="与之前的结果文件对比")
+    parser.add_argument("--keep-workdir", action="store_true", help="保留临时数据目录")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='rag_benchmark_')
+    server = FakeOpenAIServer(
+        dimension=args.dimension,
+        embed_latency_ms=args.embed_latency_ms,
+        chat_latency_ms=args.chat_latency_ms,
+        token_latency_ms=args.token_latency_ms
+    ).start()
+    client = None
+    try:
+        client = LLMClient(config=build_config(workdir, server.base_url, args), use_rag=True)
+
+        print("\n== 导入吞吐量 ==")
+        ingestion, pages_by_size = bench_ingestion(client, workdir, args.sizes, server)
+
+        # 查询在最后一次导入的（最大的）文档上进行
+        queries = make_queries(pages_by_size[args.sizes[-1]], args.queries)
+        print(f"\n== 查询延迟（{len(queries)} 个查询，{args.sizes[-1]} 页的文档）==")
+        query_results = []
+        for mode in args.modes:
+            for concurrency in args.concurrency:
+                query_results.append(bench_queries(client, queries, mode, concurrency))
+
+        results = {
+            "git_revision": git_revision(),
+            "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "parameters": vars(args),
+            "ingestion": ingestion,
+            "queries": query_results,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\n结果已保存到 {args.output}")
+
+        if args.compare:
+            with open(args.compare, 'r') as f:
+                compare_results(json.load(f), results)
+    finally:
+        if client:
+            client.close()
+        server.close()
+        if args.keep_workdir:
+            print(f"数据目录: {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import argparse
+import random
+
+
+# 合成文档使用的词表，模仿法规文本的用词
+_VOCABULARY = (
+    "provider deployer system risk high general purpose model data governance "
+    "transparency obligation authority market surveillance conformity assessment "
+    "documentation technical requirement annex article paragraph regulation union "
+    "member state notified body incident monitoring human oversight accuracy "
+    "robustness cybersecurity quality management record keeping registration "
+    "database penalty fine sandbox innovation biometric identification emotion "
+    "recognition prohibited practice safety fundamental rights impact evaluation"
+).split()
+
+_LINES_PER_PAGE = 48
+_CHARS_PER_LINE = 90
+
+
+def _sentence(rng):
+    words = [rng.choice(_VOCABULARY) for _ in range(rng.randint(8, 20))]
+    words[0] = words[0].capitalize()
+    return " ".join(words) + "."
+
+
+def generate_pages(num_pages, seed=0):
+    """
+    生成确定性的合成页面文本
+
+    Args:
+        num_pages: 页数
+        seed: 随机种子，相同种子生成相同内容
+
+    Returns:
+        每页的文本行列表
+    """
+    rng = random.Random(seed)
+    article = 1
+    pages = []
+    for _ in range(num_pages):
+        lines = []
+        current = ""
+        while len(lines) < _LINES_PER_PAGE:
+            if rng.random() < 0.08:
+                # 不时插入条款标题，便于按条款编号构造查询
+                if current:
+                    lines.append(current)
+                    current = ""
+                lines.append(f"Article {article}")
+                article += 1
+                continue
+            sentence = _sentence(rng)
+            if len(current) + len(sentence) + 1 > _CHARS_PER_LINE:
+                lines.append(current)
+                current = sentence
+            else:
+                current = f"{current} {sentence}".strip()
+        pages.append(lines[:_LINES_PER_PAGE])
+    return pages
+
+
+def _escape(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def write_pdf(path, pages):
+    """
+    不依赖第三方库写出包含文本层的PDF
+
+    Args:
+        path: 输出文件路径
+        pages: 每页的文本行列表
+    """
+    objects = []
+
+    def add(body):
+        objects.append(body)
+        return len(objects)
+
+    catalog = add(None)
+    pages_obj = add(None)
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    page_ids = []
+    for lines in pages:
+        content = "BT /F1 9 Tf 11 TL 40 800 Td " + " ".join(f"({_escape(line)}) '" for line in lines) + " ET"
+        stream = content.encode('latin-1', errors='replace')
+        content_id = add(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        page_ids.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>" % (pages_obj, font, content_id)
+        ))
+    objects[catalog - 1] = b"<< /Type /Catalog /Pages %d 0 R >>" % pages_obj
+    kids = b" ".join(b"%d 0 R" % page_id for page_id in page_ids)
+    objects[pages_obj - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids))
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        output += b"%010d 00000 n \n" % offset
+    output += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog, xref)
+
+    with open(path, 'wb') as f:
+        f.write(output)
+
+
+def generate_pdf(path, num_pages, seed=0):
+    """生成一个指定页数的合成PDF，返回各页文本"""
+    pages = generate_pages(num_pages, seed)
+    write_pdf(path, pages)
+    return pages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成用于压测的合成PDF")
+    parser.add_argument("output", type=str, help="输出文件路径")
+    parser.add_argument("--pages", type=int, default=50, help="页数")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    args = parser.parse_args()
+
+    generate_pdf(args.output, args.pages, args.seed)
+    print(f"已生成 {args.pages} 页的PDF: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+import io
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter
+import numpy as np
+
+
+# 中日韩文字按字符二元组切分，其他文字按连续的字母数字切分
+_CJK = '\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff'
+_TOKEN_RE = re.compile(f'[{_CJK}]+|[^\\W_{_CJK}]+')
+_CJK_RE = re.compile(f'[{_CJK}]')
+
+
+def tokenize(text):
+    """
+    将文本切分为检索词
+
+    英文和数字按单词切分并转为小写（条款编号如 "Article 5" 得到 article、5），
+    中文连续片段切分为字符二元组，单个汉字保留为一元组。
+    """
+    tokens = []
+    for match in _TOKEN_RE.findall(text.casefold()):
+        if _CJK_RE.match(match):
+            if len(match) == 1:
+                tokens.append(match)
+            else:
+                tokens.extend(match[i:i + 2] for i in range(len(match) - 1))
+        else:
+            tokens.append(match)
+    return tokens
+
+
+class BM25Index:
+    """
+    BM25倒排索引
+    以压缩稀疏行(CSR)格式保存倒排表：词表、每个词的倒排表偏移、文档序号(int32)和词频(uint16)，
+    查询时只访问查询词的倒排表并用NumPy向量化计算得分，与集合大小基本无关。
+
+    新增的文档写入内存中的增量段，删除的文档只在主段中标记，查询时合并两段的得分；
+    save()时把增量段和删除标记向量化地合并进主段（压缩）后写入磁盘，
+    因此导入过程中的增删和查询都不需要重建整个倒排表。
+
+    同一索引文件只能由一个进程写入（导入数据的进程）。其他进程只读，查询时发现文件被更新
+    （修改时间变化）且本进程没有未保存的修改，就重新加载索引。
+    """
+
+    # 查询时最多每隔多少秒检查一次索引文件是否被其他进程更新
+    REFRESH_INTERVAL = 1.0
+
+    def __init__(self, path, k1=1.5, b=0.75):
+        """
+        Args:
+            path: 索引文件路径（.npz）
+            k1: 词频饱和参数
+            b: 文档长度归一化参数
+        """
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._checked_at = 0.0
+        self._reset()
+        if os.path.exists(path):
+            try:
+                self._load()
+            except Exception as e:
+                print(f"无法加载BM25索引 {path}，将重新构建: {str(e)}")
+                self._reset()
+
+    def _reset(self):
+        """清空主段和增量段"""
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._doc_lens = np.zeros(0, dtype=np.int32)
+        self._vocab = {}
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._postings = np.zeros(0, dtype=np.int32)
+        self._freqs = np.zeros(0, dtype=np.uint16)
+        self._reset_changes()
+
+    def _reset_changes(self):
+        """清空增量段和删除标记，主段中的文档全部有效"""
+        self._alive = np.ones(len(self._ids), dtype=bool)
+        self._alive_count = len(self._ids)
+        self._alive_len = int(self._doc_lens.sum())
+        self._positions = None
+        # 增量段：{文档ID: {词: 词频}}，以及按词组织的 {词: {文档ID: 词频}}
+        self._delta = {}
+        self._delta_lens = {}
+        self._delta_postings = {}
+        self._delta_len = 0
+        self._changed = False
+
+    def __len__(self):
+        with self._lock:
+            return self._alive_count + len(self._delta)
+
+    def _load(self):
+        """从磁盘加载倒排表"""
+        mtime = os.stat(self.path).st_mtime_ns
+        with np.load(self.path) as data:
+            self._ids = data['ids']
+            self._doc_lens = data['doc_lens']
+            self._offsets = data['offsets']
+            self._postings = data['postings']
+            self._freqs = data['freqs']
+            terms = data['vocab'].tobytes().decode('utf-8')
+        self._vocab = {term: i for i, term in enumerate(terms.split('\n'))} if terms else {}
+        self._reset_changes()
+        self._mtime = mtime
+
+    def _maybe_reload(self):
+        """索引文件被其他进程更新且本进程没有未保存的修改时重新加载"""
+        now = time.monotonic()
+        if self._changed or now - self._checked_at < self.REFRESH_INTERVAL:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            self._load()
+        except Exception as e:
+            # 文件可能正在被替换，下次查询时再试
+            print(f"无法重新加载BM25索引 {self.path}: {str(e)}")
+
+    def _position(self, doc_id):
+        """文档在主段中的序号，不在主段或已删除时返回None"""
+        if self._positions is None:
+            self._positions = {int(doc_id): i for i, doc_id in enumerate(self._ids.tolist())}
+        position = self._positions.get(doc_id)
+        if position is None or not self._alive[position]:
+            return None
+        return position
+
+    def _discard(self, doc_id):
+        """从增量段删除文档或在主段中标记删除，返回文档是否存在"""
+        terms = self._delta.pop(doc_id, None)
+        if terms is not None:
+            self._delta_len -= self._delta_lens.pop(doc_id)
+            for term in terms:
+                postings = self._delta_postings[term]
+                del postings[doc_id]
+                if not postings:
+                    del self._delta_postings[term]
+            return True
+        position = self._position(doc_id)
+        if position is None:
+            return False
+        self._alive[position] = False
+        self._alive_count -= 1
+        self._alive_len -= int(self._doc_lens[position])
+        return True
+
+    def add(self, documents):
+        """
+        添加或替换文档
+
+        Args:
+            documents: (文档ID, 文本) 元组的可迭代对象
+        """
+        documents = [(int(doc_id), dict(Counter(tokenize(text)))) for doc_id, text in documents]
+        if not documents:
+            return
+        with self._lock:
+            for doc_id, terms in documents:
+                self._discard(doc_id)
+                doc_len = sum(terms.values())
+                self._delta[doc_id] = terms
+                self._delta_lens[doc_id] = doc_len
+                self._delta_len += doc_len
+                for term, freq in terms.items():
+                    self._delta_postings.setdefault(term, {})[doc_id] = freq
+            self._changed = True
+
+    def remove(self, ids):
+        """删除文档，不存在的ID会被忽略"""
+        with self._lock:
+            for doc_id in ids:
+                if self._discard(int(doc_id)):
+                    self._changed = True
+
+    def clear(self):
+        """删除所有文档"""
+        with self._lock:
+            self._reset()
+            self._changed = True
+
+    def _compact(self):
+        """把增量段和删除标记合并进主段，只对倒排表数组做向量化操作，不逐个文档重建"""
+        keep = np.nonzero(self._alive)[0]
+        new_positions = np.full(len(self._ids), -1, dtype=np.int64)
+        new_positions[keep] = np.arange(len(keep))
+        delta_ids = list(self._delta)
+
+        vocab = sorted(set(self._vocab) | set(self._delta_postings))
+        term_map = {term: i for i, term in enumerate(vocab)}
+
+        # 主段中仍有效的 (词, 文档, 词频)
+        old_terms = np.array([term_map[term] for term in sorted(self._vocab, key=self._vocab.get)], dtype=np.int64)
+        posting_terms = np.repeat(np.arange(len(self._offsets) - 1), np.diff(self._offsets))
+        valid = self._alive[self._postings]
+        terms = [old_terms[posting_terms[valid]] if len(old_terms) else np.zeros(0, dtype=np.int64)]
+        docs = [new_positions[self._postings[valid]]]
+        freqs = [self._freqs[valid].astype(np.int64)]
+
+        # 增量段的文档追加在主段之后
+        delta = [
+            (term_map[term], len(keep) + i, freq)
+            for i, doc_id in enumerate(delta_ids)
+            for term, freq in self._delta[doc_id].items()
+        ]
+        if delta:
+            delta = np.array(delta, dtype=np.int64)
+            terms.append(delta[:, 0])
+            docs.append(delta[:, 1])
+            freqs.append(delta[:, 2])
+        terms, docs, freqs = np.concatenate(terms), np.concatenate(docs), np.concatenate(freqs)
+
+        # 去掉已没有文档的词，按(词, 文档)排序得到新的CSR倒排表
+        counts = np.bincount(terms, minlength=len(vocab))
+        used = counts > 0
+        terms = (np.cumsum(used) - 1)[terms]
+        order = np.lexsort((docs, terms))
+        offsets = np.zeros(int(used.sum()) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(counts[used])
+
+        self._ids = np.concatenate([self._ids[keep], np.array(delta_ids, dtype=np.int64)])
+        self._doc_lens = np.concatenate([
+            self._doc_lens[keep], np.array([self._delta_lens[doc_id] for doc_id in delta_ids], dtype=np.int32)
+        ])
+        self._vocab = {term: i for i, term in enumerate(term for term, u in zip(vocab, used) if u)}
+        self._offsets = offsets
+        self._postings = docs[order].astype(np.int32)
+        self._freqs = np.minimum(freqs[order], np.iinfo(np.uint16).max).astype(np.uint16)
+        self._reset_changes()
+
+    def save(self):
+        """压缩增量段后把倒排表原子地写入磁盘，导入一批文档结束时调用"""
+        with self._lock:
+            if self._changed:
+                self._compact()
+            vocab = '\n'.join(sorted(self._vocab, key=self._vocab.get)).encode('utf-8')
+            buffer = io.BytesIO()
+            np.savez_compressed(
+                buffer,
+                ids=self._ids,
+                doc_lens=self._doc_lens,
+                offsets=self._offsets,
+                postings=self._postings,
+                freqs=self._freqs,
+                vocab=np.frombuffer(vocab, dtype=np.uint8),
+            )
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(buffer.getvalue())
+            os.replace(tmp_path, self.path)
+            self._mtime = os.stat(self.path).st_mtime_ns
+
+    def search(self, query, top_k=10):
+        """
+        按BM25得分检索文档
+
+        Args:
+            query: 查询文本
+            top_k: 返回的文档数
+
+        Returns:
+            按得分降序排列的 (文档ID, 得分) 列表
+        """
+        with self._lock:
+            self._maybe_reload()
+            total_docs = self._alive_count + len(self._delta)
+            if not total_docs:
+                return []
+            avg_len = max((self._alive_len + self._delta_len) / total_docs, 1.0)
+
+            doc_ids = []
+            doc_freqs = []
+            doc_lens = []
+            idfs = []
+            for term in set(tokenize(query)):
+                parts = []
+                term_index = self._vocab.get(term)
+                if term_index is not None:
+                    start, end = self._offsets[term_index], self._offsets[term_index + 1]
+                    postings = self._postings[start:end]
+                    freqs = self._freqs[start:end]
+                    if self._alive_count < len(self._ids):
+                        valid = self._alive[postings]
+                        postings, freqs = postings[valid], freqs[valid]
+                    parts.append((self._ids[postings], freqs, self._doc_lens[postings]))
+                delta = self._delta_postings.get(term)
+                if delta:
+                    ids = np.fromiter(delta, dtype=np.int64, count=len(delta))
+                    parts.append((
+                        ids,
+                        np.fromiter(delta.values(), dtype=np.float32, count=len(delta)),
+                        np.array([self._delta_lens[doc_id] for doc_id in delta], dtype=np.int32),
+                    ))
+                df = sum(len(ids) for ids, _, _ in parts)
+                if not df:
+                    continue
+                idf = math.log(1 + (total_docs - df + 0.5) / (df + 0.5))
+                for ids, freqs, lens in parts:
+                    doc_ids.append(ids)
+                    doc_freqs.append(freqs.astype(np.float32))
+                    doc_lens.append(lens)
+                    idfs.append(np.full(len(ids), idf, dtype=np.float32))
+
+        if not doc_ids:
+            return []
+        freqs = np.concatenate(doc_freqs)
+        norms = self.k1 * (1 - self.b + self.b * np.concatenate(doc_lens) / avg_len)
+        contributions = np.concatenate(idfs) * freqs * (self.k1 + 1) / (freqs + norms)
+        # 只在命中的文档上累加得分，代价与倒排表长度成正比而不是与文档总数成正比
+        candidates, inverse = np.unique(np.concatenate(doc_ids), return_inverse=True)
+        scores = np.bincount(inverse, weights=contributions)
+        if len(scores) > top_k:
+            top = np.argpartition(-scores, top_k - 1)[:top_k]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(int(candidates[i]), float(scores[i])) for i in top]
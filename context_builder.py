@@ -0,0 +1,156 @@
+import numpy as np
+try:
+    import tiktoken
+except ImportError:
+    # 未安装tiktoken时按字符数估算token数
+    tiktoken = None
+from embedding_scheduler import estimate_tokens
+
+
+class TokenCounter:
+    """使用与对话模型一致的tiktoken编码计算token数，未安装tiktoken时退回到按字符估算"""
+
+    def __init__(self, model='gpt-4o-mini'):
+        self.model = model
+        self.encoding = None
+        if tiktoken is not None:
+            try:
+                self.encoding = self._load_encoding(model)
+            except Exception as e:
+                # 首次使用时需要下载编码文件，离线环境下退回到估算
+                print(f"无法加载tokenizer，将按字符数估算token数: {str(e)}")
+
+    @staticmethod
+    def _load_encoding(model):
+        """加载模型对应的编码，未知模型使用cl100k_base"""
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding('cl100k_base')
+
+    def count(self, text):
+        """返回文本的token数"""
+        if self.encoding is None:
+            return estimate_tokens([text])
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def truncate(self, text, max_tokens):
+        """截断文本，使其不超过max_tokens个token"""
+        if self.encoding is None:
+            return text[:max_tokens * 4]
+        tokens = self.encoding.encode(text, disallowed_special=())
+        return self.encoding.decode(tokens[:max_tokens])
+
+
+def _overlap_length(left, right, min_chars):
+    """返回left的后缀与right的前缀重叠的最大长度，小于min_chars时返回0"""
+    if min(len(left), len(right)) < min_chars:
+        return 0
+    probe = right[:min_chars]
+    start = max(0, len(left) - len(right))
+    position = left.find(probe, start)
+    while position != -1:
+        length = len(left) - position
+        if right.startswith(left[position:]):
+            return length
+        position = left.find(probe, position + 1)
+    return 0
+
+
+class ContextBuilder:
+    """
+    在token预算内组装RAG上下文
+    先用MMR在检索结果中挑选既相关又互不重复的块，再去掉与已选块重叠的文本
+    （分块时的chunk_overlap会让相邻块首尾重复），按顺序填充直到达到token预算。
+    """
+
+    def __init__(self, max_tokens=1500, mmr_lambda=0.7, min_overlap_chars=50, model='gpt-4o-mini'):
+        """
+        Args:
+            max_tokens: 上下文的token预算
+            mmr_lambda: MMR中相关性的权重（1表示只看相关性，0表示只看多样性）
+            min_overlap_chars: 判定为重叠文本的最小字符数
+            model: 对话模型名称，用于选择tokenizer
+        """
+        self.max_tokens = max_tokens
+        self.mmr_lambda = mmr_lambda
+        self.min_overlap_chars = min_overlap_chars
+        self.token_counter = TokenCounter(model)
+
+    def uses_mmr(self, hit_count):
+        """是否需要候选块的向量来按MMR排序（结果太少时排序没有意义）"""
+        return self.mmr_lambda < 1 and hit_count >= 3
+
+    def _mmr_order(self, query_embedding, hits, hit_vectors=None):
+        """按最大边际相关性(MMR)排列检索结果，缺少向量时保持原顺序"""
+        if hit_vectors is None and all("vector" in hit for hit in hits):
+            hit_vectors = [hit["vector"] for hit in hits]
+        if query_embedding is None or hit_vectors is None or not self.uses_mmr(len(hits)):
+            return list(hits)
+
+        vectors = np.asarray(hit_vectors, dtype=np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query /= max(np.linalg.norm(query), 1e-12)
+        relevance = vectors @ query
+        similarity = vectors @ vectors.T
+
+        selected = []
+        remaining = list(range(len(hits)))
+        while remaining:
+            if selected:
+                redundancy = similarity[np.ix_(remaining, selected)].max(axis=1)
+            else:
+                redundancy = np.zeros(len(remaining), dtype=np.float32)
+            scores = self.mmr_lambda * relevance[remaining] - (1 - self.mmr_lambda) * redundancy
+            best = remaining.pop(int(np.argmax(scores)))
+            selected.append(best)
+        return [hits[i] for i in selected]
+
+    def _strip_overlap(self, text, selected_texts):
+        """去掉text中与已选块重叠的开头或结尾，完全包含在已选块中时返回空字符串"""
+        for other in selected_texts:
+            if text in other:
+                return ""
+            head = _overlap_length(other, text, self.min_overlap_chars)
+            if head:
+                text = text[head:]
+            tail = _overlap_length(text, other, self.min_overlap_chars)
+            if tail:
+                text = text[:len(text) - tail]
+        return text.strip()
+
+    def build(self, hits, query_embedding=None, hit_vectors=None):
+        """
+        组装上下文
+
+        Args:
+            hits: 检索结果，每个是包含text（可选vector）的字典
+            query_embedding: 问题的嵌入向量，用于MMR
+            hit_vectors: 与hits顺序一致的块向量（None表示使用hit中的vector）
+
+        Returns:
+            tuple: (上下文文本, 实际使用的块列表)
+        """
+        parts = []
+        used = []
+        selected_texts = []
+        remaining = self.max_tokens
+        for hit in self._mmr_order(query_embedding, hits, hit_vectors):
+            text = self._strip_overlap(hit["text"], selected_texts)
+            if not text:
+                continue
+            tokens = self.token_counter.count(text) + 1
+            if tokens > remaining:
+                # 第一个块就超出预算时截断使用，否则跳过以尝试更短的块
+                if parts:
+                    continue
+                text = self.token_counter.truncate(text, remaining - 1)
+                tokens = remaining
+            parts.append(text)
+            used.append(hit)
+            selected_texts.append(hit["text"])
+            remaining -= tokens
+            if remaining <= 1:
+                break
+        return "\n".join(parts), used
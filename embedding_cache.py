@@ -0,0 +1,167 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+
+
+class EmbeddingCache:
+    """
+    基于SQLite的持久化嵌入缓存
+    以 hash(模型名, 文本) 为键存储向量，超过容量时按最近访问时间淘汰(LRU)
+    命中时只在内存中记录访问时间，累积到一定数量或写入新条目时再批量更新，
+    查询路径上没有写操作；条目数在内存中增量维护，写入时无需统计全表
+    """
+
+    def __init__(self, path='embedding_cache.db', max_entries=200000, access_flush_size=256,
+                 access_flush_interval=30.0):
+        """
+        Args:
+            path: SQLite数据库文件路径
+            max_entries: 最多缓存的向量条数
+            access_flush_size: 累积多少条访问记录后写回数据库
+            access_flush_interval: 访问记录最长延迟多少秒写回数据库
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.access_flush_size = access_flush_size
+        self.access_flush_interval = access_flush_interval
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # 尚未写回的访问时间 {键: 时间}
+        self._pending_access = {}
+        self._last_flush = time.time()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON embeddings(last_access)")
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    @staticmethod
+    def make_key(model, text):
+        """根据模型名和文本内容生成缓存键"""
+        return hashlib.sha256(f"{model}\x00{text}".encode('utf-8')).hexdigest()
+
+    def get_many(self, model, texts):
+        """
+        批量查询缓存
+
+        Args:
+            model: 嵌入模型名称
+            texts: 文本列表
+
+        Returns:
+            dict: 命中的 {文本: 向量}
+        """
+        keys = {self.make_key(model, text): text for text in set(texts)}
+        found = {}
+        with self._lock:
+            key_list = list(keys)
+            # SQLite单条语句的参数数量有限，分批查询
+            for start in range(0, len(key_list), 500):
+                chunk = key_list[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk
+                ).fetchall()
+                for key, blob in rows:
+                    found[keys[key]] = array('f', blob).tolist()
+
+            if found:
+                now = time.time()
+                self._pending_access.update((self.make_key(model, text), now) for text in found)
+                if (len(self._pending_access) >= self.access_flush_size
+                        or now - self._last_flush >= self.access_flush_interval):
+                    self._flush_access()
+                    self._conn.commit()
+
+            self.hits += sum(1 for text in texts if text in found)
+            self.misses += sum(1 for text in texts if text not in found)
+        return found
+
+    def get(self, model, text):
+        """查询单条文本的缓存向量，未命中返回None"""
+        return self.get_many(model, [text]).get(text)
+
+    def put_many(self, model, items):
+        """
+        批量写入缓存
+
+        Args:
+            model: 嵌入模型名称
+            items: (文本, 向量) 元组列表
+        """
+        now = time.time()
+        rows = [(self.make_key(model, text), array('f', vector).tobytes(), now) for text, vector in items]
+        if not rows:
+            return
+        with self._lock:
+            existing = self._count_existing([row[0] for row in rows])
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_access) VALUES (?, ?, ?)", rows
+            )
+            self._count += len({row[0] for row in rows}) - existing
+            if self._count > self.max_entries:
+                # 淘汰前写回访问时间，避免删除最近命中过的条目
+                self._flush_access()
+                self._evict()
+            self._conn.commit()
+
+    def put(self, model, text, vector):
+        """写入单条文本的向量"""
+        self.put_many(model, [(text, vector)])
+
+    def _count_existing(self, keys):
+        """统计已存在的键数"""
+        keys = list(set(keys))
+        existing = 0
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            existing += self._conn.execute(
+                f"SELECT COUNT(*) FROM embeddings WHERE key IN ({placeholders})", chunk
+            ).fetchone()[0]
+        return existing
+
+    def _flush_access(self):
+        """把累积的访问时间批量写回数据库（由调用方提交事务）"""
+        if self._pending_access:
+            self._conn.executemany(
+                "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                [(accessed, key) for key, accessed in self._pending_access.items()]
+            )
+            self._pending_access = {}
+        self._last_flush = time.time()
+
+    def _evict(self):
+        """超过容量时删除最久未访问的条目"""
+        overflow = self._count - self.max_entries
+        if overflow > 0:
+            cursor = self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN ("
+                "SELECT key FROM embeddings ORDER BY last_access ASC LIMIT ?)",
+                (overflow,)
+            )
+            self._count -= cursor.rowcount
+
+    def stats(self):
+        """返回缓存统计信息"""
+        with self._lock:
+            size = self._count
+        return {"size": size, "max_entries": self.max_entries, "hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        """写回未保存的访问时间并关闭数据库连接"""
+        with self._lock:
+            self._flush_access()
+            self._conn.commit()
+            self._conn.close()
@@ -0,0 +1,145 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+from metrics import metrics
+
+metrics.describe('rag_embedding_coalesced_requests_total', 'Single-text embedding requests served by coalesced batches')
+metrics.describe('rag_embedding_batches_total', 'Batched embedding calls issued by the coalescer')
+metrics.describe('rag_embedding_batch_texts_total', 'Distinct texts sent in coalesced batches')
+
+class _Batch:
+    """一个正在收集中的批次"""
+
+    def __init__(self, event):
+        self.texts = []
+        self.futures = []
+        self.full = event
+
+
+def _unique_texts(texts):
+    """去重后的文本列表，同一批次中相同的问题只计算一次"""
+    return list(dict.fromkeys(texts))
+
+
+def _record_batch(requests, size):
+    metrics.inc('rag_embedding_coalesced_requests_total', requests)
+    metrics.inc('rag_embedding_batches_total')
+    metrics.inc('rag_embedding_batch_texts_total', size)
+
+
+class EmbeddingCoalescer:
+    """
+    查询嵌入的请求合并器
+    并发到达的单条嵌入请求在一个很短的时间窗口内（或达到批大小上限时）合并成一次批量调用，
+    再把结果分发给各调用方。第一个到达的请求负责等待窗口并发出批量调用，
+    其余请求只需等待结果，单个请求最多多等待一个窗口的时间。
+    """
+
+    def __init__(self, embed_batch, window_ms=3.0, max_batch_size=64):
+        """
+        Args:
+            embed_batch: 批量嵌入函数，参数为文本列表，返回顺序一致的向量列表
+            window_ms: 收集请求的时间窗口（毫秒）
+            max_batch_size: 每批的最大文本数，达到后立即发出
+        """
+        self.embed_batch = embed_batch
+        self.window = window_ms / 1000
+        self.max_batch_size = max_batch_size
+        self._pending = None
+        self._lock = threading.Lock()
+
+    def embed(self, text):
+        """生成单条文本的嵌入向量，与同一窗口内的其他请求合并计算"""
+        future = Future()
+        with self._lock:
+            batch = self._pending
+            leader = batch is None
+            if leader:
+                batch = self._pending = _Batch(threading.Event())
+            batch.texts.append(text)
+            batch.futures.append(future)
+            if len(batch.texts) >= self.max_batch_size:
+                # 批次已满，之后到达的请求开始新的批次
+                self._pending = None
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(self.window)
+            with self._lock:
+                if self._pending is batch:
+                    self._pending = None
+            self._run(batch)
+        return future.result()
+
+    def _run(self, batch):
+        unique = _unique_texts(batch.texts)
+        try:
+            embeddings = dict(zip(unique, self.embed_batch(unique)))
+        except Exception as e:
+            for future in batch.futures:
+                future.set_exception(e)
+            return
+        _record_batch(len(batch.texts), len(unique))
+        for text, future in zip(batch.texts, batch.futures):
+            future.set_result(embeddings[text])
+
+
+class AsyncEmbeddingCoalescer:
+    """
+    EmbeddingCoalescer的异步版本，在同一个事件循环中合并并发的嵌入请求
+    """
+
+    def __init__(self, embed_batch, window_ms=3.0, max_batch_size=64):
+        """
+        Args:
+            embed_batch: 异步批量嵌入函数，参数为文本列表，返回顺序一致的向量列表
+            window_ms: 收集请求的时间窗口（毫秒）
+            max_batch_size: 每批的最大文本数，达到后立即发出
+        """
+        self.embed_batch = embed_batch
+        self.window = window_ms / 1000
+        self.max_batch_size = max_batch_size
+        self._pending = None
+        self._tasks = set()
+
+    async def embed(self, text):
+        """异步生成单条文本的嵌入向量，与同一窗口内的其他请求合并计算"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        batch = self._pending
+        if batch is None:
+            # 批次在独立的任务中发出，发起请求的调用方被取消时不影响其他调用方
+            batch = self._pending = _Batch(asyncio.Event())
+            task = loop.create_task(self._flush(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        batch.texts.append(text)
+        batch.futures.append(future)
+        if len(batch.texts) >= self.max_batch_size:
+            self._pending = None
+            batch.full.set()
+        return await future
+
+    async def _flush(self, batch):
+        """等待时间窗口结束或批次已满后发出批量调用"""
+        try:
+            await asyncio.wait_for(batch.full.wait(), self.window)
+        except asyncio.TimeoutError:
+            pass
+        if self._pending is batch:
+            self._pending = None
+        await self._run(batch)
+
+    async def _run(self, batch):
+        unique = _unique_texts(batch.texts)
+        try:
+            embeddings = dict(zip(unique, await self.embed_batch(unique)))
+        except Exception as e:
+            for future in batch.futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        _record_batch(len(batch.texts), len(unique))
+        for text, future in zip(batch.texts, batch.futures):
+            if not future.done():
+                future.set_result(embeddings[text])
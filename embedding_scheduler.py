@@ -0,0 +1,259 @@
+import asyncio
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from openai import RateLimitError, APIConnectionError, APITimeoutError, InternalServerError
+from resource_pool import FAILURE_ERRORS
+
+# 可重试的错误类型
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError)
+
+
+def estimate_tokens(texts):
+    """粗略估算文本的token数（约4个字符一个token）"""
+    return sum(max(1, len(text) // 4) for text in texts)
+
+
+class RateLimiter:
+    """
+    令牌桶限流器
+    同时限制每分钟请求数和每分钟token数，None表示不限制
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._request_budget = float(requests_per_minute or 0)
+        self._token_budget = float(tokens_per_minute or 0)
+        self._last_refill = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        if self.requests_per_minute:
+            self._request_budget = min(
+                self.requests_per_minute,
+                self._request_budget + elapsed * self.requests_per_minute / 60.0
+            )
+        if self.tokens_per_minute:
+            self._token_budget = min(
+                self.tokens_per_minute,
+                self._token_budget + elapsed * self.tokens_per_minute / 60.0
+            )
+
+    def _try_acquire(self, tokens):
+        """预算足够时扣除并返回0，否则返回需要等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            wait = self._paused_until - now
+            if wait > 0:
+                return wait
+
+            # 单个请求超过整分钟预算时，只要求桶是满的
+            needed_tokens = min(tokens, self.tokens_per_minute or 0)
+            request_wait = 0.0
+            token_wait = 0.0
+            if self.requests_per_minute and self._request_budget < 1:
+                request_wait = (1 - self._request_budget) * 60.0 / self.requests_per_minute
+            if self.tokens_per_minute and self._token_budget < needed_tokens:
+                token_wait = (needed_tokens - self._token_budget) * 60.0 / self.tokens_per_minute
+            wait = max(request_wait, token_wait)
+
+            if wait <= 0:
+                if self.requests_per_minute:
+                    self._request_budget -= 1
+                if self.tokens_per_minute:
+                    self._token_budget -= needed_tokens
+            return wait
+
+    def acquire(self, tokens=0):
+        """
+        阻塞直到预算允许发送一个包含指定token数的请求
+
+        Args:
+            tokens: 本次请求预计消耗的token数
+        """
+        while True:
+            wait = self._try_acquire(tokens)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    async def aacquire(self, tokens=0):
+        """异步版本的acquire，等待时不阻塞事件循环"""
+        while True:
+            wait = self._try_acquire(tokens)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds):
+        """收到429后暂停所有请求一段时间"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class EmbeddingScheduler:
+    """
+    并发嵌入调度器
+    保持多个嵌入批次同时在途，遵守限流预算，并对失败的批次单独重试。
+    同步调用（线程池）和异步调用（aembed）共用同一个限流器，预算按整个进程计算。
+    """
+
+    def __init__(self, client, model, max_concurrency=4, requests_per_minute=None,
+                 tokens_per_minute=None, max_retries=5, backoff_base=1.0, backoff_max=60.0,
+                 timeout=None, circuit_breaker=None):
+        """
+        Args:
+            client: OpenAI客户端
+            model: 嵌入模型名称
+            max_concurrency: 同时在途的最大批次数
+            requests_per_minute: 每分钟请求数上限（None表示不限制）
+            tokens_per_minute: 每分钟token数上限（None表示不限制）
+            max_retries: 单个批次的最大重试次数
+            backoff_base: 指数退避的初始等待秒数
+            backoff_max: 指数退避的最大等待秒数
+            timeout: 单个嵌入请求的超时秒数（None表示使用客户端的默认值）
+            circuit_breaker: 可选的CircuitBreaker，上游持续失败时直接拒绝请求而不再重试
+        """
+        self.client = client
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.request_options = {'timeout': timeout} if timeout is not None else {}
+        self.circuit_breaker = circuit_breaker
+        self.rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="embedding")
+
+    def _backoff_delay(self, attempt, error):
+        """计算重试等待时间，优先使用服务端返回的retry-after"""
+        response = getattr(error, 'response', None)
+        if response is not None:
+            retry_after = response.headers.get('retry-after')
+            try:
+                if retry_after is not None:
+                    return float(retry_after)
+            except ValueError:
+                pass
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return delay * (0.5 + random.random() / 2)
+
+    def _on_success(self, response):
+        if self.circuit_breaker:
+            self.circuit_breaker.record_success()
+        ordered = sorted(response.data, key=lambda item: item.index)
+        return [item.embedding for item in ordered]
+
+    def _on_error(self, attempt, error):
+        """
+        处理失败的请求
+
+        Returns:
+            重试前等待的秒数，不应重试时重新抛出错误
+        """
+        if not isinstance(error, RETRYABLE_ERRORS):
+            # 参数错误等说明上游仍在正常响应，不计入熔断
+            if self.circuit_breaker:
+                self.circuit_breaker.record_success()
+            raise error
+        if self.circuit_breaker and isinstance(error, FAILURE_ERRORS):
+            self.circuit_breaker.record_failure()
+        if attempt >= self.max_retries:
+            raise error
+        delay = self._backoff_delay(attempt, error)
+        if isinstance(error, RateLimitError):
+            # 429表示整体超出配额，暂停所有请求
+            self.rate_limiter.pause(delay)
+        print(f"嵌入请求失败 ({type(error).__name__})，{delay:.1f} 秒后重试 ({attempt + 1}/{self.max_retries})")
+        return delay
+
+    def _embed_batch(self, batch):
+        """发送单个批次，失败时带退避重试"""
+        tokens = estimate_tokens(batch)
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire(tokens)
+            if self.circuit_breaker:
+                self.circuit_breaker.check()
+            try:
+                response = self.client.embeddings.create(model=self.model, input=batch, **self.request_options)
+            except Exception as e:
+                time.sleep(self._on_error(attempt, e))
+                continue
+            return self._on_success(response)
+
+    async def _aembed_batch(self, client, batch):
+        """异步发送单个批次，限流等待和退避都不阻塞事件循环"""
+        tokens = estimate_tokens(batch)
+        for attempt in range(self.max_retries + 1):
+            await self.rate_limiter.aacquire(tokens)
+            if self.circuit_breaker:
+                self.circuit_breaker.check()
+            try:
+                response = await client.embeddings.create(model=self.model, input=batch, **self.request_options)
+            except Exception as e:
+                await asyncio.sleep(self._on_error(attempt, e))
+                continue
+            return self._on_success(response)
+
+    def embed(self, texts, batch_size, progress_callback=None):
+        """
+        并发生成嵌入向量
+
+        Args:
+            texts: 文本列表
+            batch_size: 每个请求包含的文本数
+            progress_callback: 每完成一个批次时调用，参数为该批次的文本数
+
+        Returns:
+            与输入顺序一致的嵌入向量列表
+        """
+        batches = [texts[start:start + batch_size] for start in range(0, len(texts), batch_size)]
+        results = [None] * len(batches)
+        futures = {self._executor.submit(self._embed_batch, batch): i for i, batch in enumerate(batches)}
+
+        errors = []
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                results[index] = future.result()
+            except Exception as e:
+                errors.append(e)
+                continue
+            if progress_callback:
+                progress_callback(len(batches[index]))
+
+        if errors:
+            raise errors[0]
+        return [embedding for batch in results for embedding in batch]
+
+    async def aembed(self, client, texts, batch_size):
+        """
+        异步并发生成嵌入向量，同时在途的批次数不超过max_concurrency
+
+        Args:
+            client: AsyncOpenAI客户端
+            texts: 文本列表
+            batch_size: 每个请求包含的文本数
+
+        Returns:
+            与输入顺序一致的嵌入向量列表
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def embed_batch(batch):
+            async with semaphore:
+                return await self._aembed_batch(client, batch)
+
+        batches = [texts[start:start + batch_size] for start in range(0, len(texts), batch_size)]
+        results = await asyncio.gather(*(embed_batch(batch) for batch in batches))
+        return [embedding for batch in results for embedding in batch]
+
+    def close(self):
+        """关闭线程池"""
+        self._executor.shutdown(wait=False)
@@ -3,7 +3,11 @@ import os
 import argparse
 import json
 import socket
-from llm_client import LLMClient
+import threading
+import time
+from llm_client import AsyncLLMClient
+from resource_pool import SharedResourcePool, make_key
+from ingestion_jobs import IngestionJobManager
 import glob
 
 def load_config(config_path='config.json'):
@@ -19,6 +23,13 @@ def find_pdf_files(directory='.'):
     """查找指定目录中的所有PDF文件"""
     return [os.path.basename(f) for f in glob.glob(os.path.join(directory, "*.pdf"))]
 
+def enable_queue(demo, concurrency_limit):
+    """启用请求队列并限制并发处理数，兼容Gradio 3.x和4.x"""
+    try:
+        demo.queue(default_concurrency_limit=concurrency_limit)
+    except TypeError:
+        demo.queue(concurrency_count=concurrency_limit)
+
 def find_available_port(start_port=7860, max_attempts=20):
     """查找可用端口"""
     for port in range(start_port, start_port + max_attempts):
@@ -30,15 +41,93 @@ def find_available_port(start_port=7860, max_attempts=20):
                 continue
     return start_port
 
-# 全局客户端实例
-client = None
+# 按配置共享的客户端池：相同配置的会话共享同一个客户端
+client_pool = SharedResourcePool()
 
-def init_client(api_key, base_url, model, use_rag, collection_name, milvus_uri):
-    """初始化LLM客户端"""
-    global client
+class SessionClients:
+    """
+    记录每个会话（按Gradio的session_hash区分）使用的客户端键
+    每个会话持有所用客户端的一个引用，页面关闭（支持unload的Gradio版本）或超过ttl_seconds
+    未使用时释放。Gradio 3.x的gr.State没有delete_callback，无法得知会话结束，只能按最后使用时间过期。
+    """
+    
+    def __init__(self, pool, ttl_seconds=1800):
+        self.pool = pool
+        self.ttl_seconds = ttl_seconds
+        self._sessions = {}
+        self._lock = threading.Lock()
+    
+    def assign(self, session_id, key):
+        """会话改用新的客户端键（调用方已获取该键的引用），释放会话之前的引用"""
+        self.expire()
+        with self._lock:
+            previous = self._sessions.get(session_id)
+            self._sessions[session_id] = [key, time.monotonic()]
+        if previous:
+            self.pool.release(previous[0])
+    
+    def get(self, session_id):
+        """返回会话的客户端键并刷新最后使用时间，未初始化或已过期时返回None"""
+        self.expire()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            entry[1] = time.monotonic()
+            return entry[0]
     
-    # 创建临时配置
-    temp_config = {
+    def release(self, session_id):
+        """会话结束，释放其客户端引用，最后一个使用者释放后关闭客户端"""
+        with self._lock:
+            entry = self._sessions.pop(session_id, None)
+        if entry:
+            self.pool.release(entry[0])
+    
+    def expire(self):
+        """释放超过ttl_seconds未使用的会话"""
+        deadline = time.monotonic() - self.ttl_seconds
+        with self._lock:
+            expired = [session_id for session_id, (_, last_used) in self._sessions.items() if last_used < deadline]
+            entries = [self._sessions.pop(session_id) for session_id in expired]
+        for key, _ in entries:
+            self.pool.release(key)
+    
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+session_clients = SessionClients(client_pool)
+
+def session_id(request):
+    """请求所属会话的标识，不经Gradio调用时所有调用共用一个会话"""
+    return getattr(request, 'session_hash', None)
+
+def get_client(request=None):
+    """获取会话对应的客户端，未初始化或已过期时返回None"""
+    client_key = session_clients.get(session_id(request))
+    return client_pool.get(client_key) if client_key else None
+
+def release_session(request: gr.Request = None):
+    """页面关闭时释放会话的客户端"""
+    session_clients.release(session_id(request))
+
+# 后台数据导入任务：加载数据只提交任务，由工作线程执行，不占用Gradio的请求处理
+ingestion_jobs = IngestionJobManager()
+
+# 任务状态面板的列
+JOB_HEADERS = ["任务ID", "文件", "状态", "解析(页)", "分块", "嵌入", "写入", "耗时(秒)", "信息"]
+JOB_STATES = {
+    "queued": "排队中",
+    "running": "运行中",
+    "succeeded": "已完成",
+    "failed": "失败",
+    "cancelled": "已取消",
+}
+
+def init_client(api_key, base_url, model, use_rag, collection_name, milvus_uri, request: gr.Request = None):
+    """初始化当前会话的LLM客户端"""
+    # 会话配置
+    session_config = {
         "api_key": api_key,
         "base_url": base_url,
         "model": model,
@@ -50,55 +139,121 @@ def init_client(api_key, base_url, model, use_rag, collection_name, milvus_uri):
             }
         }
     }
+    new_key = make_key('llm_client', session_config)
     
-    # 保存临时配置
-    with open("temp_config.json", "w") as f:
-        json.dump(temp_config, f, indent=4)
-    
-    # 初始化客户端
+    # 初始化客户端（相同配置直接复用已有客户端）
     try:
-        client = LLMClient(
-            config_path="temp_config.json",
+        client_pool.acquire(new_key, lambda: AsyncLLMClient(
+            config=session_config,
             use_rag=use_rag,
             model=model,
             api_key=api_key
-        )
-        return "客户端初始化成功！" + ("RAG系统已启用。" if use_rag else "RAG系统未启用。")
+        ))
     except Exception as e:
         return f"初始化客户端时出错: {str(e)}"
+    
+    # 会话改用新客户端，释放之前使用的客户端
+    session_clients.assign(session_id(request), new_key)
+    return "客户端初始化成功！" + ("RAG系统已启用。" if use_rag else "RAG系统未启用。")
 
-def load_data(pdf_file, force_rebuild):
-    """加载数据到RAG系统"""
-    global client
+def load_data(pdf_file, force_rebuild, request: gr.Request = None):
+    """提交后台数据导入任务，立即返回任务ID"""
+    client_key = session_clients.get(session_id(request))
+    client = client_pool.get(client_key) if client_key else None
     
     if not client:
-        return "请先初始化客户端"
+        return "请先初始化客户端", list_jobs()
         
     if not client.use_rag:
-        return "RAG系统未启用，无法加载数据"
-        
-    try:
-        client.rag_system.load_data(pdf_file, force_rebuild=force_rebuild)
-        return f"成功加载PDF: {pdf_file}" + (" (强制重建)" if force_rebuild else "")
-    except Exception as e:
-        return f"加载数据时出错: {str(e)}"
+        return "RAG系统未启用，无法加载数据", list_jobs()
+    
+    # 提交时即持有客户端的引用，任务排队或运行期间会话重新初始化也不会关闭客户端
+    client_pool.acquire(client_key, lambda: client)
+    
+    def run(progress_callback, cancel_event):
+        try:
+            return client.rag_system.load_data(
+                pdf_file, force_rebuild=force_rebuild,
+                progress_callback=progress_callback, cancel_event=cancel_event
+            )
+        finally:
+            client_pool.release(client_key)
+    
+    job = ingestion_jobs.submit(
+        run, pdf_file + (" (强制重建)" if force_rebuild else ""),
+        on_cancelled=lambda: client_pool.release(client_key)
+    )
+    return f"已提交导入任务 {job.id}: {pdf_file}", list_jobs()
+
+def _format_stage(progress, total=None):
+    """阶段进度：已完成数/总数，总数未知时只显示已完成数"""
+    total = progress["total"] if progress["total"] is not None else total
+    return f"{progress['done']}/{total}" if total else str(progress["done"])
+
+def _job_message(job):
+    if job["error"]:
+        return job["error"]
+    if job["state"] != "succeeded":
+        return ""
+    result = job["result"]
+    if result is None:
+        return "文档未变化，已跳过"
+    return f"新增 {result['inserted']} 条，删除 {result['deleted']} 条，未变化 {result['unchanged']} 条"
+
+def list_jobs():
+    """导入任务状态表，最新提交的在前"""
+    rows = []
+    for job in ingestion_jobs.jobs():
+        job = job.snapshot()
+        progress = job["progress"]
+        # 嵌入和写入的总数即为已分出的块数
+        chunks = progress["split"]["done"]
+        rows.append([
+            job["id"],
+            job["description"],
+            JOB_STATES.get(job["state"], job["state"]),
+            _format_stage(progress["parse"]),
+            _format_stage(progress["split"]),
+            _format_stage(progress["embed"], chunks),
+            _format_stage(progress["insert"], chunks),
+            f"{job['elapsed']:.1f}",
+            _job_message(job),
+        ])
+    return rows
 
-def process_message(message, history):
-    """处理用户消息"""
-    global client
+def cancel_job(job_id):
+    """取消导入任务"""
+    job_id = (job_id or "").strip()
+    if not job_id:
+        return "请输入任务ID", list_jobs()
+    job = ingestion_jobs.get(job_id)
+    if job is None:
+        return f"任务 {job_id} 不存在", list_jobs()
+    if not job.cancel():
+        return f"任务 {job_id} 已结束", list_jobs()
+    if job.finished:
+        return f"已取消排队中的任务 {job_id}", list_jobs()
+    return f"已请求取消任务 {job_id}，当前批次完成后停止", list_jobs()
+
+async def process_message(message, history, request: gr.Request = None):
+    """处理用户消息，流式更新聊天记录（在Gradio的事件循环中异步执行）"""
+    client = get_client(request)
     
     if not client:
-        return history + [(message, "请先初始化客户端后再提问")]
+        yield history + [(message, "请先初始化客户端后再提问")]
+        return
         
+    response = ""
     try:
-        response = client.call_llm(message)
-        return history + [(message, response)]
+        async for delta in client.astream_llm(message):
+            response += delta
+            yield history + [(message, response)]
     except Exception as e:
-        return history + [(message, f"处理消息时出错: {str(e)}")]
+        yield history + [(message, f"处理消息时出错: {str(e)}")]
 
-def list_tools():
+def list_tools(request: gr.Request = None):
     """列出可用的工具"""
-    global client
+    client = get_client(request)
     
     if not client:
         return "请先初始化客户端"
@@ -107,9 +262,9 @@ def list_tools():
     tool_list = "\n".join([f"- {name}: {desc}" for name, desc in tools])
     return f"可用工具列表:\n{tool_list}"
 
-def execute_tool(tool_command, query):
+async def execute_tool(tool_command, query, request: gr.Request = None):
     """执行工具命令"""
-    global client
+    client = get_client(request)
     
     if not client:
         return "请先初始化客户端"
@@ -120,7 +275,7 @@ def execute_tool(tool_command, query):
     try:
         result, requires_llm = client.tool_manager.execute_tool(tool_command, query=query, tool_manager=client.tool_manager)
         if requires_llm and client:
-            result = client.call_llm(result)
+            result = await client.acall_llm(result)
         return result
     except Exception as e:
         return f"执行工具命令时出错: {str(e)}"
@@ -142,6 +297,9 @@ def create_simple_ui():
     default_use_rag = rag_config.get('enabled', False)
     default_collection_name = rag_config.get('milvus', {}).get('collection_name', 'rag_collection')
     default_uri = rag_config.get('milvus', {}).get('uri', 'http://localhost:19530')
+    gradio_config = config.get('gradio', {})
+    ingestion_jobs.workers = gradio_config.get('ingestion_workers', 1)
+    session_clients.ttl_seconds = gradio_config.get('session_ttl_seconds', 1800)
     
     # 查找PDF文件
     pdf_files = find_pdf_files()
@@ -181,11 +339,26 @@ def create_simple_ui():
             load_btn = gr.Button("加载数据")
             load_output = gr.Textbox(label="加载状态", interactive=False)
             
+            # 导入任务在后台运行，这里显示各阶段的进度
+            jobs_table = gr.Dataframe(headers=JOB_HEADERS, value=list_jobs(), label="导入任务", interactive=False)
+            refresh_jobs_btn = gr.Button("刷新任务状态")
+            job_id = gr.Textbox(label="任务ID")
+            cancel_btn = gr.Button("取消任务")
+            
             load_btn.click(
                 fn=load_data,
                 inputs=[pdf_file, force_rebuild],
-                outputs=load_output
+                outputs=[load_output, jobs_table]
             )
+            refresh_jobs_btn.click(fn=list_jobs, outputs=jobs_table)
+            cancel_btn.click(fn=cancel_job, inputs=job_id, outputs=[load_output, jobs_table])
+            
+            # 定时刷新任务进度：新版Gradio使用gr.Timer，旧版（如3.x）使用带every参数的load事件
+            job_refresh_seconds = gradio_config.get('job_refresh_seconds', 2)
+            if hasattr(gr, 'Timer'):
+                gr.Timer(job_refresh_seconds).tick(fn=list_jobs, outputs=jobs_table)
+            else:
+                demo.load(fn=list_jobs, outputs=jobs_table, every=job_refresh_seconds)
         
         with gr.Tab("聊天"):
             chatbot = gr.Chatbot(type="messages")  # 修改为推荐的格式
@@ -240,7 +413,7 @@ def create_simple_ui():
             ### 使用说明:
             
             1. **设置**: 配置API密钥和RAG系统参数
-            2. **数据加载**: 选择PDF文件并加载到向量数据库
+            2. **数据加载**: 选择PDF文件并在后台导入向量数据库，可查看进度或取消任务
             3. **聊天**: 与基于RAG的AI系统交互
             4. **工具**: 使用和测试系统提供的工具
             
@@ -250,6 +423,13 @@ def create_simple_ui():
             - RAG系统需要先加载数据才能基于文档回答问题
             """)
     
+        # 每个会话的客户端按session_hash记录；支持unload的Gradio版本在页面关闭时立即释放，
+        # 否则在超过session_ttl_seconds未使用后释放
+        if hasattr(demo, 'unload'):
+            demo.unload(release_session)
+    
+    # 启用队列，生成器处理函数需要队列才能流式返回，并限制同时处理的请求数
+    enable_queue(demo, gradio_config.get('concurrency_limit', 16))
     return demo
 
 if __name__ == "__main__":
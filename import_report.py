@@ -0,0 +1,80 @@
+import os
+import sys
+import argparse
+import subprocess
+
+
+# 默认分析的入口模块
+DEFAULT_MODULES = ('llm_client', 'rag_system')
+
+
+def measure_imports(module):
+    """
+    在新的解释器进程中用 -X importtime 导入模块，统计冷启动导入耗时
+
+    Args:
+        module: 要导入的模块名
+
+    Returns:
+        dict: total（导入该模块的总耗时，秒）和 dependencies
+              （直接依赖的模块名及其累计耗时，按耗时从大到小排序）
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        error = result.stderr.strip().splitlines()
+        raise RuntimeError(f"导入 {module} 失败: {error[-1] if error else result.returncode}")
+
+    total = 0.0
+    dependencies = []
+    # 子模块的记录先于其父模块输出，遇到顶层模块时才知道之前的直接依赖属于谁
+    pending = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        cumulative = int(parts[1]) / 1e6
+        # 模块名前的缩进表示嵌套层级（每层两个空格）
+        name = parts[2][1:]
+        level = (len(name) - len(name.lstrip(' '))) // 2
+        name = name.strip()
+        if level == 0:
+            if name == module:
+                total = cumulative
+                dependencies = pending
+            pending = []
+        elif level == 1:
+            pending.append((name, cumulative))
+    dependencies.sort(key=lambda item: item[1], reverse=True)
+    return {"total": total, "dependencies": dependencies}
+
+
+def print_import_report(modules=DEFAULT_MODULES, top=10):
+    """打印各入口模块的冷启动导入耗时和最慢的直接依赖"""
+    print("冷启动导入耗时（每个模块在新进程中单独测量）:")
+    for module in modules:
+        try:
+            report = measure_imports(module)
+        except RuntimeError as e:
+            print(f"  {str(e)}")
+            continue
+        print(f"\n  {module}: {report['total'] * 1000:.0f} ms")
+        for name, seconds in report['dependencies'][:top]:
+            print(f"    {name:<40} {seconds * 1000:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分析模块的冷启动导入耗时")
+    parser.add_argument("modules", type=str, nargs='*', default=list(DEFAULT_MODULES), help="要分析的模块")
+    parser.add_argument("--top", type=int, default=10, help="显示的依赖数")
+    args = parser.parse_args()
+    print_import_report(args.modules, args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from rag_system import JobCancelled
+
+
+# 数据导入的各个阶段（解析、分块、生成嵌入、写入向量库）
+STAGES = ('parse', 'split', 'embed', 'insert')
+
+# 任务状态
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+
+class IngestionJob:
+    """
+    一个后台导入任务
+    导入函数通过progress_callback上报各阶段的进度，并在检查点查看cancel_event决定是否停止
+    """
+
+    def __init__(self, func, description='', on_cancelled=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.description = description
+        self.state = QUEUED
+        self.progress = {stage: {"done": 0, "total": None} for stage in STAGES}
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+        self._func = func
+        self._on_cancelled = on_cancelled
+        self._lock = threading.Lock()
+
+    def update(self, stage, count, total=None):
+        """
+        记录阶段进度
+
+        Args:
+            stage: 阶段名
+            count: 新完成的数量
+            total: 该阶段的总数（None表示不变）
+        """
+        with self._lock:
+            progress = self.progress.setdefault(stage, {"done": 0, "total": None})
+            progress["done"] += count
+            if total is not None:
+                progress["total"] = total
+
+    def cancel(self):
+        """
+        请求取消任务：排队中的任务直接取消，运行中的任务在下一个检查点停止
+
+        Returns:
+            bool: 任务是否还未结束
+        """
+        with self._lock:
+            if self.finished:
+                return False
+            self.cancel_event.set()
+            if self.state != QUEUED:
+                return True
+            self.state = CANCELLED
+            self.finished_at = time.time()
+            on_cancelled, self._on_cancelled = self._on_cancelled, None
+            self._func = None
+        if on_cancelled:
+            on_cancelled()
+        return True
+
+    @property
+    def finished(self):
+        return self.state in (SUCCEEDED, FAILED, CANCELLED)
+
+    @property
+    def elapsed(self):
+        """已运行的秒数，未开始时为0"""
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+    def run(self):
+        """在工作线程中执行任务"""
+        with self._lock:
+            if self.state != QUEUED:
+                return
+            self.state = RUNNING
+            self.started_at = time.time()
+            # 已开始执行，资源由导入函数自己释放
+            self._on_cancelled = None
+        try:
+            result = self._func(self.update, self.cancel_event)
+            state, error = SUCCEEDED, None
+        except JobCancelled:
+            result, state, error = None, CANCELLED, None
+        except Exception as e:
+            result, state, error = None, FAILED, str(e)
+        with self._lock:
+            self.result = result
+            self.error = error
+            self.state = state
+            self.finished_at = time.time()
+            # 释放导入函数引用的客户端等对象
+            self._func = None
+
+    def snapshot(self):
+        """返回任务当前状态的副本，供界面显示"""
+        with self._lock:
+            return {
+                "id": self.id,
+                "description": self.description,
+                "state": self.state,
+                "progress": {stage: dict(progress) for stage, progress in self.progress.items()},
+                "result": self.result,
+                "error": self.error,
+                "created_at": self.created_at,
+                "elapsed": self.elapsed,
+            }
+
+
+class IngestionJobManager:
+    """
+    后台数据导入任务队列
+    任务按提交顺序由固定数量的工作线程执行，提交后立即返回任务ID，
+    调用方（如Gradio界面）随时查询进度或取消任务，不占用请求处理线程。
+    工作线程与聊天请求共享进程内的RAG系统、嵌入缓存和向量库连接，
+    PDF解析等耗时步骤在后台进行，聊天请求不受影响。
+    """
+
+    def __init__(self, workers=1, max_history=50):
+        """
+        Args:
+            workers: 工作线程数（同时运行的导入任务数），在第一次提交任务时启动
+            max_history: 最多保留的已结束任务数
+        """
+        self.workers = workers
+        self.max_history = max_history
+        self._jobs = OrderedDict()
+        self._queue = queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def submit(self, func, description='', on_cancelled=None):
+        """
+        提交导入任务
+
+        Args:
+            func: 导入函数，参数为(progress_callback, cancel_event)，返回值作为任务结果；
+                  progress_callback的参数为(stage, count, total=None)，
+                  发现cancel_event已设置时应抛出JobCancelled
+            description: 任务描述（如文件名）
+            on_cancelled: 任务在排队中被取消、导入函数不会执行时调用，用于释放提交时获取的资源
+
+        Returns:
+            IngestionJob: 新任务
+        """
+        job = IngestionJob(func, description, on_cancelled)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(
+                    target=self._worker, name=f"ingestion-worker-{len(self._threads)}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+        self._queue.put(job)
+        return job
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            job.run()
+
+    def _prune(self):
+        """删除超出保留数量的最早结束的任务"""
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.max_history)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        """按ID获取任务，不存在返回None"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self):
+        """所有任务，最新提交的在前"""
+        with self._lock:
+            return list(reversed(self._jobs.values()))
+
+    def cancel(self, job_id):
+        """
+        取消任务
+
+        Returns:
+            bool: 任务存在且尚未结束
+        """
+        job = self.get(job_id)
+        return job.cancel() if job else False
+
+    def shutdown(self, cancel_pending=True):
+        """停止工作线程，cancel_pending为True时取消所有未结束的任务"""
+        if cancel_pending:
+            for job in self.jobs():
+                job.cancel()
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(None)
+        for thread in threads:
+            thread.join()
@@ -3,6 +3,8 @@ import json
 import argparse
 from pymilvus import MilvusClient
 from rag_system import RAGSystem
+from vector_store import create_vector_store
+from resource_pool import shared_resources, make_key, RetryPolicy
 import sys
 import time
 from pathlib import Path
@@ -16,27 +18,39 @@ def load_config(config_path='config.json'):
         print(f"警告: 无法加载配置文件 {config_path}: {str(e)}")
         return {}
 
-def check_milvus_connection(uri, user='', password='', max_retries=5, retry_interval=2):
-    """检查是否可以连接到Milvus服务器"""
+def check_milvus_connection(uri, user='', password='', max_retries=5, retry_interval=2, timeout=None):
+    """
+    检查是否可以连接到Milvus服务器
+    连接成功的客户端保留在共享资源池中，随后创建的RAGSystem直接复用同一个连接
+    """
     print(f"正在尝试连接到Milvus服务器: {uri}")
     
     milvus_params = {'uri': uri}
     if user:
         milvus_params['user'] = user
         milvus_params['password'] = password
+    if timeout:
+        milvus_params['timeout'] = timeout
+    key = make_key('milvus', milvus_params)
+    backoff = RetryPolicy(base_delay=retry_interval, max_delay=retry_interval * 8)
     
     for i in range(max_retries):
         try:
-            client = MilvusClient(**milvus_params)
-            # 执行一个简单的操作来验证连接
-            client.list_collections()
+            client = shared_resources.acquire(key, lambda: MilvusClient(**milvus_params))
+            try:
+                # 执行一个简单的操作来验证连接
+                client.list_collections()
+            except Exception:
+                shared_resources.release(key)
+                raise
             print("Milvus连接成功!")
             return client
         except Exception as e:
             print(f"尝试 {i+1}/{max_retries} 连接失败: {str(e)}")
             if i < max_retries - 1:
-                print(f"等待 {retry_interval} 秒后重试...")
-                time.sleep(retry_interval)
+                delay = backoff.delay(i)
+                print(f"等待 {delay:.1f} 秒后重试...")
+                time.sleep(delay)
     
     print("无法连接到Milvus服务器，请检查服务是否运行以及URI是否正确")
     return None
@@ -80,7 +94,8 @@ def list_pdf_options(pdf_files):
             print("\n操作已取消")
             return None
 
-def initialize_system(config_path='config.json', pdf_path=None, auto_select=False, search_dir='.', force_rebuild=False):
+def initialize_system(config_path='config.json', pdf_path=None, auto_select=False, search_dir='.', force_rebuild=False,
+                      bulk=False, workers=None):
     """初始化RAG系统"""
     # 加载配置文件
     config = load_config(config_path)
@@ -93,10 +108,25 @@ def initialize_system(config_path='config.json', pdf_path=None, auto_select=Fals
     milvus_password = milvus_config.get('password', '')
     collection_name = milvus_config.get('collection_name', 'rag_collection')
     
-    # 测试Milvus连接
-    milvus_client = check_milvus_connection(milvus_uri, milvus_user, milvus_password)
-    if not milvus_client:
-        return False
+    # 本地索引无需连接外部服务，Milvus则先测试连接
+    backend = rag_config.get('vector_store', {}).get('backend', 'milvus')
+    if backend == 'local':
+        # 与RAGSystem使用相同的资源键，随后创建的RAGSystem复用同一个实例，
+        # 避免两个实例同时写同一目录下的向量文件和日志
+        store_params = {'backend': backend, 'local': rag_config.get('local_index', {})}
+        milvus_client = shared_resources.acquire(
+            make_key('vector_store', store_params), lambda: create_vector_store(rag_config)
+        )
+    else:
+        milvus_client = check_milvus_connection(
+            milvus_uri, milvus_user, milvus_password, timeout=milvus_config.get('timeout')
+        )
+        if not milvus_client:
+            return False
+    
+    # 批量模式：非交互地导入目录树中的所有PDF
+    if bulk:
+        return bulk_ingest(config_path, search_dir, force_rebuild=force_rebuild, workers=workers)
     
     # 检查集合是否存在
     collection_exists = milvus_client.has_collection(collection_name)
@@ -150,6 +180,20 @@ def initialize_system(config_path='config.json', pdf_path=None, auto_select=Fals
         print(f"初始化RAG系统时出错: {str(e)}")
         return False
 
+def bulk_ingest(config_path='config.json', search_dir='.', force_rebuild=False, workers=None):
+    """将目录树中的所有PDF导入同一个集合"""
+    try:
+        print(f"批量导入目录: {search_dir}")
+        rag_system = RAGSystem(config_path=config_path)
+        totals = rag_system.load_directory(search_dir, force_rebuild=force_rebuild, max_workers=workers)
+        if totals is None:
+            return False
+        print("\n初始化完成！系统已准备就绪")
+        return totals['failed'] == 0
+    except Exception as e:
+        print(f"批量导入时出错: {str(e)}")
+        return False
+
 def main():
     parser = argparse.ArgumentParser(description="Milvus RAG系统初始化工具")
     parser.add_argument("--config", type=str, default="config.json", help="配置文件路径")
@@ -157,6 +201,8 @@ def main():
     parser.add_argument("--auto", action="store_true", help="自动选择第一个找到的PDF文件")
     parser.add_argument("--dir", type=str, default=".", help="搜索PDF文件的目录")
     parser.add_argument("--force-rebuild", action="store_true", help="强制重建集合，即使已存在")
+    parser.add_argument("--bulk", action="store_true", help="非交互地导入--dir目录树中的所有PDF文件")
+    parser.add_argument("--workers", type=int, help="批量模式下解析PDF的进程数（默认为CPU核心数）")
     args = parser.parse_args()
     
     success = initialize_system(
@@ -164,7 +210,9 @@ def main():
         pdf_path=args.pdf,
         auto_select=args.auto,
         search_dir=args.dir,
-        force_rebuild=args.force_rebuild
+        force_rebuild=args.force_rebuild,
+        bulk=args.bulk,
+        workers=args.workers
     )
     
     if not success:
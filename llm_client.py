@@ -1,11 +1,22 @@
 import os
 import json
-from openai import OpenAI
-from rag_system import RAGSystem
+import time
+import asyncio
+import threading
+from rag_system import RAGSystem, AsyncRAGSystem
+from semantic_cache import SemanticCache
+from context_builder import TokenCounter
+from metrics import metrics, configure_metrics
+from resource_pool import (
+    shared_resources, make_key, create_openai_client, create_retry_policy, openai_resource_params
+)
 from tools.tool_manager import ToolManager
 
 class LLMClient:
-    def __init__(self, config_path='config.json', use_rag=None, model=None, api_key=None):
+    # 使用的RAG系统实现，子类可以替换
+    rag_system_class = RAGSystem
+    
+    def __init__(self, config_path='config.json', use_rag=None, model=None, api_key=None, config=None):
         """
         初始化LLM客户端
         
@@ -14,14 +25,26 @@ class LLMClient:
             use_rag: 是否使用RAG系统（None表示使用配置文件中的设置）
             model: 要使用的OpenAI模型ID（None表示使用配置文件中的模型）
             api_key: OpenAI API密钥（None表示使用配置文件中的密钥）
+            config: 可选的配置字典（提供时不再读取配置文件）
         """
+        self._resource_keys = []
+        self.config_path = config_path
+        self._rag_system = None
+        self._tool_manager = None
+        self._rag_lock = threading.Lock()
+        self._tool_lock = threading.Lock()
+        self._token_counter = None
+        
         # 加载配置文件
-        try:
-            with open(config_path, 'r') as f:
-                self.config = json.load(f)
-        except Exception as e:
-            print(f"无法加载配置文件: {str(e)}")
-            self.config = {}
+        if config is not None:
+            self.config = config
+        else:
+            try:
+                with open(config_path, 'r') as f:
+                    self.config = json.load(f)
+            except Exception as e:
+                print(f"无法加载配置文件: {str(e)}")
+                self.config = {}
         
         # 优先使用传入的参数，如果没有传入则使用配置文件中的值
         self.api_key = api_key or self.config.get('api_key')
@@ -35,27 +58,82 @@ class LLMClient:
         else:
             self.use_rag = use_rag
         
+        # 按配置启动指标导出（Prometheus端点、JSONL追踪日志）
+        configure_metrics(self.config.get('metrics', {}))
+        
         # 初始化OpenAI客户端
-        client_params = {'api_key': self.api_key}
+        self.client_params = {'api_key': self.api_key}
         if self.base_url:
-            client_params['base_url'] = self.base_url
+            self.client_params['base_url'] = self.base_url
         if self.organization:
-            client_params['organization'] = self.organization
+            self.client_params['organization'] = self.organization
             
-        self.client = OpenAI(**client_params)
-        
-        # 如果启用RAG，初始化RAG系统
-        if self.use_rag:
-            self.rag_system = RAGSystem(
-                config_path=config_path,
-                api_key=self.api_key, 
-                base_url=self.base_url, 
-                organization=self.organization
+        # 连接池、超时、重试和熔断设置，与RAG系统的嵌入请求共用同一个客户端和熔断器
+        self.http_config = self.config.get('http', {})
+        self.chat_timeout = self.http_config.get('timeouts', {}).get('chat', self.http_config.get('timeout', 60.0))
+        self.retry_policy = create_retry_policy(self.http_config, self.base_url or 'api.openai.com')
+        self.client = self._acquire_shared(
+            'openai', openai_resource_params(self.client_params, self.http_config),
+            lambda: create_openai_client(self.client_params, self.http_config)
+        )
+        
+        # RAG系统（向量存储连接、嵌入模型）和工具在首次使用时才初始化，见rag_system和tool_manager属性
+        
+        # 语义回答缓存：相似问题且检索到相同上下文时复用之前的回答
+        self.semantic_cache = None
+        semantic_cache_config = self.config.get('rag', {}).get('semantic_cache', {})
+        if self.use_rag and semantic_cache_config.get('enabled', False):
+            self.semantic_cache = SemanticCache(
+                similarity_threshold=semantic_cache_config.get('similarity_threshold', 0.95),
+                max_entries=semantic_cache_config.get('max_entries', 256),
+                ttl_seconds=semantic_cache_config.get('ttl_seconds', 3600)
             )
-            
-        # 初始化工具管理器
-        self.tool_manager = ToolManager()
-        self.tool_manager.load_tools_from_directory()
+    
+    @property
+    def rag_system(self):
+        """RAG系统，首次访问时初始化（未启用RAG时为None）"""
+        if self._rag_system is None and self.use_rag:
+            with self._rag_lock:
+                if self._rag_system is None:
+                    self._rag_system = self.rag_system_class(
+                        config_path=self.config_path,
+                        api_key=self.api_key, 
+                        base_url=self.base_url, 
+                        organization=self.organization,
+                        config=self.config
+                    )
+        return self._rag_system
+    
+    @property
+    def tool_manager(self):
+        """工具管理器，首次调用工具时才加载tools目录下的工具"""
+        if self._tool_manager is None:
+            with self._tool_lock:
+                if self._tool_manager is None:
+                    tool_manager = ToolManager()
+                    tool_manager.load_tools_from_directory()
+                    self._tool_manager = tool_manager
+        return self._tool_manager
+    
+    def warm_up(self):
+        """提前初始化RAG系统和工具，避免首个请求承担初始化耗时"""
+        self.rag_system
+        self.tool_manager
+    
+    def _acquire_shared(self, kind, params, factory):
+        """从共享资源池获取资源，并记录以便close()时释放"""
+        key = make_key(kind, params)
+        resource = shared_resources.acquire(key, factory)
+        self._resource_keys.append(key)
+        return resource
+    
+    def close(self):
+        """释放本客户端及其RAG系统持有的共享资源引用"""
+        if self._rag_system:
+            self._rag_system.close()
+        for key in self._resource_keys:
+            shared_resources.release(key)
+        self._resource_keys = []
     
     def call_llm(self, prompt, max_tokens=1000):
         """
@@ -68,29 +146,179 @@ class LLMClient:
         Returns:
             生成的回复文本
         """
-        # 检查是否是工具调用
-        if prompt.startswith('/'):
-            # 解析命令和参数
-            parts = prompt.strip().split(' ', 1)
-            command = parts[0]
-            query = parts[1] if len(parts) > 1 else ""
+        with metrics.trace('call_llm') as trace:
+            # 检查是否是工具调用
+            if prompt.startswith('/'):
+                result, requires_llm = self._execute_tool(prompt)
+                
+                # 如果工具需要LLM处理，将结果传递给LLM
+                if requires_llm:
+                    return self.call_llm(result, max_tokens)
+                else:
+                    # 否则直接返回结果
+                    return result
             
-            # 执行工具
-            result, requires_llm = self.tool_manager.execute_tool(command, query=query, tool_manager=self.tool_manager)
+            messages, cache_key, cached_answer = self._prepare_request(prompt)
+            if cached_answer is not None:
+                trace.set('semantic_cache_hit', True)
+                return cached_answer
+            
+            # 使用OpenAI生成回答
+            with metrics.span('llm_total'):
+                response = self.retry_policy.call(
+                    self.client.chat.completions.create,
+                    model=self.model,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    timeout=self.chat_timeout
+                )
+            answer = response.choices[0].message.content
+            self._record_usage(response.usage, messages, answer)
+            self._remember_answer(cache_key, answer)
+            return answer
+    
+    def stream_llm(self, prompt, max_tokens=1000):
+        """
+        以流式方式调用OpenAI语言模型，逐段产出生成的文本
+        
+        Args:
+            prompt: 提示文本
+            max_tokens: 生成的最大token数
             
-            # 如果工具需要LLM处理，将结果传递给LLM
+        Yields:
+            回复文本的增量片段
+        """
+        # 生成器可能在不同的线程或上下文中恢复执行，追踪记录只在每一步执行期间生效
+        return metrics.trace_generator('stream_llm', self._stream_llm(prompt, max_tokens))
+    
+    def _stream_llm(self, prompt, max_tokens):
+        # 检查是否是工具调用
+        if prompt.startswith('/'):
+            result, requires_llm = self._execute_tool(prompt)
             if requires_llm:
-                return self.call_llm(result)
+                yield from self.stream_llm(result, max_tokens)
             else:
-                # 否则直接返回结果
-                return result
-                
-        if self.use_rag:
-            # 使用RAG系统检索相关内容
-            context = self.rag_system.retrieve(prompt)
-            
-            # 构建包含上下文的提示
-            rag_prompt = f"""
+                yield result
+            return
+        
+        messages, cache_key, cached_answer = self._prepare_request(prompt)
+        if cached_answer is not None:
+            metrics.current_trace().set('semantic_cache_hit', True)
+            yield cached_answer
+            return
+        
+        start = time.perf_counter()
+        # 只重试建立流的请求，已开始产出内容后的错误直接抛出
+        stream = self.retry_policy.call(
+            self.client.chat.completions.create,
+            model=self.model,
+            messages=messages,
+            max_tokens=max_tokens,
+            stream=True,
+            timeout=self.chat_timeout
+        )
+        parts = []
+        usage = None
+        for chunk in stream:
+            usage = getattr(chunk, 'usage', None) or usage
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                if not parts:
+                    metrics.record_span('llm_first_token', time.perf_counter() - start, start=start)
+                parts.append(delta)
+                yield delta
+        metrics.record_span('llm_total', time.perf_counter() - start, start=start)
+        answer = "".join(parts)
+        self._record_usage(usage, messages, answer)
+        self._remember_answer(cache_key, answer)
+    
+    def _execute_tool(self, prompt):
+        """
+        解析并执行工具命令
+        
+        Returns:
+            tuple: (执行结果, 是否需要LLM处理)
+        """
+        # 解析命令和参数
+        parts = prompt.strip().split(' ', 1)
+        command = parts[0]
+        query = parts[1] if len(parts) > 1 else ""
+        
+        # 执行工具
+        # 未注册的命令统一记为unknown，避免指标标签数量无限增长
+        tool_label = command if self.tool_manager.get_tool(command) else 'unknown'
+        with metrics.span('tool_dispatch', tool=tool_label):
+            return self.tool_manager.execute_tool(command, query=query, tool_manager=self.tool_manager)
+    
+    def _prepare_request(self, prompt):
+        """
+        检索上下文、查询语义缓存并构建消息
+        
+        Returns:
+            tuple: (消息列表, 语义缓存键, 缓存的回答或None)
+        """
+        if not self.use_rag:
+            with metrics.span('prompt_build'):
+                return self._build_messages(prompt), None, None
+        
+        # 使用RAG系统检索相关内容
+        search_result = self.rag_system.search(prompt)
+        return self._finish_request(prompt, search_result)
+    
+    def _finish_request(self, prompt, search_result, built_context=None):
+        """
+        在token预算内组装上下文、查询语义缓存并构建消息
+        built_context为已组装好的(上下文, 使用的块)时直接使用（异步路径先异步组装）
+        """
+        with metrics.span('prompt_build'):
+            if built_context is None:
+                built_context = self.rag_system.build_context(search_result["hits"], search_result["embedding"])
+            context, used_hits = built_context
+            cache_key = (search_result["embedding"], [hit["id"] for hit in used_hits])
+            messages = self._build_messages(prompt, context)
+        
+        # 复用检索时已计算的问题向量查询语义缓存
+        cached_answer = None
+        if self.semantic_cache:
+            cached_answer = self.semantic_cache.lookup(*cache_key)
+            metrics.record_cache('semantic', cached_answer is not None)
+        return messages, cache_key, cached_answer
+    
+    def _record_usage(self, usage, messages, answer):
+        """记录本次调用的token数，接口未返回用量（如流式响应）时用tokenizer估算"""
+        if usage is not None:
+            prompt_tokens = usage.prompt_tokens
+            completion_tokens = usage.completion_tokens
+        else:
+            if self._token_counter is None:
+                self._token_counter = TokenCounter(self.model)
+            prompt_tokens = sum(self._token_counter.count(message["content"]) for message in messages)
+            completion_tokens = self._token_counter.count(answer)
+        metrics.inc('llm_tokens_total', prompt_tokens, type='prompt')
+        metrics.inc('llm_tokens_total', completion_tokens, type='completion')
+        trace = metrics.current_trace()
+        if trace is not None:
+            trace.set('prompt_tokens', prompt_tokens)
+            trace.set('completion_tokens', completion_tokens)
+    
+    def _build_messages(self, prompt, context=None):
+        """
+        构建发送给模型的消息
+        
+        Args:
+            prompt: 用户问题
+            context: 组装好的RAG上下文（None表示不使用RAG上下文）
+        """
+        if context is None:
+            return [
+                {"role": "system", "content": "You are a helpful assistant."},
+                {"role": "user", "content": prompt}
+            ]
+        
+        # 构建包含上下文的提示
+        rag_prompt = f"""
 Use the following pieces of information enclosed in <context> tags to provide an answer to the question enclosed in <question> tags.
 <context>
 {context}
@@ -99,24 +327,137 @@ Use the following pieces of information enclosed in <context> tags to provide an
 {prompt}
 </question>
 """
-            # 使用OpenAI生成回答
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant that answers questions based on the provided context."},
-                    {"role": "user", "content": rag_prompt}
-                ],
-                max_tokens=max_tokens
-            )
-            return response.choices[0].message.content
-        else:
-            # 直接使用OpenAI生成回答
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=max_tokens
-            )
-            return response.choices[0].message.content
+        return [
+            {"role": "system", "content": "You are a helpful assistant that answers questions based on the provided context."},
+            {"role": "user", "content": rag_prompt}
+        ]
+    
+    def _remember_answer(self, cache_key, answer):
+        """将回答写入语义缓存"""
+        if self.semantic_cache and cache_key is not None and answer:
+            self.semantic_cache.store(*cache_key, answer)
+
+
+class AsyncLLMClient(LLMClient):
+    """
+    LLM客户端的异步版本
+    
+    基于AsyncOpenAI和AsyncRAGSystem，检索和生成都不阻塞事件循环，
+    单个进程可以在同一个事件循环中同时处理大量对话。
+    """
+    
+    rag_system_class = AsyncRAGSystem
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.async_client = self._acquire_shared(
+            'async_openai', openai_resource_params(self.client_params, self.http_config),
+            lambda: create_openai_client(self.client_params, self.http_config, asynchronous=True)
+        )
+    
+    async def acall_llm(self, prompt, max_tokens=1000):
+        """
+        异步调用OpenAI语言模型
+        
+        Args:
+            prompt: 提示文本
+            max_tokens: 生成的最大token数
+            
+        Returns:
+            生成的回复文本
+        """
+        with metrics.trace('acall_llm') as trace:
+            # 检查是否是工具调用
+            if prompt.startswith('/'):
+                result, requires_llm = self._execute_tool(prompt)
+                if requires_llm:
+                    return await self.acall_llm(result, max_tokens)
+                return result
+            
+            messages, cache_key, cached_answer = await self._aprepare_request(prompt)
+            if cached_answer is not None:
+                trace.set('semantic_cache_hit', True)
+                return cached_answer
+            
+            with metrics.span('llm_total'):
+                response = await self.retry_policy.acall(
+                    self.async_client.chat.completions.create,
+                    model=self.model,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    timeout=self.chat_timeout
+                )
+            answer = response.choices[0].message.content
+            self._record_usage(response.usage, messages, answer)
+            self._remember_answer(cache_key, answer)
+            return answer
+    
+    def astream_llm(self, prompt, max_tokens=1000):
+        """
+        以异步流式方式调用OpenAI语言模型
+        
+        Args:
+            prompt: 提示文本
+            max_tokens: 生成的最大token数
+            
+        Yields:
+            回复文本的增量片段
+        """
+        return metrics.atrace_generator('astream_llm', self._astream_llm(prompt, max_tokens))
+    
+    async def _astream_llm(self, prompt, max_tokens):
+        # 检查是否是工具调用
+        if prompt.startswith('/'):
+            result, requires_llm = self._execute_tool(prompt)
+            if requires_llm:
+                async for delta in self.astream_llm(result, max_tokens):
+                    yield delta
+            else:
+                yield result
+            return
+        
+        messages, cache_key, cached_answer = await self._aprepare_request(prompt)
+        if cached_answer is not None:
+            metrics.current_trace().set('semantic_cache_hit', True)
+            yield cached_answer
+            return
+        
+        start = time.perf_counter()
+        stream = await self.retry_policy.acall(
+            self.async_client.chat.completions.create,
+            model=self.model,
+            messages=messages,
+            max_tokens=max_tokens,
+            stream=True,
+            timeout=self.chat_timeout
+        )
+        parts = []
+        usage = None
+        async for chunk in stream:
+            usage = getattr(chunk, 'usage', None) or usage
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                if not parts:
+                    metrics.record_span('llm_first_token', time.perf_counter() - start, start=start)
+                parts.append(delta)
+                yield delta
+        metrics.record_span('llm_total', time.perf_counter() - start, start=start)
+        answer = "".join(parts)
+        self._record_usage(usage, messages, answer)
+        self._remember_answer(cache_key, answer)
+    
+    async def _aprepare_request(self, prompt):
+        """异步检索上下文、查询语义缓存并构建消息"""
+        if not self.use_rag:
+            with metrics.span('prompt_build'):
+                return self._build_messages(prompt), None, None
+        
+        rag_system = self._rag_system
+        if rag_system is None:
+            # 首次使用时的初始化（加载模型、连接向量存储）是阻塞的，放到线程中执行
+            rag_system = await asyncio.to_thread(lambda: self.rag_system)
+        search_result = await rag_system.asearch(prompt)
+        built_context = await rag_system.abuild_context(search_result["hits"], search_result["embedding"])
+        return self._finish_request(prompt, search_result, built_context)
@@ -0,0 +1,128 @@
+import os
+import threading
+import numpy as np
+
+
+# 支持的推理后端
+BACKENDS = ('torch', 'onnx', 'onnx_int8')
+
+
+class LocalEmbeddingEngine:
+    """
+    CPU上的本地嵌入引擎
+    基于sentence_transformers，可选ONNX Runtime后端或int8动态量化的ONNX模型；
+    编码前按文本长度排序，使同一批次内的文本长度接近，减少padding的计算量；
+    大批量导入时可启用多进程编码池，把各批次分发到多个CPU进程并行计算。
+    """
+
+    def __init__(self, model_name, backend='torch', quantization='avx2', device='cpu', batch_size=32,
+                 processes=0, multi_process_min_texts=1024, export_dir='onnx_models', max_seq_length=None):
+        """
+        Args:
+            model_name: 模型名称或本地路径
+            backend: 推理后端，torch、onnx或onnx_int8
+            quantization: int8量化的目标指令集（arm64、avx2、avx512、avx512_vnni）
+            device: 推理设备
+            batch_size: 默认的编码批大小
+            processes: 多进程编码池的进程数（0或1表示不使用）
+            multi_process_min_texts: 文本数不少于该值时才使用多进程编码池
+            export_dir: 导出的ONNX/量化模型的保存目录
+            max_seq_length: 最大序列长度（None表示使用模型的默认值）
+        """
+        if backend not in BACKENDS:
+            raise ValueError(f"不支持的本地嵌入后端: {backend}，可选: {', '.join(BACKENDS)}")
+        self.model_name = model_name
+        self.backend = backend
+        self.quantization = quantization
+        self.device = device
+        self.batch_size = batch_size
+        self.processes = processes
+        self.multi_process_min_texts = multi_process_min_texts
+        self.export_dir = export_dir
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+        self.model = self._load_model()
+        if max_seq_length:
+            self.model.max_seq_length = max_seq_length
+        self.dimension = self.model.get_sentence_embedding_dimension()
+
+    def _load_model(self):
+        # sentence_transformers会连带导入torch，只在使用本地模型时导入
+        from sentence_transformers import SentenceTransformer
+        if self.backend == 'torch':
+            return SentenceTransformer(self.model_name, device=self.device)
+        if self.backend == 'onnx':
+            # 模型仓库中没有ONNX文件时，sentence_transformers会自动导出
+            return SentenceTransformer(self.model_name, device=self.device, backend='onnx')
+        return self._load_quantized_model(SentenceTransformer)
+
+    def _load_quantized_model(self, model_class):
+        """加载int8量化的ONNX模型，不存在时从ONNX模型导出并保存到export_dir"""
+        file_name = f"onnx/model_qint8_{self.quantization}.onnx"
+        local_path = os.path.join(self.export_dir, self.model_name.replace('/', '__'))
+        if os.path.exists(os.path.join(local_path, file_name)):
+            return model_class(local_path, device=self.device, backend='onnx', model_kwargs={'file_name': file_name})
+        try:
+            # 不少模型仓库已经提供了量化好的ONNX文件
+            return model_class(self.model_name, device=self.device, backend='onnx', model_kwargs={'file_name': file_name})
+        except Exception:
+            pass
+
+        from sentence_transformers import export_dynamic_quantized_onnx_model
+        print(f"导出 {self.model_name} 的int8量化ONNX模型到 {local_path}...")
+        model = model_class(self.model_name, device=self.device, backend='onnx')
+        model.save(local_path)
+        export_dynamic_quantized_onnx_model(model, self.quantization, local_path)
+        return model_class(local_path, device=self.device, backend='onnx', model_kwargs={'file_name': file_name})
+
+    def _get_pool(self):
+        """延迟启动多进程编码池"""
+        with self._pool_lock:
+            if self._pool is None:
+                print(f"启动多进程嵌入编码池 (进程数: {self.processes})")
+                self._pool = self.model.start_multi_process_pool([self.device] * self.processes)
+            return self._pool
+
+    def encode(self, texts, batch_size=None):
+        """
+        批量编码文本
+
+        Args:
+            texts: 文本列表
+            batch_size: 编码批大小（None表示使用默认值）
+
+        Returns:
+            np.ndarray: 与输入顺序一致的归一化嵌入向量（float32）
+        """
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        batch_size = batch_size or self.batch_size
+
+        # 按长度从长到短排序：每批的padding长度取决于批内最长的文本，长度接近的文本放在一起计算量最小；
+        # 多进程编码时各进程分到的也是长度接近的连续块
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]), reverse=True)
+        sorted_texts = [texts[i] for i in order]
+
+        if self.processes > 1 and len(texts) >= self.multi_process_min_texts:
+            chunk_size = max(batch_size, -(-len(texts) // (self.processes * 4)))
+            sorted_embeddings = self.model.encode_multi_process(
+                sorted_texts, self._get_pool(), batch_size=batch_size,
+                chunk_size=chunk_size, normalize_embeddings=True
+            )
+        else:
+            sorted_embeddings = self.model.encode(
+                sorted_texts, batch_size=batch_size, normalize_embeddings=True, convert_to_numpy=True
+            )
+
+        embeddings = np.empty_like(sorted_embeddings, dtype=np.float32)
+        embeddings[order] = sorted_embeddings
+        return embeddings
+
+    def close(self):
+        """停止多进程编码池"""
+        with self._pool_lock:
+            if self._pool is not None:
+                self.model.stop_multi_process_pool(self._pool)
+                self._pool = None
@@ -1,4 +1,5 @@
 from llm_client import LLMClient
+from import_report import print_import_report
 import argparse
 import os
 import json
@@ -27,8 +28,13 @@ def main():
     parser.add_argument("--api-key", type=str, help="OpenAI API密钥")
     parser.add_argument("--milvus-uri", type=str, help="Milvus服务器URI")
     parser.add_argument("--force-rebuild", action="store_true", help="强制重建集合，即使已存在")
+    parser.add_argument("--import-report", action="store_true", help="显示各模块的冷启动导入耗时后退出")
     args = parser.parse_args()
     
+    if args.import_report:
+        print_import_report()
+        return
+    
     # 如果指定了不同的配置文件，重新加载
     if args.config != 'config.json':
         config = load_config(args.config)
@@ -77,8 +83,8 @@ def main():
             print(f"集合: {collection_name}")
             
             # 检查集合是否存在且有数据
-            if client.rag_system.milvus_client.has_collection(collection_name):
-                stats = client.rag_system.milvus_client.get_collection_stats(collection_name)
+            if client.rag_system.vector_store.has_collection(collection_name):
+                stats = client.rag_system.vector_store.get_collection_stats(collection_name)
                 row_count = stats.get('row_count', 0)
                 print(f"集合中的数据量: {row_count} 条")
         else:
@@ -103,8 +109,11 @@ def main():
                 continue
                 
             try:
-                response = client.call_llm(prompt)
-                print("\nAI: " + response)
+                # 流式输出回答，边生成边显示
+                print("\nAI: ", end="", flush=True)
+                for delta in client.stream_llm(prompt):
+                    print(delta, end="", flush=True)
+                print()
                 print("-" * 50)
             except Exception as e:
                 print(f"\n错误: {str(e)}")
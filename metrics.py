@@ -0,0 +1,373 @@
+import contextvars
+import json
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# 延迟直方图的桶上界（秒）
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# 当前请求的追踪记录，span自动挂到其上
+_current_trace = contextvars.ContextVar('current_trace', default=None)
+
+
+def _label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _escape_label_value(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(label_key, extra=()):
+    items = list(label_key) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape_label_value(value)}"' for key, value in items) + "}"
+
+
+class Trace:
+    """一次请求的追踪记录，包含各阶段span的开始偏移和耗时"""
+
+    def __init__(self, name, **attributes):
+        self.name = name
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        self.attributes = dict(attributes)
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add_span(self, name, start, duration, labels):
+        with self._lock:
+            self.spans.append({
+                "name": name,
+                "offset_ms": round((start - self._start) * 1000, 3),
+                "duration_ms": round(duration * 1000, 3),
+                **labels,
+            })
+
+    def set(self, key, value):
+        """记录请求级别的属性（如token数、是否命中缓存）"""
+        self.attributes[key] = value
+
+    def to_dict(self, duration):
+        with self._lock:
+            spans = list(self.spans)
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "timestamp": self.start_time,
+            "duration_ms": round(duration * 1000, 3),
+            "attributes": self.attributes,
+            "spans": spans,
+        }
+
+
+class MetricsRegistry:
+    """
+    进程内指标注册表
+    记录计数器和延迟直方图，可导出为字典快照或Prometheus文本格式；
+    请求级追踪记录可选地以JSONL格式逐行追加到文件。
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+        self._lock = threading.Lock()
+        self._trace_file = None
+        self._trace_lock = threading.Lock()
+
+    def describe(self, name, help_text):
+        """设置指标的说明文字"""
+        self._help[name] = help_text
+
+    def inc(self, name, value=1, **labels):
+        """累加计数器"""
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """向直方图记录一个观测值"""
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {
+                    "buckets": [0] * len(self.buckets), "count": 0, "sum": 0.0
+                }
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram["buckets"][i] += 1
+                    break
+            histogram["count"] += 1
+            histogram["sum"] += value
+
+    def record_span(self, name, duration, start=None, **labels):
+        """记录一个已完成阶段的耗时（秒），并挂到当前请求的追踪记录上"""
+        self.observe('rag_stage_duration_seconds', duration, stage=name, **labels)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add_span(name, start if start is not None else time.perf_counter() - duration, duration, labels)
+
+    @contextmanager
+    def span(self, name, **labels):
+        """计时一个阶段，如 with metrics.span('embed'): ..."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_span(name, time.perf_counter() - start, start=start, **labels)
+
+    @contextmanager
+    def trace(self, name, **attributes):
+        """
+        追踪一次请求，期间的span都记录到同一条追踪记录中
+        已处于某个请求中时（如工具结果再交给LLM处理）复用外层记录
+        """
+        current = _current_trace.get()
+        if current is not None:
+            yield current
+            return
+
+        trace = Trace(name, **attributes)
+        token = _current_trace.set(trace)
+        try:
+            yield trace
+        finally:
+            _current_trace.reset(token)
+            self._finish_trace(name, trace)
+
+    def trace_generator(self, name, generator, **attributes):
+        """
+        追踪由生成器逐步产出结果的请求（如流式回答）
+        追踪记录只在生成器每一步执行期间设为当前记录：生成器暂停时不会泄漏到调用方的上下文，
+        在其他线程或上下文中恢复执行时，之后的span也记录到同一条记录中
+        """
+        if _current_trace.get() is not None:
+            yield from generator
+            return
+
+        trace = Trace(name, **attributes)
+        try:
+            while True:
+                token = _current_trace.set(trace)
+                try:
+                    item = next(generator)
+                except StopIteration:
+                    return
+                finally:
+                    _current_trace.reset(token)
+                yield item
+        finally:
+            generator.close()
+            self._finish_trace(name, trace)
+
+    async def atrace_generator(self, name, generator, **attributes):
+        """trace_generator的异步版本，追踪异步生成器产出结果的请求"""
+        if _current_trace.get() is not None:
+            async for item in generator:
+                yield item
+            return
+
+        trace = Trace(name, **attributes)
+        try:
+            while True:
+                token = _current_trace.set(trace)
+                try:
+                    item = await generator.__anext__()
+                except StopAsyncIteration:
+                    return
+                finally:
+                    _current_trace.reset(token)
+                yield item
+        finally:
+            await generator.aclose()
+            self._finish_trace(name, trace)
+
+    def _finish_trace(self, name, trace):
+        """请求结束：记录总耗时并写出追踪记录"""
+        duration = time.perf_counter() - trace._start
+        self.observe('rag_request_duration_seconds', duration, operation=name)
+        self._write_trace(trace.to_dict(duration))
+
+    @staticmethod
+    def current_trace():
+        """返回当前请求的追踪记录，不在请求中时返回None"""
+        return _current_trace.get()
+
+    def record_cache(self, cache, hit, count=1):
+        """记录缓存命中或未命中"""
+        if count:
+            self.inc('rag_cache_requests_total', count, cache=cache, result='hit' if hit else 'miss')
+
+    def enable_trace_log(self, path):
+        """把每次请求的追踪记录以JSONL格式追加到文件，path为空时关闭"""
+        with self._trace_lock:
+            if self._trace_file is not None:
+                self._trace_file.close()
+                self._trace_file = None
+            if path:
+                self._trace_file = open(path, 'a', encoding='utf-8')
+
+    def _write_trace(self, record):
+        if self._trace_file is None:
+            return
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._trace_lock:
+            if self._trace_file is not None:
+                self._trace_file.write(line + "\n")
+                self._trace_file.flush()
+
+    def snapshot(self):
+        """
+        返回所有指标的快照
+
+        Returns:
+            dict: counters、histograms（次数、总和、平均值）和各缓存的命中率
+        """
+        with self._lock:
+            counters = {
+                name + _format_labels(labels): value for (name, labels), value in self._counters.items()
+            }
+            histograms = {
+                name + _format_labels(labels): {
+                    "count": h["count"],
+                    "sum": h["sum"],
+                    "avg": h["sum"] / h["count"] if h["count"] else 0.0,
+                }
+                for (name, labels), h in self._histograms.items()
+            }
+            cache_totals = {}
+            for (name, labels), value in self._counters.items():
+                if name == 'rag_cache_requests_total':
+                    labels = dict(labels)
+                    totals = cache_totals.setdefault(labels['cache'], {"hit": 0, "miss": 0})
+                    totals[labels['result']] += value
+        cache_hit_rates = {
+            cache: totals["hit"] / (totals["hit"] + totals["miss"])
+            for cache, totals in cache_totals.items() if totals["hit"] + totals["miss"]
+        }
+        return {"counters": counters, "histograms": histograms, "cache_hit_rates": cache_hit_rates}
+
+    def render_prometheus(self):
+        """导出为Prometheus文本格式"""
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(
+                (key, {"buckets": list(h["buckets"]), "count": h["count"], "sum": h["sum"]})
+                for key, h in self._histograms.items()
+            )
+
+        last_name = None
+        for (name, labels), value in counters:
+            if name != last_name:
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} counter")
+                last_name = name
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+
+        last_name = None
+        for (name, labels), h in histograms:
+            if name != last_name:
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} histogram")
+                last_name = name
+            cumulative = 0
+            for bound, count in zip(self.buckets, h["buckets"]):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', repr(bound))])} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {h['count']}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {h['sum']}")
+            lines.append(f"{name}_count{_format_labels(labels)} {h['count']}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        """清空所有指标"""
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+class MetricsServer:
+    """在后台线程中提供 /metrics（Prometheus文本）和 /metrics.json（快照）"""
+
+    def __init__(self, registry, host='127.0.0.1', port=9464):
+        self.registry = registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(handler):
+                path = handler.path.split('?', 1)[0]
+                if path == '/metrics':
+                    body = registry.render_prometheus().encode('utf-8')
+                    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+                elif path == '/metrics.json':
+                    body = json.dumps(registry.snapshot(), ensure_ascii=False).encode('utf-8')
+                    content_type = 'application/json; charset=utf-8'
+                else:
+                    handler.send_error(404)
+                    return
+                handler.send_response(200)
+                handler.send_header('Content-Type', content_type)
+                handler.send_header('Content-Length', str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def address(self):
+        return self.server.server_address
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# 进程内共享的指标注册表
+metrics = MetricsRegistry()
+metrics.describe('rag_stage_duration_seconds', 'Duration of each request stage')
+metrics.describe('rag_request_duration_seconds', 'End-to-end request duration')
+metrics.describe('rag_cache_requests_total', 'Cache lookups by cache and result')
+metrics.describe('llm_tokens_total', 'LLM tokens by type')
+
+_server = None
+_configure_lock = threading.Lock()
+
+
+def configure_metrics(metrics_config):
+    """
+    按配置启动指标导出（多次调用只生效一次）
+
+    Args:
+        metrics_config: 配置文件中的metrics部分
+    """
+    global _server
+    with _configure_lock:
+        trace_log = metrics_config.get('trace_log')
+        if trace_log and metrics._trace_file is None:
+            metrics.enable_trace_log(trace_log)
+
+        prometheus_config = metrics_config.get('prometheus', {})
+        if prometheus_config.get('enabled', False) and _server is None:
+            host = prometheus_config.get('host', '127.0.0.1')
+            port = prometheus_config.get('port', 9464)
+            try:
+                _server = MetricsServer(metrics, host, port)
+                print(f"指标导出地址: http://{host}:{port}/metrics")
+            except OSError as e:
+                print(f"无法启动指标服务: {str(e)}")
@@ -0,0 +1,62 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    线程安全的进程内LRU缓存，条目超过存活时间后失效
+    """
+
+    def __init__(self, max_entries=1024, ttl_seconds=600):
+        """
+        Args:
+            max_entries: 最多缓存的条目数
+            ttl_seconds: 条目存活秒数（None表示永不过期）
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """查询缓存，未命中或已过期返回None"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        """写入缓存，超过容量时淘汰最久未使用的条目"""
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        """清空所有条目"""
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """返回缓存统计信息"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
@@ -1,30 +1,122 @@
 import os
+import re
 import json
-from pymilvus import MilvusClient
-from sentence_transformers import SentenceTransformer
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from tqdm import tqdm
-from openai import OpenAI
+import asyncio
+import hashlib
+import threading
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from embedding_scheduler import EmbeddingScheduler
+from embedding_cache import EmbeddingCache
+from embedding_coalescer import EmbeddingCoalescer, AsyncEmbeddingCoalescer
+from local_embedding import LocalEmbeddingEngine
+from query_cache import TTLCache
+from bm25_index import BM25Index
+from reranker import CrossEncoderReranker
+from context_builder import ContextBuilder
+from resource_pool import (
+    shared_resources, make_key, create_openai_client, create_retry_policy, openai_resource_params
+)
+from metrics import metrics
+from vector_store import create_vector_store
+
+def iter_pdf_chunks(pdf_path, chunk_size, chunk_overlap, progress_callback=None):
+    """
+    逐页加载PDF并分块，产出包含文本和页码的块
+    
+    progress_callback不为None时，每处理完一页以 (阶段, 数量, 总数) 上报parse和split阶段的进度
+    """
+    # PDF解析和分块只在导入数据时需要，延迟导入以加快启动
+    from langchain_community.document_loaders import PyPDFLoader
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    loader = PyPDFLoader(pdf_path)
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    if progress_callback:
+        progress_callback('parse', 0, _count_pdf_pages(pdf_path))
+    total_chunks = 0
+    for page in loader.lazy_load():
+        chunks = text_splitter.split_documents([page])
+        total_chunks += len(chunks)
+        if progress_callback:
+            progress_callback('parse', 1)
+            progress_callback('split', len(chunks))
+        for chunk in chunks:
+            yield {"text": chunk.page_content, "page": chunk.metadata.get('page', 0)}
+    if progress_callback:
+        progress_callback('split', 0, total_chunks)
+
+def _count_pdf_pages(pdf_path):
+    """PDF的页数（只用于显示进度），无法读取时返回None"""
+    try:
+        from pypdf import PdfReader
+        return len(PdfReader(pdf_path).pages)
+    except Exception:
+        return None
+
+def load_pdf_chunks(pdf_path, chunk_size, chunk_overlap):
+    """解析并分块整个PDF，供进程池调用"""
+    return list(iter_pdf_chunks(pdf_path, chunk_size, chunk_overlap))
+
+def _batched(iterable, batch_size):
+    """将可迭代对象按固定大小分批"""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _escape_filter_value(value):
+    """转义Milvus过滤表达式中的字符串值"""
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+def document_type(source):
+    """根据文件扩展名推断文档类型（如pdf），没有扩展名时为unknown"""
+    extension = os.path.splitext(source)[1].lstrip('.').lower()
+    return extension or 'unknown'
+
+def document_partition(source):
+    """
+    文档对应的分区名
+    由文件名中的字母数字部分和来源路径的哈希组成，满足Milvus分区名的字符限制且不同文档不会冲突
+    """
+    stem = re.sub(r'[^0-9A-Za-z_]', '_', os.path.splitext(os.path.basename(source))[0])[:40]
+    digest = hashlib.sha1(os.path.abspath(source).encode('utf-8')).hexdigest()[:12]
+    return f"doc_{stem}_{digest}"
+
+class JobCancelled(Exception):
+    """数据导入被取消（cancel_event已设置）"""
 
 class RAGSystem:
-    def __init__(self, config_path='config.json', api_key=None, base_url=None, organization=None):
+    def __init__(self, config_path='config.json', api_key=None, base_url=None, organization=None, config=None):
         """
         初始化RAG系统，从配置文件加载所有设置
         
+        OpenAI客户端、Milvus客户端、嵌入模型和嵌入缓存从进程内共享资源池获取，
+        相同配置的多个实例共享同一份资源，调用close()释放。
+        
         Args:
             config_path: 配置文件路径
             api_key: 可选的OpenAI API密钥（覆盖配置文件中的值）
             base_url: 可选的OpenAI API基础URL（覆盖配置文件中的值）
             organization: 可选的OpenAI组织ID（覆盖配置文件中的值）
+            config: 可选的配置字典（提供时不再读取配置文件）
         """
+        self._resource_keys = []
+        
         # 加载配置文件
-        try:
-            with open(config_path, 'r') as f:
-                self.config = json.load(f)
-        except Exception as e:
-            print(f"无法加载配置文件: {str(e)}")
-            self.config = {}
+        if config is not None:
+            self.config = config
+        else:
+            try:
+                with open(config_path, 'r') as f:
+                    self.config = json.load(f)
+            except Exception as e:
+                print(f"无法加载配置文件: {str(e)}")
+                self.config = {}
 
         # 设置API参数（命令行参数优先）
         self.api_key = api_key or self.config.get('api_key')
@@ -44,92 +136,366 @@ class RAGSystem:
         self.milvus_password = milvus_config.get('password', '')
         self.metric_type = milvus_config.get('metric_type', 'IP')
         self.consistency_level = milvus_config.get('consistency_level', 'Strong')
+        # 向量索引类型及其构建参数（只在新建集合时生效），以及搜索参数（如HNSW的ef、IVF的nprobe）
+        self.index_type = milvus_config.get('index_type', 'AUTOINDEX').upper()
+        self.index_params = milvus_config.get('index_params', {})
+        self.search_params = milvus_config.get('search_params', {})
+        # 每个文档写入独立的分区，检索时可以只搜索指定文档的分区
+        self.partition_by_document = milvus_config.get('partition_by_document', False)
         
         # 设置嵌入参数 - 修改默认值为使用OpenAI嵌入
         self.use_openai_embeddings = embedding_config.get('use_openai', True)  # 默认改为True
         self.openai_model = embedding_config.get('openai_model', 'text-embedding-ada-002')
         self.local_embedding_model = embedding_config.get('local_model', 'BAAI/bge-small-en-v1.5')
+        local_engine_config = embedding_config.get('local', {})
+        self.local_engine_params = {
+            'model_name': self.local_embedding_model,
+            'backend': local_engine_config.get('backend', 'torch'),
+            'quantization': local_engine_config.get('quantization', 'avx2'),
+            'device': local_engine_config.get('device', 'cpu'),
+            'processes': local_engine_config.get('processes', 0),
+            'multi_process_min_texts': local_engine_config.get('multi_process_min_texts', 1024),
+            'export_dir': local_engine_config.get('export_dir', 'onnx_models'),
+            'max_seq_length': local_engine_config.get('max_seq_length'),
+        }
+        self.embedding_batch_size = embedding_config.get('batch_size', 64)
+        self.embedding_concurrency = embedding_config.get('concurrency', 1)
+        self.embedding_scheduler = None
+        cache_config = embedding_config.get('cache', {})
+        
+        # 请求合并：并发到达的单条查询嵌入在短时间窗口内合并成一次批量调用
+        coalesce_config = embedding_config.get('coalesce', {})
+        self.embedding_coalescer = None
+        self.coalesce_window_ms = coalesce_config.get('window_ms', 3.0)
+        self.coalesce_max_batch_size = coalesce_config.get('max_batch_size', 64)
+        if coalesce_config.get('enabled', False):
+            self.embedding_coalescer = EmbeddingCoalescer(
+                lambda texts: self._compute_embeddings(texts, len(texts)),
+                window_ms=self.coalesce_window_ms,
+                max_batch_size=self.coalesce_max_batch_size
+            )
+        
+        # 初始化持久化嵌入缓存
+        self.embedding_cache = None
+        if cache_config.get('enabled', True):
+            try:
+                cache_path = cache_config.get('path', 'embedding_cache.db')
+                max_entries = cache_config.get('max_entries', 200000)
+                self.embedding_cache = self._acquire_shared(
+                    'embedding_cache', {'path': os.path.abspath(cache_path), 'max_entries': max_entries},
+                    lambda: EmbeddingCache(path=cache_path, max_entries=max_entries)
+                )
+            except Exception as e:
+                print(f"无法打开嵌入缓存，将不使用缓存: {str(e)}")
         
         # 设置检索参数
         self.top_k = retrieval_config.get('top_k', 3)
         
+        # 混合检索：BM25关键词检索结果与向量检索结果按倒数排名融合(RRF)
+        hybrid_config = retrieval_config.get('hybrid', {})
+        self.lexical_index = None
+        self.hybrid_candidates = hybrid_config.get('candidates', 20)
+        self.hybrid_rrf_k = hybrid_config.get('rrf_k', 60)
+        self.dense_weight = hybrid_config.get('dense_weight', 1.0)
+        self.lexical_weight = hybrid_config.get('lexical_weight', 1.0)
+        # 第一次混合检索前检查BM25索引是否需要从集合构建（如对已有集合开启混合检索）
+        self._lexical_checked = False
+        self._lexical_lock = threading.Lock()
+        if hybrid_config.get('enabled', False):
+            index_path = os.path.join(hybrid_config.get('index_dir', 'bm25_index'), f"{self.collection_name}.npz")
+            k1 = hybrid_config.get('k1', 1.5)
+            b = hybrid_config.get('b', 0.75)
+            self.lexical_index = self._acquire_shared(
+                'bm25_index', {'path': os.path.abspath(index_path), 'k1': k1, 'b': b},
+                lambda: BM25Index(index_path, k1=k1, b=b)
+            )
+        
+        # 查询缓存：问题 -> 嵌入向量，(向量, top_k, 集合) -> 检索结果
+        query_cache_config = retrieval_config.get('cache', {})
+        self.query_embedding_cache = None
+        self.search_cache = None
+        if query_cache_config.get('enabled', True):
+            max_entries = query_cache_config.get('max_entries', 1024)
+            ttl_seconds = query_cache_config.get('ttl_seconds', 600)
+            self.query_embedding_cache = TTLCache(max_entries, ttl_seconds)
+            self.search_cache = TTLCache(max_entries, ttl_seconds)
+        
+        # 重排序：多取回候选块，用交叉编码器重新打分后保留前top_k个
+        rerank_config = rag_config.get('rerank', {})
+        self.reranker = None
+        self.rerank_candidates = rerank_config.get('candidates', 20)
+        if rerank_config.get('enabled', False):
+            rerank_params = {
+                'model_name': rerank_config.get('model', 'cross-encoder/ms-marco-MiniLM-L-6-v2'),
+                'batch_size': rerank_config.get('batch_size', 32),
+                'budget_ms': rerank_config.get('budget_ms', 150),
+                'max_length': rerank_config.get('max_length', 512),
+            }
+            print(f"加载重排序模型 {rerank_params['model_name']}...")
+            try:
+                self.reranker = self._acquire_shared(
+                    'reranker', rerank_params, lambda: CrossEncoderReranker(**rerank_params)
+                )
+            except Exception as e:
+                print(f"无法加载重排序模型，将不使用重排序: {str(e)}")
+        
+        # 上下文组装：MMR去冗余、去除重叠文本并限制token数（需在配置中启用）
+        context_config = rag_config.get('context', {})
+        self.context_builder = None
+        if context_config.get('enabled', False):
+            self.context_builder = ContextBuilder(
+                max_tokens=context_config.get('max_tokens', 1500),
+                mmr_lambda=context_config.get('mmr_lambda', 0.7),
+                min_overlap_chars=context_config.get('min_overlap_chars', 50),
+                model=self.config.get('model', 'gpt-4o-mini')
+            )
+        
+        # OpenAI客户端参数
+        self.openai_client_params = {'api_key': self.api_key}
+        if self.base_url:
+            self.openai_client_params['base_url'] = self.base_url
+        if self.organization:
+            self.openai_client_params['organization'] = self.organization
+        
+        # 连接池、超时、重试和熔断设置（与LLMClient相同时共用客户端和熔断器）
+        self.http_config = self.config.get('http', {})
+        self.embedding_timeout = self.http_config.get('timeouts', {}).get('embedding', 30.0)
+        self.retry_policy = create_retry_policy(self.http_config, self.base_url or 'api.openai.com')
+        
         # 初始化嵌入模型
         if self.use_openai_embeddings:
             print("使用OpenAI嵌入模型...")
-            client_params = {'api_key': self.api_key}
-            if self.base_url:
-                client_params['base_url'] = self.base_url
-            if self.organization:
-                client_params['organization'] = self.organization
-                
-            self.openai_client = OpenAI(**client_params)
+            self.openai_client = self._acquire_openai_client()
         else:
             print(f"警告: 尝试加载本地嵌入模型 {self.local_embedding_model}...")
             print("如果出现网络问题，建议在配置文件中设置 use_openai 为 true")
             try:
-                self.embedding_model = SentenceTransformer(self.local_embedding_model)
+                self.embedding_model = self._acquire_shared(
+                    'local_embedding', self.local_engine_params,
+                    lambda: LocalEmbeddingEngine(**self.local_engine_params)
+                )
+                print(f"本地嵌入后端: {self.embedding_model.backend}")
             except Exception as e:
                 print(f"无法加载本地模型: {str(e)}")
                 print("自动切换到OpenAI嵌入模型...")
                 self.use_openai_embeddings = True
-                client_params = {'api_key': self.api_key}
-                if self.base_url:
-                    client_params['base_url'] = self.base_url
-                if self.organization:
-                    client_params['organization'] = self.organization
-                    
-                self.openai_client = OpenAI(**client_params)
+                self.openai_client = self._acquire_openai_client()
+        
+        # 并发嵌入模式：同时保持多个批次在途
+        if self.use_openai_embeddings and self.embedding_concurrency > 1:
+            print(f"启用并发嵌入模式 (并发数: {self.embedding_concurrency})")
+            self.embedding_scheduler = EmbeddingScheduler(
+                client=self.openai_client,
+                model=self.openai_model,
+                max_concurrency=self.embedding_concurrency,
+                requests_per_minute=embedding_config.get('requests_per_minute'),
+                tokens_per_minute=embedding_config.get('tokens_per_minute'),
+                max_retries=embedding_config.get('max_retries', 5),
+                timeout=self.embedding_timeout,
+                circuit_breaker=self.retry_policy.breaker
+            )
                 
-        # 连接到Milvus
-        print(f"连接到Milvus服务器: {self.milvus_uri}")
-        milvus_params = {'uri': self.milvus_uri}
+        # 连接向量存储后端（Milvus或进程内本地索引）
+        self.vector_backend = rag_config.get('vector_store', {}).get('backend', 'milvus')
+        self.milvus_params = {'uri': self.milvus_uri}
         if self.milvus_user:
-            milvus_params['user'] = self.milvus_user
-            milvus_params['password'] = self.milvus_password
-            
+            self.milvus_params['user'] = self.milvus_user
+            self.milvus_params['password'] = self.milvus_password
+        if milvus_config.get('timeout'):
+            self.milvus_params['timeout'] = milvus_config['timeout']
+        
+        # Milvus客户端按连接参数共享，init_milvus检查连接时创建的客户端可以直接复用
+        if self.vector_backend == 'milvus':
+            print(f"连接到Milvus服务器: {self.milvus_uri}")
+            store_kind, store_params = 'milvus', self.milvus_params
+        else:
+            print(f"使用本地向量索引: {rag_config.get('local_index', {}).get('path', 'local_index')}")
+            store_kind = 'vector_store'
+            store_params = {'backend': self.vector_backend, 'local': rag_config.get('local_index', {})}
         try:
-            self.milvus_client = MilvusClient(**milvus_params)
-            print("Milvus连接成功")
+            self.vector_store = self._acquire_shared(
+                store_kind, store_params, lambda: create_vector_store(rag_config, self.milvus_params)
+            )
+            if self.vector_backend == 'milvus':
+                print("Milvus连接成功")
         except Exception as e:
-            print(f"连接到Milvus时出错: {str(e)}")
-            print("请确保Milvus服务器正在运行且可访问")
+            print(f"连接到向量存储时出错: {str(e)}")
+            if self.vector_backend == 'milvus':
+                print("请确保Milvus服务器正在运行且可访问")
+            self.close()
             raise
         
         # 检查集合是否存在
         try:
-            if not self.milvus_client.has_collection(self.collection_name):
+            if not self.vector_store.has_collection(self.collection_name):
                 print(f"集合 {self.collection_name} 不存在，请先加载数据")
         except Exception as e:
             print(f"检查集合时出错: {str(e)}")
     
+    def _acquire_openai_client(self, asynchronous=False):
+        """从共享资源池获取按http配置创建的OpenAI客户端"""
+        return self._acquire_shared(
+            'async_openai' if asynchronous else 'openai',
+            openai_resource_params(self.openai_client_params, self.http_config),
+            lambda: create_openai_client(self.openai_client_params, self.http_config, asynchronous=asynchronous)
+        )
+    
+    def _acquire_shared(self, kind, params, factory):
+        """从共享资源池获取资源，并记录以便close()时释放"""
+        key = make_key(kind, params)
+        resource = shared_resources.acquire(key, factory)
+        self._resource_keys.append(key)
+        return resource
+    
+    def close(self):
+        """释放本实例持有的共享资源引用"""
+        if self.embedding_scheduler:
+            self.embedding_scheduler.close()
+            self.embedding_scheduler = None
+        for key in self._resource_keys:
+            shared_resources.release(key)
+        self._resource_keys = []
+    
+    @property
+    def milvus_client(self):
+        """向量存储后端（保留旧名称以兼容已有调用）"""
+        return self.vector_store
+    
+    @property
+    def embedding_model_name(self):
+        """当前嵌入模型的标识，用作缓存键的一部分"""
+        if self.use_openai_embeddings:
+            return f"openai:{self.openai_model}"
+        backend = self.local_engine_params['backend']
+        # 量化或换用ONNX后向量会有细微差别，不同后端的缓存分开保存
+        if backend == 'torch':
+            return f"local:{self.local_embedding_model}"
+        if backend == 'onnx_int8':
+            backend = f"{backend}_{self.local_engine_params['quantization']}"
+        return f"local:{self.local_embedding_model}:{backend}"
+    
     def emb_text(self, text):
         """生成文本的嵌入向量"""
-        if self.use_openai_embeddings:
+        # 优先使用嵌入缓存
+        if self.embedding_cache:
+            cached = self.embedding_cache.get(self.embedding_model_name, text)
+            if cached is not None:
+                return cached
+        
+        if self.embedding_coalescer:
+            # 与同时到达的其他请求合并成一次批量调用
+            embedding = self.embedding_coalescer.embed(text)
+        elif self.use_openai_embeddings:
             # 使用OpenAI生成嵌入
-            response = self.openai_client.embeddings.create(
+            response = self.retry_policy.call(
+                self.openai_client.embeddings.create,
                 model=self.openai_model,
-                input=text
+                input=text,
+                timeout=self.embedding_timeout
             )
-            return response.data[0].embedding
+            embedding = response.data[0].embedding
         else:
             # 使用本地模型生成嵌入
-            return self.embedding_model.encode([text], normalize_embeddings=True).tolist()[0]
+            embedding = self.embedding_model.encode([text]).tolist()[0]
+        
+        if self.embedding_cache:
+            self.embedding_cache.put(self.embedding_model_name, text, embedding)
+        return embedding
     
-    def load_data(self, pdf_path=None, chunk_size=None, chunk_overlap=None, force_rebuild=False):
+    def emb_texts(self, texts, batch_size=None, progress_callback=None):
+        """
+        批量生成文本的嵌入向量
+        
+        Args:
+            texts: 文本列表
+            batch_size: 每个请求包含的文本数（None表示使用配置文件中的值）
+            progress_callback: 每完成一个批次时调用，参数为该批次的文本数
+            
+        Returns:
+            与输入顺序一致的嵌入向量列表
+        """
+        texts = list(texts)
+        if not texts:
+            return []
+        batch_size = batch_size or self.embedding_batch_size
+        
+        if not self.embedding_cache:
+            return self._compute_embeddings(texts, batch_size, progress_callback)
+        
+        # 先查缓存，只为未命中的文本（去重后）生成嵌入
+        model_name = self.embedding_model_name
+        cached = self.embedding_cache.get_many(model_name, texts)
+        missing = list(dict.fromkeys(text for text in texts if text not in cached))
+        metrics.record_cache('embedding', True, len(texts) - len(missing))
+        metrics.record_cache('embedding', False, len(missing))
+        if progress_callback and len(texts) > len(missing):
+            progress_callback(sum(1 for text in texts if text in cached))
+        
+        if missing:
+            embeddings = self._compute_embeddings(missing, batch_size, progress_callback)
+            computed = list(zip(missing, embeddings))
+            self.embedding_cache.put_many(model_name, computed)
+            cached.update(computed)
+        return [cached[text] for text in texts]
+    
+    def _compute_embeddings(self, texts, batch_size, progress_callback=None):
+        """调用嵌入模型批量生成向量（不经过缓存）"""
+        if self.embedding_scheduler:
+            # 并发模式：多个批次同时在途，失败的批次单独重试
+            return self.embedding_scheduler.embed(texts, batch_size, progress_callback=progress_callback)
+        
+        if self.use_openai_embeddings:
+            # 每个请求发送多条输入，按返回的index恢复顺序
+            embeddings = []
+            for start in range(0, len(texts), batch_size):
+                batch = texts[start:start + batch_size]
+                response = self.retry_policy.call(
+                    self.openai_client.embeddings.create,
+                    model=self.openai_model,
+                    input=batch,
+                    timeout=self.embedding_timeout
+                )
+                ordered = sorted(response.data, key=lambda item: item.index)
+                embeddings.extend(item.embedding for item in ordered)
+                if progress_callback:
+                    progress_callback(len(batch))
+            return embeddings
+        else:
+            # 本地模型一次性批量编码（按长度排序，文本足够多时分发到多进程编码池）
+            embeddings = self.embedding_model.encode(texts, batch_size=batch_size).tolist()
+            if progress_callback:
+                progress_callback(len(texts))
+            return embeddings
+    
+    def load_data(self, pdf_path=None, chunk_size=None, chunk_overlap=None, force_rebuild=False, doc_type=None,
+                  progress_callback=None, cancel_event=None):
         """
         从PDF加载数据到Milvus
         
+        以流水线方式处理：逐页加载、分块、生成嵌入并按批次插入，内存占用与文档大小无关。
+        集合已存在时进行增量同步：每个块的ID由来源文件和内容哈希决定，
+        只插入新增的块并删除该文档中已不存在的块，未变化的块保持不动。
+        中断后再次运行会跳过已提交的块，从断点继续。
+        
         Args:
             pdf_path: PDF文件路径（None表示使用配置文件中的路径）
             chunk_size: 分块大小（None表示使用配置文件中的值）
             chunk_overlap: 分块重叠大小（None表示使用配置文件中的值）
             force_rebuild: 是否强制重建集合，即使已存在
+            doc_type: 文档类型（None表示按文件扩展名推断）
+            progress_callback: 上报进度的函数，参数为 (阶段, 新完成数量, 总数或None)，
+                               阶段依次为parse、split、embed和insert
+            cancel_event: threading.Event，设置后在下一个批次前抛出JobCancelled停止导入
+            
+        Returns:
+            dict: 新增、删除和未变化的块数量（文档未变化而跳过时为None）
         """
         # 从配置文件加载文档设置
         doc_config = self.config.get('rag', {}).get('documents', {})
         pdf_path = pdf_path or doc_config.get('pdf_path')
         chunk_size = chunk_size or doc_config.get('chunk_size', 1000)
         chunk_overlap = chunk_overlap or doc_config.get('chunk_overlap', 200)
+        insert_batch_size = doc_config.get('insert_batch_size', 256)
         
         if not pdf_path:
             print("错误: 未指定PDF文件路径")
@@ -139,97 +505,987 @@ class RAGSystem:
             print(f"错误: PDF文件 '{pdf_path}' 不存在")
             return
         
-        # 检查集合是否已存在
-        collection_exists = self.milvus_client.has_collection(self.collection_name)
+        source = os.path.abspath(pdf_path)
+        fingerprint = self._document_fingerprint(pdf_path, chunk_size, chunk_overlap)
         
-        # 如果集合已存在且不强制重建，直接返回
-        if collection_exists and not force_rebuild:
-            print(f"集合 {self.collection_name} 已存在，跳过创建和数据加载")
-            # 获取集合统计信息
-            stats = self.milvus_client.get_collection_stats(self.collection_name)
-            row_count = stats.get('row_count', 0)
-            print(f"集合中的数据量: {row_count} 条")
-            return
+        try:
+            if self._prepare_collection(force_rebuild):
+                self._ensure_lexical_index()
+                # 文档及分块参数均未变化时无需重新解析
+                manifest = self._read_manifest()
+                if manifest.get(source) == fingerprint:
+                    print(f"文档 {pdf_path} 未变化，跳过数据加载")
+                    stats = self.vector_store.get_collection_stats(self.collection_name)
+                    print(f"集合中的数据量: {stats.get('row_count', 0)} 条")
+                    return
+            
+            print(f"加载PDF文件: {pdf_path}")
+            print(f"将文档分割成块 (大小: {chunk_size}, 重叠: {chunk_overlap})，每批插入 {insert_batch_size} 条...")
+            result = self.sync_document(
+                source,
+                _batched(iter_pdf_chunks(pdf_path, chunk_size, chunk_overlap, progress_callback), insert_batch_size),
+                doc_type=doc_type,
+                progress_callback=progress_callback,
+                cancel_event=cancel_event
+            )
+            
+            manifest = self._read_manifest()
+            manifest[source] = fingerprint
+            self._write_manifest(manifest)
+            print(f"同步完成: 新增 {result['inserted']} 条，删除 {result['deleted']} 条，未变化 {result['unchanged']} 条")
+            return result
+            
+        except JobCancelled:
+            print(f"导入 {pdf_path} 已取消，已写入的块在下次导入时会被跳过")
+            raise
+        except Exception as e:
+            print(f"操作Milvus时出错: {str(e)}")
+            print("请检查Milvus服务器状态和配置")
+            raise
+    
+    def load_directory(self, directory, chunk_size=None, chunk_overlap=None, force_rebuild=False,
+                       max_workers=None, recursive=True, doc_type=None, progress_callback=None,
+                       cancel_event=None):
+        """
+        将目录树中的所有PDF导入同一个集合
         
-        print(f"加载PDF文件: {pdf_path}")
-        # 加载PDF文件
-        loader = PyPDFLoader(pdf_path)
-        docs = loader.load()
+        PDF解析和分块在进程池中跨CPU核心并行执行，主进程按完成顺序
+        流水线式地为每个文档生成嵌入并增量同步到集合。同时提交解析的文档数不超过进程数，
+        每取出一个文档的解析结果才提交下一个，已解析但尚未同步的分块不会在内存中堆积。
+        未变化的文档直接跳过，单个文档解析或同步失败时记录错误并继续处理其余文档。
         
-        # 将文档分割成块
-        print(f"将文档分割成块 (大小: {chunk_size}, 重叠: {chunk_overlap})...")
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-        chunks = text_splitter.split_documents(docs)
-        text_lines = [chunk.page_content for chunk in chunks]
+        Args:
+            directory: 要搜索PDF文件的目录
+            chunk_size: 分块大小（None表示使用配置文件中的值）
+            chunk_overlap: 分块重叠大小（None表示使用配置文件中的值）
+            force_rebuild: 是否强制重建集合，即使已存在
+            max_workers: 解析PDF的进程数（None表示使用CPU核心数）
+            recursive: 是否递归搜索子目录
+            doc_type: 所有文档的类型（None表示按文件扩展名推断）
+            progress_callback: 上报进度的函数，参数为 (阶段, 新完成数量, 总数或None)；
+                               parse阶段以文档为单位，其余阶段以块为单位
+            cancel_event: threading.Event，设置后在下一个文档或批次前抛出JobCancelled停止导入
+            
+        Returns:
+            dict: 各项统计数量
+        """
+        doc_config = self.config.get('rag', {}).get('documents', {})
+        chunk_size = chunk_size or doc_config.get('chunk_size', 1000)
+        chunk_overlap = chunk_overlap or doc_config.get('chunk_overlap', 200)
+        insert_batch_size = doc_config.get('insert_batch_size', 256)
         
-        # 获取嵌入维度
-        test_embedding = self.emb_text("测试文本")
-        embedding_dim = len(test_embedding)
+        pattern = '**/*.pdf' if recursive else '*.pdf'
+        pdf_paths = sorted(str(path) for path in Path(directory).glob(pattern))
+        if not pdf_paths:
+            print(f"在 {directory} 目录中未找到PDF文件")
+            return None
         
         try:
-            # 如果集合存在且强制重建，先删除
-            if collection_exists and force_rebuild:
-                print(f"删除现有集合: {self.collection_name}")
-                self.milvus_client.drop_collection(self.collection_name)
-                collection_exists = False
-            
-            # 如果集合不存在，创建新集合
-            if not collection_exists:
-                print(f"创建新集合: {self.collection_name}")
-                self.milvus_client.create_collection(
-                    collection_name=self.collection_name,
-                    dimension=embedding_dim,
-                    metric_type=self.metric_type,
-                    consistency_level=self.consistency_level,
-                )
+            manifest = self._read_manifest() if self._prepare_collection(force_rebuild) else {}
+            self._ensure_lexical_index()
+            
+            # 找出需要同步的文档
+            pending = {}
+            for pdf_path in pdf_paths:
+                source = os.path.abspath(pdf_path)
+                fingerprint = self._document_fingerprint(pdf_path, chunk_size, chunk_overlap)
+                if manifest.get(source) != fingerprint:
+                    pending[source] = fingerprint
             
-                # 准备数据并插入
-                print("生成嵌入并插入数据...")
-                data = []
-                for i, line in enumerate(tqdm(text_lines, desc="创建嵌入")):
-                    data.append({
-                        "id": i, 
-                        "vector": self.emb_text(line), 
-                        "text": line
-                    })
+            totals = {
+                "documents": len(pdf_paths),
+                "skipped": len(pdf_paths) - len(pending),
+                "failed": 0,
+                "inserted": 0,
+                "deleted": 0,
+                "unchanged": 0,
+            }
+            print(f"共找到 {len(pdf_paths)} 个PDF文件，其中 {len(pending)} 个需要同步")
+            if progress_callback:
+                progress_callback('parse', 0, len(pending))
+            
+            max_workers = max_workers or os.cpu_count() or 1
+            queued = iter(pending)
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                futures = {}
+                
+                def submit_next():
+                    source = next(queued, None)
+                    if source is not None:
+                        futures[executor.submit(load_pdf_chunks, source, chunk_size, chunk_overlap)] = source
                 
-                # 插入数据到Milvus
-                insert_res = self.milvus_client.insert(collection_name=self.collection_name, data=data)
-                print(f"成功插入 {insert_res['insert_count']} 条数据")
+                for _ in range(max_workers):
+                    submit_next()
+                while futures:
+                    future = next(as_completed(futures))
+                    source = futures.pop(future)
+                    if cancel_event is not None and cancel_event.is_set():
+                        # 尚未开始解析的文档不再处理，已同步的文档保留在清单中
+                        for other in futures:
+                            other.cancel()
+                        raise JobCancelled(f"导入目录 {directory} 已取消")
+                    # 当前文档的分块已取出，补充提交一个文档，保持进程池忙碌
+                    submit_next()
+                    
+                    try:
+                        chunks = future.result()
+                    except Exception as e:
+                        print(f"解析PDF {source} 时出错: {str(e)}")
+                        totals["failed"] += 1
+                        continue
+                    if progress_callback:
+                        progress_callback('parse', 1)
+                        progress_callback('split', len(chunks))
+                    
+                    print(f"同步文档: {source} ({len(chunks)} 个块)")
+                    try:
+                        result = self.sync_document(
+                            source, _batched(chunks, insert_batch_size), doc_type=doc_type,
+                            progress_callback=progress_callback, cancel_event=cancel_event
+                        )
+                    except JobCancelled:
+                        for other in futures:
+                            other.cancel()
+                        raise
+                    except Exception as e:
+                        # 清单未更新，下次导入时重新同步该文档
+                        print(f"同步文档 {source} 时出错: {str(e)}")
+                        totals["failed"] += 1
+                        continue
+                    for key, value in result.items():
+                        totals[key] += value
+                    
+                    manifest[source] = pending[source]
+                    self._write_manifest(manifest)
             
+            print(f"批量导入完成: 新增 {totals['inserted']} 条，删除 {totals['deleted']} 条，"
+                  f"跳过 {totals['skipped']} 个未变化的文档，失败 {totals['failed']} 个")
+            return totals
+            
+        except JobCancelled:
+            print(f"导入目录 {directory} 已取消，已同步的文档在下次导入时会被跳过")
+            raise
         except Exception as e:
             print(f"操作Milvus时出错: {str(e)}")
             print("请检查Milvus服务器状态和配置")
             raise
     
-    def retrieve(self, question, top_k=None):
+    def sync_document(self, source, chunk_batches, doc_type=None, progress_callback=None, cancel_event=None):
         """
-        检索与问题相关的文档
+        将一个文档的分块增量同步到集合
+        
+        每个块与来源文件、页码和文档类型一起保存，检索时可用过滤表达式按这些字段筛选；
+        启用partition_by_document时新增的块写入该文档的分区。
+        
+        Args:
+            source: 文档来源标识（文件绝对路径）
+            chunk_batches: 产出块列表的可迭代对象，每个块是包含text和page的字典
+            doc_type: 文档类型（None表示按文件扩展名推断）
+            progress_callback: 上报embed和insert阶段进度的函数，参数为 (阶段, 新完成数量)
+            cancel_event: threading.Event，设置后在下一个批次前抛出JobCancelled
+            
+        Returns:
+            dict: 新增、删除和未变化的块数量
+        """
+        from tqdm import tqdm
+        doc_type = doc_type or document_type(source)
+        partition_name = self._ensure_partition(source) if self.partition_by_document else None
+        insert_kwargs = {"partition_name": partition_name} if partition_name else {}
+        existing_ids = self._query_source_ids(source)
+        if partition_name and existing_ids:
+            self._move_to_partition(source, existing_ids, partition_name)
+        seen_ids = set()
+        inserted = 0
+        embed_progress = (lambda count: progress_callback('embed', count)) if progress_callback else None
+        
+        with tqdm(desc="导入数据", unit="条") as progress:
+            for chunks in chunk_batches:
+                if cancel_event is not None and cancel_event.is_set():
+                    # 已写入的块保持不变，清单未更新，下次导入时从断点继续
+                    self._finish_sync(inserted, [])
+                    raise JobCancelled(f"导入 {source} 已取消")
+                
+                # 计算稳定ID，跳过已存在的块和文档内重复的块
+                new_rows = []
+                for chunk in chunks:
+                    chunk_id = self.chunk_id(source, chunk["text"])
+                    if chunk_id in seen_ids:
+                        continue
+                    seen_ids.add(chunk_id)
+                    if chunk_id not in existing_ids:
+                        new_rows.append((chunk_id, chunk))
+                if progress_callback:
+                    progress_callback('embed', len(chunks) - len(new_rows))
+                
+                if new_rows:
+                    vectors = self.emb_texts([chunk["text"] for _, chunk in new_rows], progress_callback=embed_progress)
+                    data = [
+                        {
+                            "id": chunk_id,
+                            "vector": vector,
+                            "text": chunk["text"],
+                            "source": source,
+                            "page": chunk["page"],
+                            "doc_type": doc_type,
+                        }
+                        for (chunk_id, chunk), vector in zip(new_rows, vectors)
+                    ]
+                    insert_res = self.vector_store.insert(
+                        collection_name=self.collection_name, data=data, **insert_kwargs
+                    )
+                    inserted += insert_res['insert_count']
+                    if self.lexical_index is not None:
+                        self.lexical_index.add((row["id"], row["text"]) for row in data)
+                progress.update(len(chunks))
+                progress.set_postfix_str(f"新增 {inserted}")
+                if progress_callback:
+                    progress_callback('insert', len(chunks))
+        
+        # 删除文档中已不存在的块
+        stale_ids = list(existing_ids - seen_ids)
+        for start in range(0, len(stale_ids), 1000):
+            self.vector_store.delete(collection_name=self.collection_name, ids=stale_ids[start:start + 1000])
+        self._finish_sync(inserted, stale_ids)
+        
+        return {
+            "inserted": inserted,
+            "deleted": len(stale_ids),
+            "unchanged": len(seen_ids & existing_ids),
+        }
+    
+    def _finish_sync(self, inserted, stale_ids):
+        """集合内容已变化时保存BM25索引并清空检索缓存，之前的检索结果不再有效"""
+        if inserted or stale_ids:
+            if self.lexical_index is not None:
+                self.lexical_index.remove(stale_ids)
+                self.lexical_index.save()
+            self.invalidate_search_cache()
+    
+    def _move_to_partition(self, source, chunk_ids, partition_name):
+        """
+        把文档已有但不在其分区中的块移到该分区
+        对已有集合开启partition_by_document后，之前导入的块仍在默认分区，按分区检索时会漏掉它们。
+        主键在整个集合内唯一，因此先删除再连同向量写入目标分区，不需要重新生成嵌入
+        """
+        in_partition = {
+            row["id"]
+            for rows in self._iter_rows(
+                f'source == "{_escape_filter_value(source)}"', ["id"], partition_names=[partition_name]
+            )
+            for row in rows
+        }
+        outside = list(chunk_ids - in_partition)
+        if not outside:
+            return
+        print(f"将文档 {source} 已有的 {len(outside)} 个块移到分区 {partition_name}")
+        for start in range(0, len(outside), 1000):
+            batch = outside[start:start + 1000]
+            rows = self.vector_store.query(
+                collection_name=self.collection_name,
+                filter=f"id in [{', '.join(str(chunk_id) for chunk_id in batch)}]",
+                output_fields=["vector", "text", "source", "page", "doc_type"]
+            )
+            self.vector_store.delete(collection_name=self.collection_name, ids=[row["id"] for row in rows])
+            self.vector_store.insert(collection_name=self.collection_name, data=rows, partition_name=partition_name)
+        self.invalidate_search_cache()
+    
+    def _ensure_partition(self, source):
+        """返回文档的分区名，分区不存在时创建"""
+        partition_name = document_partition(source)
+        if not self.vector_store.has_partition(self.collection_name, partition_name):
+            self.vector_store.create_partition(self.collection_name, partition_name)
+        return partition_name
+    
+    @staticmethod
+    def chunk_id(source, text):
+        """根据来源文件和块内容生成稳定的64位ID"""
+        digest = hashlib.sha256(f"{source}\x00{text}".encode('utf-8')).digest()
+        return int.from_bytes(digest[:8], 'big') & 0x7FFFFFFFFFFFFFFF
+    
+    def _prepare_collection(self, force_rebuild=False):
+        """
+        确保集合存在，强制重建时先删除现有集合
+        
+        Returns:
+            bool: 集合是否为已有集合（False表示刚刚新建）
+        """
+        collection_exists = self.vector_store.has_collection(self.collection_name)
+        
+        # 如果集合存在且强制重建，先删除
+        if collection_exists and force_rebuild:
+            print(f"删除现有集合: {self.collection_name}")
+            self.vector_store.drop_collection(self.collection_name)
+            self._write_manifest({})
+            if self.lexical_index is not None:
+                self.lexical_index.clear()
+                self.lexical_index.save()
+            self.invalidate_search_cache()
+            collection_exists = False
+        
+        # 如果集合不存在，创建新集合
+        if not collection_exists:
+            self._create_collection()
+        else:
+            self._check_source_tagged()
+        return collection_exists
+    
+    def _check_source_tagged(self):
+        """
+        检查已有集合中的块是否带有来源信息
+        
+        旧版本按序号生成块ID且不保存来源文件，这样的集合无法按文档增量同步
+        （所有块都会被当作新块再次插入），需要重建后才能导入。
+        """
+        rows = self.vector_store.query(
+            collection_name=self.collection_name,
+            filter="id >= 0",
+            output_fields=["source"],
+            limit=1
+        )
+        if rows and not rows[0].get("source"):
+            raise RuntimeError(
+                f"集合 {self.collection_name} 由旧版本创建，块中没有来源文件信息，无法增量同步，"
+                f"请使用 --force-rebuild 重建集合"
+            )
+    
+    def _create_collection(self):
+        """创建新集合，维度由当前嵌入模型决定"""
+        # 获取嵌入维度
+        embedding_dim = len(self.emb_text("测试文本"))
+        print(f"创建新集合: {self.collection_name}")
+        if self.vector_backend != 'milvus':
+            self.vector_store.create_collection(
+                collection_name=self.collection_name,
+                dimension=embedding_dim,
+                metric_type=self.metric_type,
+                consistency_level=self.consistency_level,
+            )
+            return
+        
+        print(f"向量索引: {self.index_type} {self.index_params}")
+        schema, index_params = self._milvus_schema(embedding_dim)
+        self.vector_store.create_collection(
+            collection_name=self.collection_name,
+            schema=schema,
+            index_params=index_params,
+            consistency_level=self.consistency_level,
+        )
+    
+    def _milvus_schema(self, dimension):
+        """
+        Milvus集合的schema和索引参数
+        来源文件、页码和文档类型定义为标量字段，并为常用于过滤的source和doc_type建立倒排索引
+        """
+        from pymilvus import DataType
+        schema = self.vector_store.create_schema(auto_id=False, enable_dynamic_field=True)
+        schema.add_field(field_name="id", datatype=DataType.INT64, is_primary=True)
+        schema.add_field(field_name="vector", datatype=DataType.FLOAT_VECTOR, dim=dimension)
+        schema.add_field(field_name="text", datatype=DataType.VARCHAR, max_length=65535)
+        schema.add_field(field_name="source", datatype=DataType.VARCHAR, max_length=1024)
+        schema.add_field(field_name="page", datatype=DataType.INT64)
+        schema.add_field(field_name="doc_type", datatype=DataType.VARCHAR, max_length=64)
+        
+        index_params = self.vector_store.prepare_index_params()
+        index_params.add_index(
+            field_name="vector",
+            index_type=self.index_type,
+            metric_type=self.metric_type,
+            params=self.index_params
+        )
+        for field_name in ("source", "doc_type"):
+            index_params.add_index(field_name=field_name, index_type="INVERTED")
+        return schema, index_params
+    
+    def _query_source_ids(self, source):
+        """查询集合中属于指定文档的所有块ID"""
+        expr = f'source == "{_escape_filter_value(source)}"'
+        return {row["id"] for rows in self._iter_rows(expr, ["id"]) for row in rows}
+    
+    def _iter_rows(self, expr, output_fields, partition_names=None):
+        """按批次产出集合中满足过滤条件的行，指定partition_names时只查询这些分区"""
+        scope = {"partition_names": list(partition_names)} if partition_names else {}
+        if hasattr(self.vector_store, 'query_iterator'):
+            iterator = self.vector_store.query_iterator(
+                collection_name=self.collection_name,
+                batch_size=1000,
+                filter=expr,
+                output_fields=output_fields,
+                **scope
+            )
+            while True:
+                rows = iterator.next()
+                if not rows:
+                    iterator.close()
+                    break
+                yield rows
+        else:
+            # 旧版pymilvus没有query_iterator，按offset分页查询，offset+limit受最大结果数限制
+            batch_size, max_window = 1000, 16384
+            offset = 0
+            while True:
+                limit = min(batch_size, max_window - offset)
+                rows = self.vector_store.query(
+                    collection_name=self.collection_name,
+                    filter=expr,
+                    output_fields=output_fields,
+                    offset=offset,
+                    limit=limit,
+                    **scope
+                )
+                if rows:
+                    yield rows
+                offset += len(rows)
+                if len(rows) < limit:
+                    break
+                if offset >= max_window:
+                    raise RuntimeError(
+                        f"满足条件 {expr} 的行超过 {max_window} 条，当前pymilvus版本不支持query_iterator，"
+                        f"无法完整读取，请升级pymilvus"
+                    )
+    
+    def _ensure_lexical_index(self):
+        """
+        启用混合检索但BM25索引为空时（如刚开启该功能），从集合中已有的块重建索引
+        导入数据前和第一次混合检索前调用。BM25索引文件只应由导入数据的进程写入，
+        其他进程（如Gradio界面）在索引文件更新后自动重新加载
+        """
+        self._lexical_checked = True
+        if self.lexical_index is None or len(self.lexical_index):
+            return
+        stats = self.vector_store.get_collection_stats(self.collection_name)
+        if not int(stats.get('row_count', 0)):
+            return
+        print("BM25索引为空，从集合中已有的块构建索引...")
+        for rows in self._iter_rows("id >= 0", ["id", "text"]):
+            self.lexical_index.add((row["id"], row["text"]) for row in rows)
+        self.lexical_index.save()
+        print(f"BM25索引构建完成: {len(self.lexical_index)} 个块")
+    
+    def _document_fingerprint(self, pdf_path, chunk_size, chunk_overlap):
+        """描述文档内容和导入参数，用于判断文档是否需要重新同步"""
+        sha256 = hashlib.sha256()
+        with open(pdf_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha256.update(block)
+        fingerprint = {
+            "sha256": sha256.hexdigest(),
+            "chunk_size": chunk_size,
+            "chunk_overlap": chunk_overlap,
+            "embedding_model": self.embedding_model_name,
+        }
+        if self.partition_by_document:
+            # 开启按文档分区后已导入的文档需要再同步一次，把已有的块移到文档的分区
+            fingerprint["partition_by_document"] = True
+        return fingerprint
+    
+    def _manifest_path(self):
+        """当前集合的文档清单文件路径"""
+        state_dir = self.config.get('rag', {}).get('documents', {}).get('state_dir', 'ingest_state')
+        return os.path.join(state_dir, f"{self.collection_name}.json")
+    
+    def _read_manifest(self):
+        """读取已同步文档的清单，不存在时返回空字典"""
+        try:
+            with open(self._manifest_path(), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+    
+    def _write_manifest(self, manifest):
+        """原子地写入文档清单"""
+        path = self._manifest_path()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, path)
+    
+    def invalidate_search_cache(self):
+        """清空检索结果缓存（集合内容变化时调用）"""
+        if self.search_cache:
+            self.search_cache.clear()
+    
+    def cache_stats(self):
+        """
+        返回各级缓存的命中统计，用于调整缓存大小
+        
+        Returns:
+            dict: 缓存名称到统计信息的映射
+        """
+        stats = {}
+        if self.query_embedding_cache:
+            stats['query_embedding'] = self.query_embedding_cache.stats()
+        if self.search_cache:
+            stats['search'] = self.search_cache.stats()
+        if self.embedding_cache:
+            stats['embedding'] = self.embedding_cache.stats()
+        return stats
+    
+    def rerank_stats(self):
+        """返回重排序的调用次数、跳过次数和耗时分布，未启用重排序时返回None"""
+        return self.reranker.stats() if self.reranker else None
+    
+    @staticmethod
+    def _normalize_question(question):
+        """规范化问题文本（折叠空白、忽略大小写），作为查询缓存的键"""
+        return " ".join(question.split()).casefold()
+    
+    def embed_query(self, question):
+        """生成问题的嵌入向量，重复的问题直接使用缓存"""
+        with metrics.span('embed'):
+            if not self.query_embedding_cache:
+                return self.emb_text(question)
+            
+            key = (self.embedding_model_name, self._normalize_question(question))
+            embedding = self.query_embedding_cache.get(key)
+            metrics.record_cache('query_embedding', embedding is not None)
+            if embedding is None:
+                embedding = self.emb_text(question)
+                self.query_embedding_cache.put(key, embedding)
+            return embedding
+    
+    def embed_queries(self, questions):
+        """批量生成问题的嵌入向量，只为缓存未命中的问题调用嵌入模型"""
+        with metrics.span('embed'):
+            if not self.query_embedding_cache:
+                return self.emb_texts(questions)
+            
+            keys = [(self.embedding_model_name, self._normalize_question(q)) for q in questions]
+            embeddings = [self.query_embedding_cache.get(key) for key in keys]
+            missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+            metrics.record_cache('query_embedding', True, len(keys) - len(missing))
+            metrics.record_cache('query_embedding', False, len(missing))
+            if missing:
+                computed = self.emb_texts([questions[i] for i in missing])
+                for i, embedding in zip(missing, computed):
+                    embeddings[i] = embedding
+                    self.query_embedding_cache.put(keys[i], embedding)
+            return embeddings
+    
+    def _search_cache_key(self, embedding, top_k, filter=None, partition_names=None):
+        """检索结果缓存的键：(向量摘要, top_k, 集合, 过滤表达式, 分区)"""
+        digest = hashlib.sha1(array('f', embedding).tobytes()).hexdigest()
+        return (digest, top_k, self.collection_name, filter or '', tuple(partition_names or ()))
+    
+    def search(self, question, top_k=None, filter=None, partition_names=None):
+        """
+        检索与问题相关的文档块，返回结构化结果
         
         Args:
             question: 问题文本
             top_k: 返回前k个结果（None表示使用配置文件中的值）
+            filter: 标量过滤表达式，如 'doc_type == "pdf" and page < 10'（None表示不过滤）
+            partition_names: 只搜索这些分区（None表示搜索整个集合）
             
         Returns:
-            检索到的文档文本
+            dict: embedding为问题的嵌入向量，hits为包含id、text和distance的结果列表
         """
         # 使用配置文件中的值（如果未指定）
         top_k = top_k or self.top_k
         
         # 将问题转换为嵌入向量
-        question_embedding = self.emb_text(question)
+        question_embedding = self.embed_query(question)
         
-        # 在Milvus中搜索相似向量
-        search_res = self.milvus_client.search(
-            collection_name=self.collection_name,
-            data=[question_embedding],
-            limit=top_k,
-            search_params={"metric_type": self.metric_type, "params": {}},
-            output_fields=["text"],
+        # 相同的查询向量直接返回缓存的检索结果
+        cache_key = self._search_cache_key(question_embedding, top_k, filter, partition_names)
+        hits = self.search_cache.get(cache_key) if self.search_cache else None
+        if self.search_cache:
+            metrics.record_cache('search', hits is not None)
+        
+        if hits is None:
+            # 在Milvus中搜索相似向量
+            with metrics.span('search'):
+                search_res = self.vector_store.search(**self._search_kwargs(
+                    [question_embedding], self._dense_limit(top_k),
+                    filter=filter, partition_names=partition_names
+                ))
+            hits = self._collect_hits([question], search_res, top_k, filter, partition_names)[0]
+            if self.search_cache:
+                self.search_cache.put(cache_key, hits)
+        
+        return {"embedding": question_embedding, "hits": hits}
+    
+    def _search_kwargs(self, vectors, top_k, search_params=None, filter=None, partition_names=None):
+        """构建向量搜索请求参数，search_params为None时使用配置中的搜索参数"""
+        params = self.search_params if search_params is None else search_params
+        kwargs = {
+            "collection_name": self.collection_name,
+            "data": vectors,
+            "limit": top_k,
+            "search_params": {"metric_type": self.metric_type, "params": dict(params)},
+            "output_fields": ["text"],
+        }
+        if filter:
+            kwargs["filter"] = filter
+        if partition_names:
+            kwargs["partition_names"] = list(partition_names)
+        return kwargs
+    
+    @staticmethod
+    def _parse_hits(results):
+        """将Milvus的单个查询结果转换为简单字典列表"""
+        return [
+            {"id": res["id"], "text": res["entity"]["text"], "distance": res["distance"]}
+            for res in results
+        ]
+    
+    def _dense_limit(self, top_k):
+        """向量检索的返回数量，混合检索或重排序时多取一些候选"""
+        limit = top_k
+        if self.lexical_index is not None:
+            limit = max(limit, self.hybrid_candidates)
+        if self.reranker is not None:
+            limit = max(limit, self.rerank_candidates)
+        return limit
+    
+    def _collect_hits(self, questions, search_res, top_k, filter=None, partition_names=None):
+        """
+        将向量搜索结果转换为每个问题的命中列表
+        启用混合检索时与BM25结果融合（BM25结果同样限定在过滤条件和分区内），
+        启用重排序时对候选重新打分后截取前top_k个
+        
+        Returns:
+            与问题顺序一致的命中列表
+        """
+        hits_list = [self._parse_hits(results) for results in search_res]
+        if self.lexical_index is None and self.reranker is None:
+            return hits_list
+        
+        pool_size = max(top_k, self.rerank_candidates) if self.reranker is not None else top_k
+        collected = []
+        for question, hits in zip(questions, hits_list):
+            if self.lexical_index is not None:
+                with metrics.span('lexical_search'):
+                    hits = self._fuse_hits(question, hits, pool_size, filter, partition_names)
+            if self.reranker is not None:
+                with metrics.span('rerank'):
+                    hits = self.reranker.rerank(question, hits, top_k)
+            collected.append(hits[:top_k])
+        return collected
+    
+    def _fuse_hits(self, question, dense_hits, top_k, filter=None, partition_names=None):
+        """
+        用加权倒数排名融合(RRF)合并向量检索和BM25检索的结果
+        
+        融合后hit的distance为RRF得分（越大越相关）。
+        """
+        if not self._lexical_checked:
+            with self._lexical_lock:
+                if not self._lexical_checked and self.vector_store.has_collection(self.collection_name):
+                    self._ensure_lexical_index()
+        lexical_hits = self.lexical_index.search(question, max(top_k, self.hybrid_candidates))
+        found = {hit["id"]: hit for hit in dense_hits}
+        if filter or partition_names:
+            # BM25索引覆盖整个集合，先取回只被BM25命中的块，不在检索范围内的取不到，直接丢弃
+            self._fetch_hits(found, [chunk_id for chunk_id, _ in lexical_hits], filter, partition_names)
+            lexical_hits = [(chunk_id, score) for chunk_id, score in lexical_hits if chunk_id in found]
+        
+        scores = {}
+        for rank, hit in enumerate(dense_hits):
+            scores[hit["id"]] = scores.get(hit["id"], 0.0) + self.dense_weight / (self.hybrid_rrf_k + rank + 1)
+        for rank, (chunk_id, _) in enumerate(lexical_hits):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + self.lexical_weight / (self.hybrid_rrf_k + rank + 1)
+        
+        ranked = sorted(scores, key=scores.get, reverse=True)[:top_k]
+        # 只被BM25命中的块需要从集合中取回文本
+        self._fetch_hits(found, ranked)
+        # 索引与集合不同步时，集合中已不存在的块直接跳过
+        return [
+            {"id": chunk_id, "text": found[chunk_id]["text"], "distance": scores[chunk_id]}
+            for chunk_id in ranked if chunk_id in found
+        ]
+    
+    def _fetch_hits(self, found, ids, filter=None, partition_names=None):
+        """从集合中取回found中还没有的块，指定过滤条件或分区时只取回范围内的块"""
+        missing = [chunk_id for chunk_id in ids if chunk_id not in found]
+        if not missing:
+            return
+        if filter or partition_names:
+            expr = f"id in [{', '.join(str(chunk_id) for chunk_id in missing)}]"
+            kwargs = {"filter": f"{expr} and ({filter})" if filter else expr}
+            if partition_names:
+                kwargs["partition_names"] = list(partition_names)
+        else:
+            kwargs = {"ids": missing}
+        rows = self.vector_store.query(
+            collection_name=self.collection_name, output_fields=["text"], **kwargs
         )
+        found.update((row["id"], row) for row in rows)
+    
+    def retrieve(self, question, top_k=None, filter=None, partition_names=None):
+        """
+        检索与问题相关的文档
         
-        # 提取检索到的文本
-        retrieved_lines = [res["entity"]["text"] for res in search_res[0]]
+        Args:
+            question: 问题文本
+            top_k: 返回前k个结果（None表示使用配置文件中的值）
+            filter: 标量过滤表达式，可按source、page和doc_type筛选（None表示不过滤）
+            partition_names: 只搜索这些分区（None表示搜索整个集合）
+            
+        Returns:
+            检索到的文档文本
+        """
+        search_result = self.search(question, top_k, filter, partition_names)
+        
+        # 将检索到的文本组装为一个字符串
+        return self.build_context(search_result["hits"], search_result["embedding"])[0]
+    
+    def build_context(self, hits, query_embedding=None):
+        """
+        将检索结果组装为提示中的上下文
+        
+        Args:
+            hits: search返回的检索结果
+            query_embedding: 问题的嵌入向量，用于MMR去冗余
+            
+        Returns:
+            tuple: (上下文文本, 实际使用的块列表)
+        """
+        if self.context_builder is None:
+            return "\n".join(hit["text"] for hit in hits), hits
+        hit_vectors = None
+        if self._needs_hit_vectors(hits, query_embedding):
+            hit_vectors = self.emb_texts([hit["text"] for hit in hits])
+        return self.context_builder.build(hits, query_embedding, hit_vectors)
+    
+    def _needs_hit_vectors(self, hits, query_embedding):
+        """
+        MMR需要候选块的向量。检索时不返回存储的向量（避免传输并缓存大量浮点数），
+        而是在组装上下文时重新嵌入候选块；导入时已写入嵌入缓存，通常直接命中缓存
+        """
+        return query_embedding is not None and self.context_builder.uses_mmr(len(hits))
+    
+    def retrieve_many(self, questions, top_k=None, filter=None, partition_names=None):
+        """
+        批量检索多个问题的相关文档
+        
+        所有问题的嵌入通过一次批量调用生成，并在一次多向量搜索中完成检索。
+        
+        Args:
+            questions: 问题文本列表
+            top_k: 每个问题返回前k个结果（None表示使用配置文件中的值）
+            filter: 所有问题共用的标量过滤表达式（None表示不过滤）
+            partition_names: 只搜索这些分区（None表示搜索整个集合）
+            
+        Returns:
+            与问题顺序一致的检索文本列表
+        """
+        questions = list(questions)
+        if not questions:
+            return []
+        top_k = top_k or self.top_k
+        
+        # 批量生成所有问题的嵌入向量
+        question_embeddings = self.embed_queries(questions)
+        
+        # 一次搜索多个查询向量
+        with metrics.span('search'):
+            search_res = self.vector_store.search(**self._search_kwargs(
+                question_embeddings, self._dense_limit(top_k),
+                filter=filter, partition_names=partition_names
+            ))
+        
+        hits_list = self._collect_hits(questions, search_res, top_k, filter, partition_names)
+        return [
+            self.build_context(hits, embedding)[0]
+            for hits, embedding in zip(hits_list, question_embeddings)
+        ]
+
+
+class AsyncRAGSystem(RAGSystem):
+    """
+    RAG系统的异步版本
+    
+    检索路径（嵌入、向量搜索）基于AsyncOpenAI和AsyncMilvusClient，多个并发请求
+    共享同一个事件循环和连接池；数据导入等方法沿用同步实现。
+    """
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.async_openai_client = None
+        if self.use_openai_embeddings:
+            self.async_openai_client = self._acquire_openai_client(asynchronous=True)
+        self._async_milvus_client = None
+        self.async_embedding_coalescer = None
+        if self.embedding_coalescer:
+            self.async_embedding_coalescer = AsyncEmbeddingCoalescer(
+                lambda texts: self._acompute_embeddings(texts, len(texts)),
+                window_ms=self.coalesce_window_ms,
+                max_batch_size=self.coalesce_max_batch_size
+            )
+    
+    def _get_async_milvus_client(self):
+        """在事件循环中延迟创建异步Milvus客户端，不支持时返回None"""
+        if self.vector_backend != 'milvus':
+            return None
+        if self._async_milvus_client is None:
+            try:
+                from pymilvus import AsyncMilvusClient
+            except ImportError:
+                # 旧版pymilvus没有异步客户端，退回到在线程中调用同步后端
+                return None
+            self._async_milvus_client = self._acquire_shared(
+                'async_milvus', self.milvus_params, lambda: AsyncMilvusClient(**self.milvus_params)
+            )
+        return self._async_milvus_client
+    
+    async def aemb_text(self, text):
+        """异步生成文本的嵌入向量"""
+        return (await self.aemb_texts([text]))[0]
+    
+    async def aemb_texts(self, texts, batch_size=None):
+        """
+        异步批量生成文本的嵌入向量
+        
+        Args:
+            texts: 文本列表
+            batch_size: 每个请求包含的文本数（None表示使用配置文件中的值）
+            
+        Returns:
+            与输入顺序一致的嵌入向量列表
+        """
+        texts = list(texts)
+        if not texts:
+            return []
+        batch_size = batch_size or self.embedding_batch_size
+        model_name = self.embedding_model_name
+        
+        # SQLite缓存的读写是阻塞的磁盘I/O，放到线程中执行以免阻塞事件循环
+        cached = {}
+        if self.embedding_cache:
+            cached = await asyncio.to_thread(self.embedding_cache.get_many, model_name, texts)
+        missing = list(dict.fromkeys(text for text in texts if text not in cached))
+        if self.embedding_cache:
+            metrics.record_cache('embedding', True, len(texts) - len(missing))
+            metrics.record_cache('embedding', False, len(missing))
+        if missing:
+            if len(missing) == 1 and self.async_embedding_coalescer:
+                # 单条查询与同时到达的其他请求合并成一次批量调用
+                embeddings = [await self.async_embedding_coalescer.embed(missing[0])]
+            else:
+                embeddings = await self._acompute_embeddings(missing, batch_size)
+            computed = list(zip(missing, embeddings))
+            if self.embedding_cache:
+                await asyncio.to_thread(self.embedding_cache.put_many, model_name, computed)
+            cached.update(computed)
+        return [cached[text] for text in texts]
+    
+    async def _acompute_embeddings(self, texts, batch_size):
+        """调用嵌入模型生成向量，OpenAI的多个批次并发发送"""
+        if not self.use_openai_embeddings:
+            # 本地模型为CPU密集型计算，放到线程中执行以免阻塞事件循环
+            return await asyncio.to_thread(self._compute_embeddings, texts, batch_size)
+        
+        if self.embedding_scheduler:
+            # 与同步路径共用调度器的限流预算（每分钟请求数、token数）和429退避
+            return await self.embedding_scheduler.aembed(self.async_openai_client, texts, batch_size)
+        
+        semaphore = asyncio.Semaphore(max(1, self.embedding_concurrency))
+        
+        async def embed_batch(batch):
+            async with semaphore:
+                response = await self.retry_policy.acall(
+                    self.async_openai_client.embeddings.create,
+                    model=self.openai_model,
+                    input=batch,
+                    timeout=self.embedding_timeout
+                )
+            return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
         
-        # 将检索到的文本合并为一个字符串
-        return "\n".join(retrieved_lines)
+        batches = [texts[start:start + batch_size] for start in range(0, len(texts), batch_size)]
+        results = await asyncio.gather(*(embed_batch(batch) for batch in batches))
+        return [embedding for batch in results for embedding in batch]
+    
+    async def aembed_query(self, question):
+        """异步生成问题的嵌入向量，重复的问题直接使用缓存"""
+        return (await self.aembed_queries([question]))[0]
+    
+    async def aembed_queries(self, questions):
+        """异步批量生成问题的嵌入向量，只为缓存未命中的问题调用嵌入模型"""
+        with metrics.span('embed'):
+            if not self.query_embedding_cache:
+                return await self.aemb_texts(questions)
+            
+            keys = [(self.embedding_model_name, self._normalize_question(q)) for q in questions]
+            embeddings = [self.query_embedding_cache.get(key) for key in keys]
+            missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+            metrics.record_cache('query_embedding', True, len(keys) - len(missing))
+            metrics.record_cache('query_embedding', False, len(missing))
+            if missing:
+                computed = await self.aemb_texts([questions[i] for i in missing])
+                for i, embedding in zip(missing, computed):
+                    embeddings[i] = embedding
+                    self.query_embedding_cache.put(keys[i], embedding)
+            return embeddings
+    
+    async def _asearch_vectors(self, vectors, top_k, filter=None, partition_names=None):
+        """异步执行向量搜索，没有异步客户端时（本地索引或旧版pymilvus）在线程中调用同步后端"""
+        kwargs = self._search_kwargs(vectors, top_k, filter=filter, partition_names=partition_names)
+        client = self._get_async_milvus_client()
+        with metrics.span('search'):
+            if client is not None:
+                return await client.search(**kwargs)
+            return await asyncio.to_thread(self.vector_store.search, **kwargs)
+    
+    async def _acollect_hits(self, questions, search_res, top_k, filter=None, partition_names=None):
+        """异步版本的_collect_hits，融合时取回文本的查询和重排序模型推理在线程中执行"""
+        if self.lexical_index is None and self.reranker is None:
+            return self._collect_hits(questions, search_res, top_k)
+        return await asyncio.to_thread(
+            self._collect_hits, questions, search_res, top_k, filter, partition_names
+        )
+    
+    async def asearch(self, question, top_k=None, filter=None, partition_names=None):
+        """
+        异步检索与问题相关的文档块
+        
+        Returns:
+            dict: embedding为问题的嵌入向量，hits为包含id、text和distance的结果列表
+        """
+        top_k = top_k or self.top_k
+        question_embedding = await self.aembed_query(question)
+        
+        cache_key = self._search_cache_key(question_embedding, top_k, filter, partition_names)
+        hits = self.search_cache.get(cache_key) if self.search_cache else None
+        if self.search_cache:
+            metrics.record_cache('search', hits is not None)
+        if hits is None:
+            search_res = await self._asearch_vectors(
+                [question_embedding], self._dense_limit(top_k), filter, partition_names
+            )
+            hits = (await self._acollect_hits([question], search_res, top_k, filter, partition_names))[0]
+            if self.search_cache:
+                self.search_cache.put(cache_key, hits)
+        
+        return {"embedding": question_embedding, "hits": hits}
+    
+    async def abuild_context(self, hits, query_embedding=None):
+        """异步版本的build_context，MMR需要的候选块向量通过异步嵌入接口获取"""
+        if self.context_builder is None:
+            return "\n".join(hit["text"] for hit in hits), hits
+        hit_vectors = None
+        if self._needs_hit_vectors(hits, query_embedding):
+            hit_vectors = await self.aemb_texts([hit["text"] for hit in hits])
+        return self.context_builder.build(hits, query_embedding, hit_vectors)
+    
+    async def aretrieve(self, question, top_k=None, filter=None, partition_names=None):
+        """异步检索与问题相关的文档，返回组装后的上下文"""
+        search_result = await self.asearch(question, top_k, filter, partition_names)
+        return (await self.abuild_context(search_result["hits"], search_result["embedding"]))[0]
+    
+    async def aretrieve_many(self, questions, top_k=None, filter=None, partition_names=None):
+        """异步批量检索多个问题的相关文档"""
+        questions = list(questions)
+        if not questions:
+            return []
+        top_k = top_k or self.top_k
+        
+        question_embeddings = await self.aembed_queries(questions)
+        search_res = await self._asearch_vectors(
+            question_embeddings, self._dense_limit(top_k), filter, partition_names
+        )
+        hits_list = await self._acollect_hits(questions, search_res, top_k, filter, partition_names)
+        return [
+            (await self.abuild_context(hits, embedding))[0]
+            for hits, embedding in zip(hits_list, question_embeddings)
+        ]
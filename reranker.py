@@ -0,0 +1,111 @@
+import threading
+import time
+from collections import deque
+
+
+class CrossEncoderReranker:
+    """
+    交叉编码器重排序
+    对向量检索多取回的候选块，将 (问题, 块文本) 对一次性批量送入本地交叉编码器打分，
+    只保留得分最高的k个。根据历史耗时估计每对的打分开销，预计超出延迟预算时
+    减少参与重排序的候选数，连k+1个候选都放不下时跳过重排序，保证不增加尾延迟。
+    """
+
+    def __init__(self, model_name='cross-encoder/ms-marco-MiniLM-L-6-v2', batch_size=32,
+                 budget_ms=150, max_length=512, device=None):
+        """
+        Args:
+            model_name: 交叉编码器模型名称
+            batch_size: 模型推理的批大小
+            budget_ms: 单次重排序的延迟预算（毫秒，None表示不限制）
+            max_length: 每对输入的最大token数
+            device: 推理设备（None表示自动选择）
+        """
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.budget_ms = budget_ms
+        # 只有启用重排序时才导入sentence_transformers（及torch）
+        from sentence_transformers import CrossEncoder
+        self.model = CrossEncoder(model_name, max_length=max_length, device=device)
+        self._lock = threading.Lock()
+        # 每对候选的平均打分耗时（毫秒），指数滑动平均
+        self._pair_cost_ms = None
+        self._latencies = deque(maxlen=1024)
+        self.calls = 0
+        self.skipped = 0
+        self.truncated = 0
+        self.pairs = 0
+
+    def _affordable_candidates(self, count):
+        """根据延迟预算计算本次最多能重排序的候选数"""
+        with self._lock:
+            if self.budget_ms is None or self._pair_cost_ms is None:
+                return count
+            return min(count, int(self.budget_ms / self._pair_cost_ms))
+
+    def rerank(self, query, hits, top_k):
+        """
+        对检索结果重排序
+
+        Args:
+            query: 问题文本
+            hits: 按向量检索排序的候选块，每个是包含text的字典
+            top_k: 保留的块数
+
+        Returns:
+            重排序后的前top_k个块，每个块增加rerank_score字段；跳过重排序时返回原顺序的前top_k个
+        """
+        if len(hits) <= max(1, top_k):
+            # 候选不多于要保留的数量，重排序不会改变保留哪些块
+            return hits[:top_k]
+
+        limit = self._affordable_candidates(len(hits))
+        if limit <= top_k:
+            # 预算内无法比原排序做得更好，直接使用向量检索的顺序；
+            # 同时逐步调低耗时估计，偶发的慢调用过后能重新启用重排序
+            with self._lock:
+                self.skipped += 1
+                if self._pair_cost_ms is not None:
+                    self._pair_cost_ms *= 0.9
+            return hits[:top_k]
+
+        candidates = hits[:limit]
+        start = time.perf_counter()
+        scores = self.model.predict(
+            [(query, hit["text"]) for hit in candidates],
+            batch_size=self.batch_size,
+            show_progress_bar=False
+        )
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        with self._lock:
+            pair_cost = elapsed_ms / len(candidates)
+            if self._pair_cost_ms is None:
+                self._pair_cost_ms = pair_cost
+            else:
+                self._pair_cost_ms = 0.8 * self._pair_cost_ms + 0.2 * pair_cost
+            self._latencies.append(elapsed_ms)
+            self.calls += 1
+            self.pairs += len(candidates)
+            if limit < len(hits):
+                self.truncated += 1
+
+        ranked = sorted(zip(candidates, scores), key=lambda item: item[1], reverse=True)
+        return [dict(hit, rerank_score=float(score)) for hit, score in ranked[:top_k]]
+
+    def stats(self):
+        """返回重排序的调用次数、跳过次数和耗时分布"""
+        with self._lock:
+            latencies = sorted(self._latencies)
+            stats = {
+                "calls": self.calls,
+                "skipped": self.skipped,
+                "truncated": self.truncated,
+                "pairs": self.pairs,
+                "pair_cost_ms": self._pair_cost_ms,
+            }
+        if latencies:
+            stats["p50_ms"] = latencies[len(latencies) // 2]
+            stats["p95_ms"] = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            stats["max_ms"] = latencies[-1]
+        return stats
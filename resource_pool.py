@@ -0,0 +1,373 @@
+import asyncio
+import json
+import random
+import threading
+import time
+import httpx
+from openai import (
+    OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient,
+    APIConnectionError, InternalServerError, RateLimitError
+)
+
+
+class SharedResourcePool:
+    """
+    引用计数的共享资源池
+    相同键的资源只创建一次，由所有使用者共享；最后一个使用者释放后关闭资源
+    """
+
+    def __init__(self):
+        self._resources = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key, factory):
+        """
+        获取共享资源，不存在时调用factory创建
+
+        Args:
+            key: 资源键（可哈希）
+            factory: 创建资源的无参函数
+
+        Returns:
+            共享的资源实例
+        """
+        with self._lock:
+            entry = self._resources.get(key)
+            if entry is not None:
+                entry[1] += 1
+                return entry[0]
+
+        # 在锁外创建资源，避免加载模型等耗时操作阻塞其他键
+        resource = factory()
+        with self._lock:
+            entry = self._resources.get(key)
+            if entry is not None:
+                # 其他线程已抢先创建，丢弃本次创建的实例
+                entry[1] += 1
+                duplicate, resource = resource, entry[0]
+            else:
+                self._resources[key] = [resource, 1]
+                duplicate = None
+        if duplicate is not None:
+            _close_resource(duplicate)
+        return resource
+
+    def get(self, key):
+        """查看已存在的资源（不增加引用计数），不存在返回None"""
+        with self._lock:
+            entry = self._resources.get(key)
+            return entry[0] if entry else None
+
+    def release(self, key):
+        """释放一次引用，引用计数归零时关闭并移除资源"""
+        with self._lock:
+            entry = self._resources.get(key)
+            if entry is None:
+                return
+            entry[1] -= 1
+            if entry[1] > 0:
+                return
+            del self._resources[key]
+        _close_resource(entry[0])
+
+    def stats(self):
+        """返回每个资源键的引用计数"""
+        with self._lock:
+            return {key: entry[1] for key, entry in self._resources.items()}
+
+
+def _close_resource(resource):
+    """尽力关闭资源，同步和异步客户端都可能没有同步的close方法"""
+    close = getattr(resource, 'close', None)
+    if not callable(close):
+        return
+    try:
+        result = close()
+        # 异步客户端（AsyncOpenAI、AsyncMilvusClient）的close返回协程
+        if asyncio.iscoroutine(result):
+            _run_async_close(result)
+    except Exception as e:
+        print(f"关闭共享资源时出错: {str(e)}")
+
+
+# 正在执行的异步关闭任务，保持引用以免任务被垃圾回收
+_closing_tasks = set()
+
+
+async def _await_close(coroutine):
+    try:
+        await coroutine
+    except Exception as e:
+        print(f"关闭共享资源时出错: {str(e)}")
+
+
+def _run_async_close(coroutine):
+    """
+    执行异步客户端的关闭协程，确保连接池真正关闭：
+    在事件循环中释放时（如Gradio的异步处理函数）调度到该事件循环，否则在当前线程中运行完
+    """
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+    if loop is None:
+        asyncio.run(_await_close(coroutine))
+        return
+    task = loop.create_task(_await_close(coroutine))
+    _closing_tasks.add(task)
+    task.add_done_callback(_closing_tasks.discard)
+
+
+def make_key(kind, params):
+    """根据资源类型和参数生成稳定的资源键"""
+    return (kind, json.dumps(params, sort_keys=True, default=str))
+
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态，调用被直接拒绝"""
+
+
+class CircuitBreaker:
+    """
+    熔断器
+    连续失败达到阈值后打开，在reset_timeout秒内直接拒绝调用，不再等待已经降级的上游；
+    之后进入半开状态，只放行一个探测请求，成功则关闭，失败则重新打开。
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        """
+        Args:
+            name: 熔断器名称（用于日志）
+            failure_threshold: 打开熔断器所需的连续失败次数
+            reset_timeout: 打开后多少秒进入半开状态
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        """当前状态：closed、open或half_open"""
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return 'half_open'
+            return 'open'
+
+    def check(self):
+        """调用前检查，熔断器打开时抛出CircuitOpenError"""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            remaining = self.reset_timeout - (time.monotonic() - self._opened_at)
+            if remaining <= 0 and not self._probing:
+                self._probing = True
+                return
+        raise CircuitOpenError(f"{self.name} 熔断中，{max(remaining, 0):.1f} 秒后重试")
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                print(f"{self.name} 已恢复，关闭熔断器")
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or (self._opened_at is None and self._failures >= self.failure_threshold):
+                print(f"{self.name} 连续失败 {self._failures} 次，熔断 {self.reset_timeout} 秒")
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+
+# 可重试的OpenAI错误（APIConnectionError包括超时），其中限流不视为上游故障
+RETRYABLE_ERRORS = (APIConnectionError, InternalServerError, RateLimitError)
+FAILURE_ERRORS = (APIConnectionError, InternalServerError)
+
+
+class RetryPolicy:
+    """
+    带抖动指数退避的重试策略，可选地与熔断器配合
+    等待时间在[0, min(max_delay, base_delay * 2^attempt)]内随机（full jitter），
+    避免大量请求在上游恢复时同时重试；服务端返回retry-after时优先使用。
+    """
+
+    def __init__(self, max_retries=2, base_delay=0.5, max_delay=8.0, breaker=None,
+                 retryable=RETRYABLE_ERRORS, failures=FAILURE_ERRORS):
+        """
+        Args:
+            max_retries: 最大重试次数
+            base_delay: 退避的初始等待秒数
+            max_delay: 单次等待的最大秒数
+            breaker: 可选的CircuitBreaker
+            retryable: 可重试的异常类型
+            failures: 计入熔断器失败次数的异常类型
+        """
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker
+        self.retryable = retryable
+        self.failures = failures
+
+    def delay(self, attempt, error=None):
+        """计算第attempt次重试前的等待秒数"""
+        response = getattr(error, 'response', None)
+        if response is not None:
+            try:
+                retry_after = response.headers.get('retry-after')
+                if retry_after is not None:
+                    return min(self.max_delay, float(retry_after))
+            except (AttributeError, ValueError):
+                pass
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def _before(self):
+        if self.breaker:
+            self.breaker.check()
+
+    def _on_error(self, attempt, error):
+        """记录失败，返回重试前的等待秒数，不应重试时返回None"""
+        if self.breaker:
+            if isinstance(error, self.failures):
+                self.breaker.record_failure()
+            else:
+                # 参数错误、限流等说明上游仍在正常响应
+                self.breaker.record_success()
+        if not isinstance(error, self.retryable) or attempt >= self.max_retries:
+            return None
+        return self.delay(attempt, error)
+
+    def call(self, func, *args, **kwargs):
+        """调用func，失败时按策略重试"""
+        attempt = 0
+        while True:
+            self._before()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                delay = self._on_error(attempt, e)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                continue
+            if self.breaker:
+                self.breaker.record_success()
+            return result
+
+    async def acall(self, func, *args, **kwargs):
+        """异步版本的call，func返回可等待对象"""
+        attempt = 0
+        while True:
+            self._before()
+            try:
+                result = await func(*args, **kwargs)
+            except Exception as e:
+                delay = self._on_error(attempt, e)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            if self.breaker:
+                self.breaker.record_success()
+            return result
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(name, failure_threshold=5, reset_timeout=30.0):
+    """按名称获取进程内共享的熔断器（同一上游的所有客户端共用一个）"""
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(name, failure_threshold, reset_timeout)
+        return breaker
+
+
+def create_retry_policy(http_config, name):
+    """
+    根据配置创建重试策略
+
+    Args:
+        http_config: 配置文件中的http部分
+        name: 上游名称，相同名称的策略共享一个熔断器
+    """
+    retry_config = http_config.get('retry', {})
+    breaker_config = http_config.get('circuit_breaker', {})
+    breaker = None
+    if breaker_config.get('enabled', True):
+        breaker = get_circuit_breaker(
+            name,
+            failure_threshold=breaker_config.get('failure_threshold', 5),
+            reset_timeout=breaker_config.get('reset_timeout', 30.0)
+        )
+    return RetryPolicy(
+        max_retries=retry_config.get('max_retries', 2),
+        base_delay=retry_config.get('base_delay', 0.5),
+        max_delay=retry_config.get('max_delay', 8.0),
+        breaker=breaker
+    )
+
+
+def _http_client_options(http_config):
+    """根据配置生成httpx客户端的连接池、keep-alive、HTTP/2和超时参数"""
+    http2 = http_config.get('http2', False)
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            print("未安装h2，无法启用HTTP/2（pip install httpx[http2]），使用HTTP/1.1")
+            http2 = False
+    return {
+        'limits': httpx.Limits(
+            max_connections=http_config.get('max_connections', 100),
+            max_keepalive_connections=http_config.get('max_keepalive_connections', 20),
+            keepalive_expiry=http_config.get('keepalive_expiry', 30.0)
+        ),
+        'timeout': httpx.Timeout(
+            http_config.get('timeout', 60.0), connect=http_config.get('connect_timeout', 5.0)
+        ),
+        'http2': http2,
+    }
+
+
+def create_openai_client(client_params, http_config=None, asynchronous=False):
+    """
+    创建使用可调连接池的OpenAI客户端
+    重试由RetryPolicy统一负责（带抖动和熔断），SDK自身的重试关闭，避免两层重试叠加。
+
+    Args:
+        client_params: api_key、base_url、organization等参数
+        http_config: 配置文件中的http部分
+        asynchronous: 是否创建AsyncOpenAI客户端
+    """
+    options = _http_client_options(http_config or {})
+    if asynchronous:
+        return AsyncOpenAI(
+            **client_params, max_retries=0, timeout=options['timeout'],
+            http_client=DefaultAsyncHttpxClient(**options)
+        )
+    return OpenAI(
+        **client_params, max_retries=0, timeout=options['timeout'],
+        http_client=DefaultHttpxClient(**options)
+    )
+
+
+def openai_resource_params(client_params, http_config=None):
+    """OpenAI客户端在共享资源池中的参数（连接设置不同的客户端不共享）"""
+    return {**client_params, 'http': http_config or {}}
+
+
+# 进程内共享的OpenAI/Milvus客户端和嵌入模型
+shared_resources = SharedResourcePool()
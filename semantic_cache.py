@@ -0,0 +1,120 @@
+import threading
+import time
+import numpy as np
+
+
+class SemanticCache:
+    """
+    语义回答缓存
+    在本地向量索引中保存(问题向量, 上下文ID, 回答)，新问题与已缓存问题的相似度
+    超过阈值且检索到的上下文相同时直接复用回答。容量满时淘汰最久未使用的条目。
+    """
+
+    def __init__(self, similarity_threshold=0.95, max_entries=256, ttl_seconds=3600):
+        """
+        Args:
+            similarity_threshold: 判定为相同问题的最小余弦相似度
+            max_entries: 最多缓存的回答数
+            ttl_seconds: 回答存活秒数（None表示永不过期）
+        """
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._vectors = None
+        self._entries = []
+        self._last_used = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, embedding, context_ids):
+        """
+        查找可复用的回答
+
+        Args:
+            embedding: 问题的嵌入向量
+            context_ids: 本次检索到的上下文块ID
+
+        Returns:
+            缓存的回答，未命中返回None
+        """
+        with self._lock:
+            if not self._entries:
+                self.misses += 1
+                return None
+
+            query = self._normalize(embedding)
+            similarities = self._vectors[:len(self._entries)] @ query
+            context_key = tuple(sorted(context_ids))
+            now = time.monotonic()
+
+            # 按相似度从高到低检查，直到低于阈值
+            for index in np.argsort(-similarities):
+                if similarities[index] < self.similarity_threshold:
+                    break
+                entry_context, answer, expires_at = self._entries[index]
+                if expires_at is not None and expires_at <= now:
+                    continue
+                if entry_context == context_key:
+                    self._last_used[index] = now
+                    self.hits += 1
+                    return answer
+
+            self.misses += 1
+            return None
+
+    def store(self, embedding, context_ids, answer):
+        """
+        缓存一个回答
+
+        Args:
+            embedding: 问题的嵌入向量
+            context_ids: 生成回答时使用的上下文块ID
+            answer: 回答文本
+        """
+        vector = self._normalize(embedding)
+        now = time.monotonic()
+        expires_at = now + self.ttl_seconds if self.ttl_seconds else None
+        entry = (tuple(sorted(context_ids)), answer, expires_at)
+
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[1] != vector.shape[0]:
+                # 首次写入或嵌入模型维度变化时重建索引
+                self._vectors = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+                self._entries = []
+                self._last_used = []
+
+            if len(self._entries) < self.max_entries:
+                index = len(self._entries)
+                self._entries.append(entry)
+                self._last_used.append(now)
+            else:
+                # 替换最久未使用的条目
+                index = int(np.argmin(self._last_used))
+                self._entries[index] = entry
+                self._last_used[index] = now
+            self._vectors[index] = vector
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries = []
+            self._last_used = []
+
+    def stats(self):
+        """返回缓存统计信息"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
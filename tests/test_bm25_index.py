@@ -0,0 +1,109 @@
+import os
+
+import pytest
+
+from bm25_index import BM25Index, tokenize
+
+
+DOCS = {
+    1: "Article 5 prohibits certain artificial intelligence practices",
+    2: "Article 6 classifies high-risk AI systems",
+    3: "Providers of high-risk AI systems shall ensure compliance",
+    4: "人工智能系统的提供者应当确保合规",
+}
+
+
+def ranked_ids(index, query, top_k=10):
+    return [doc_id for doc_id, _ in index.search(query, top_k)]
+
+
+def assert_same_results(index, reference, queries=("article", "high-risk systems", "人工智能", "compliance 5")):
+    for query in queries:
+        results = index.search(query, 10)
+        expected = reference.search(query, 10)
+        assert [doc_id for doc_id, _ in results] == [doc_id for doc_id, _ in expected]
+        assert [score for _, score in results] == pytest.approx([score for _, score in expected], rel=1e-5)
+
+
+def test_tokenize():
+    assert tokenize("Article 5(1)") == ["article", "5", "1"]
+    assert tokenize("人工智能 AI") == ["人工", "工智", "智能", "ai"]
+
+
+def test_search_ranks_exact_terms_first(tmp_path):
+    index = BM25Index(str(tmp_path / "index.npz"))
+    index.add(DOCS.items())
+    assert ranked_ids(index, "article 5")[0] == 1
+    assert ranked_ids(index, "人工智能") == [4]
+    assert index.search("unknown", 10) == []
+
+
+def test_save_load_round_trip(tmp_path):
+    path = str(tmp_path / "index.npz")
+    index = BM25Index(path)
+    index.add(DOCS.items())
+    index.save()
+
+    loaded = BM25Index(path)
+    assert len(loaded) == len(DOCS)
+    assert_same_results(loaded, index)
+
+
+def test_add_and_remove_after_load_match_rebuilt_index(tmp_path):
+    path = str(tmp_path / "index.npz")
+    index = BM25Index(path)
+    index.add(DOCS.items())
+    index.save()
+
+    loaded = BM25Index(path)
+    loaded.remove([2])
+    loaded.add([(3, "Providers shall register systems"), (5, "Article 7 amends annex III")])
+
+    documents = dict(DOCS)
+    del documents[2]
+    documents[3] = "Providers shall register systems"
+    documents[5] = "Article 7 amends annex III"
+    reference = BM25Index(str(tmp_path / "reference.npz"))
+    reference.add(documents.items())
+
+    # 增量段未压缩时的结果与重建的索引一致
+    assert len(loaded) == len(documents)
+    assert_same_results(loaded, reference)
+
+    loaded.save()
+    assert_same_results(loaded, reference)
+    assert_same_results(BM25Index(path), reference)
+
+
+def test_remove_missing_ids_is_ignored(tmp_path):
+    index = BM25Index(str(tmp_path / "index.npz"))
+    index.add(DOCS.items())
+    index.remove([42])
+    assert len(index) == len(DOCS)
+
+
+def test_clear(tmp_path):
+    path = str(tmp_path / "index.npz")
+    index = BM25Index(path)
+    index.add(DOCS.items())
+    index.save()
+    index.clear()
+    index.save()
+    assert len(BM25Index(path)) == 0
+    assert index.search("article", 10) == []
+
+
+def test_reader_reloads_after_writer_saves(tmp_path):
+    path = str(tmp_path / "index.npz")
+    writer = BM25Index(path)
+    writer.add(DOCS.items())
+    writer.save()
+
+    reader = BM25Index(path)
+    reader.REFRESH_INTERVAL = 0
+    writer.add([(6, "Article 99 penalties")])
+    writer.save()
+    # 文件系统的时间精度较粗时两次保存的修改时间可能相同
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert ranked_ids(reader, "penalties") == [6]
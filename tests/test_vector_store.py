@@ -0,0 +1,150 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from vector_store import LocalVectorStore, compile_filter
+
+
+ROWS = [
+    {"id": 1, "source": "/docs/a.pdf", "page": 1, "doc_type": "pdf"},
+    {"id": 2, "source": "/docs/b.pdf", "page": 5, "doc_type": "report"},
+    {"id": 3, "source": "/other/c.txt", "page": 10, "doc_type": "txt"},
+    {"id": 4, "page": 2},
+]
+
+
+def matching(expr):
+    predicate = compile_filter(expr)
+    return [row["id"] for row in ROWS if predicate(row)]
+
+
+@pytest.mark.parametrize("expr, expected", [
+    ('source == "/docs/a.pdf"', [1]),
+    ('page != 5', [1, 3, 4]),
+    ('page >= 2 and page < 10', [2, 4]),
+    ('page > 1 && doc_type == "report"', [2]),
+    ('doc_type == "txt" || id == 1', [1, 3]),
+    ('doc_type in ["pdf", "txt"]', [1, 3]),
+    ('doc_type not in ["pdf", "txt"]', [2, 4]),
+    ('not (page <= 2)', [2, 3]),
+    ('source like "/docs/%"', [1, 2]),
+    ('source like "%.tx_"', [3]),
+    ('not source like "%.pdf"', [3, 4]),
+])
+def test_filter_parser(expr, expected):
+    assert matching(expr) == expected
+
+
+def test_empty_filter_matches_everything():
+    assert compile_filter('') is None
+    assert compile_filter('   ') is None
+
+
+@pytest.mark.parametrize("expr", ['page >', 'page ~ 1', '(page == 1', 'page == 1 extra', 'source like 5'])
+def test_filter_parser_rejects_invalid_expressions(expr):
+    with pytest.raises(ValueError):
+        compile_filter(expr)
+
+
+def make_store(path, count=10, dimension=4):
+    store = LocalVectorStore(str(path))
+    store.create_collection('c', dimension, 'IP')
+    vectors = np.eye(count, dimension, dtype=np.float32) + 0.01
+    store.insert('c', [{"id": i, "vector": vectors[i].tolist(), "text": f"t{i}"} for i in range(count)])
+    return store
+
+
+def collection_dir(path):
+    return os.path.join(str(path), 'c')
+
+
+def test_replay_restores_rows_and_deletes(tmp_path):
+    store = make_store(tmp_path)
+    store.delete('c', ids=[1, 2])
+    store.insert('c', [{"id": 3, "vector": [0, 0, 0, 1], "text": "replaced"}])
+
+    reloaded = LocalVectorStore(str(tmp_path))
+    assert reloaded.get_collection_stats('c') == {"row_count": 8}
+    assert reloaded.query('c', ids=[1, 3], output_fields=["text"]) == [{"id": 3, "text": "replaced"}]
+    hit = reloaded.search('c', [[0, 0, 0, 1]], limit=1)[0][0]
+    assert hit["id"] == 3
+
+
+def test_replay_drops_torn_last_line(tmp_path):
+    store = make_store(tmp_path)
+    log_path = os.path.join(collection_dir(tmp_path), 'rows.jsonl')
+    with open(log_path, 'ab') as f:
+        f.write(b'{"op": "insert", "row": {"id": 9')
+
+    reloaded = LocalVectorStore(str(tmp_path))
+    assert reloaded.get_collection_stats('c') == {"row_count": 10}
+    # 截断后追加的记录不会接在残缺的行后面
+    reloaded.insert('c', [{"id": 100, "vector": [1, 1, 1, 1], "text": "new"}])
+    assert LocalVectorStore(str(tmp_path)).get_collection_stats('c') == {"row_count": 11}
+
+
+def test_replay_raises_on_corruption_before_last_line(tmp_path):
+    make_store(tmp_path)
+    log_path = os.path.join(collection_dir(tmp_path), 'rows.jsonl')
+    with open(log_path, 'rb') as f:
+        lines = f.read().split(b'\n')
+    lines[3] = b'not json'
+    with open(log_path, 'wb') as f:
+        f.write(b'\n'.join(lines))
+
+    with pytest.raises(ValueError):
+        LocalVectorStore(str(tmp_path)).get_collection_stats('c')
+
+
+def test_replay_truncates_vectors_without_log_rows(tmp_path):
+    make_store(tmp_path)
+    with open(os.path.join(collection_dir(tmp_path), 'vectors.f32'), 'ab') as f:
+        f.write(np.ones(4, dtype=np.float32).tobytes())
+
+    reloaded = LocalVectorStore(str(tmp_path))
+    assert reloaded.get_collection_stats('c') == {"row_count": 10}
+    assert os.path.getsize(os.path.join(collection_dir(tmp_path), 'vectors.f32')) == 10 * 4 * 4
+
+
+def test_compaction_switches_generation(tmp_path):
+    store = make_store(tmp_path, count=2000)
+    store.delete('c', ids=list(range(1500)))
+
+    with open(os.path.join(collection_dir(tmp_path), 'meta.json')) as f:
+        assert json.load(f)["generation"] == 1
+    assert sorted(os.listdir(collection_dir(tmp_path))) == ['meta.json', 'rows.1.jsonl', 'vectors.1.f32']
+
+    reloaded = LocalVectorStore(str(tmp_path))
+    assert reloaded.get_collection_stats('c') == {"row_count": 500}
+    assert [row["id"] for row in reloaded.query('c', filter='id < 1502')] == [1500, 1501]
+
+
+def test_interrupted_compaction_keeps_current_generation(tmp_path):
+    make_store(tmp_path)
+    directory = collection_dir(tmp_path)
+    # 新一代文件已写出，但meta.json尚未切换
+    with open(os.path.join(directory, 'vectors.1.f32'), 'wb') as f:
+        f.write(b'partial')
+    with open(os.path.join(directory, 'rows.1.jsonl'), 'w') as f:
+        f.write('{"op": "insert"')
+
+    reloaded = LocalVectorStore(str(tmp_path))
+    assert reloaded.get_collection_stats('c') == {"row_count": 10}
+    assert sorted(os.listdir(directory)) == ['meta.json', 'rows.jsonl', 'vectors.f32']
+
+
+def test_compaction_interrupted_after_switch_removes_old_files(tmp_path):
+    store = make_store(tmp_path, count=2000)
+    directory = collection_dir(tmp_path)
+    store.delete('c', ids=list(range(1500)))
+    # 模拟切换代号后、删除旧文件前中断
+    with open(os.path.join(directory, 'vectors.f32'), 'wb') as f:
+        f.write(b'stale')
+    with open(os.path.join(directory, 'rows.jsonl'), 'w') as f:
+        f.write('stale')
+
+    reloaded = LocalVectorStore(str(tmp_path))
+    assert reloaded.get_collection_stats('c') == {"row_count": 500}
+    assert 'vectors.f32' not in os.listdir(directory)
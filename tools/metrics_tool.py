@@ -0,0 +1,36 @@
+from .base_tool import BaseTool
+from metrics import metrics
+
+class MetricsTool(BaseTool):
+    """
+    指标工具：显示各阶段平均耗时、token数和缓存命中率
+    """
+    
+    @property
+    def name(self) -> str:
+        return "/metrics"
+        
+    @property
+    def description(self) -> str:
+        return "显示各阶段的平均耗时、token用量和缓存命中率"
+        
+    @property
+    def requires_llm(self) -> bool:
+        return False
+        
+    def execute(self, *args, **kwargs) -> str:
+        snapshot = metrics.snapshot()
+        result = "各阶段耗时:\n" + "-" * 30 + "\n"
+        for name, histogram in sorted(snapshot["histograms"].items()):
+            result += f"{name}: {histogram['count']} 次，平均 {histogram['avg'] * 1000:.1f} ms\n"
+        
+        result += "\ntoken用量:\n" + "-" * 30 + "\n"
+        for name, value in sorted(snapshot["counters"].items()):
+            if name.startswith('llm_tokens_total'):
+                result += f"{name}: {value}\n"
+        
+        result += "\n缓存命中率:\n" + "-" * 30 + "\n"
+        for cache, hit_rate in sorted(snapshot["cache_hit_rates"].items()):
+            result += f"{cache}: {hit_rate:.1%}\n"
+            
+        return result
\ No newline at end of file
@@ -0,0 +1,951 @@
+import ast
+import json
+import os
+import re
+import shutil
+import threading
+from abc import ABC, abstractmethod
+import numpy as np
+
+
+class VectorStore(ABC):
+    """
+    向量存储后端接口
+    方法签名与pymilvus.MilvusClient中RAG系统用到的部分保持一致，
+    因此MilvusClient本身即可作为一种后端使用
+    """
+
+    @abstractmethod
+    def has_collection(self, collection_name):
+        """集合是否存在"""
+
+    @abstractmethod
+    def create_collection(self, collection_name, dimension, metric_type='IP', **kwargs):
+        """创建集合"""
+
+    @abstractmethod
+    def drop_collection(self, collection_name):
+        """删除集合"""
+
+    @abstractmethod
+    def get_collection_stats(self, collection_name):
+        """返回集合统计信息，至少包含row_count"""
+
+    @abstractmethod
+    def insert(self, collection_name, data, partition_name=None):
+        """插入数据，data为包含id、vector及其他字段的字典列表"""
+
+    @abstractmethod
+    def delete(self, collection_name, ids=None, filter=None):
+        """按ID或过滤表达式删除数据"""
+
+    @abstractmethod
+    def query(self, collection_name, filter='', output_fields=None, limit=None, partition_names=None):
+        """按过滤表达式查询数据"""
+
+    @abstractmethod
+    def search(self, collection_name, data, limit=10, search_params=None, output_fields=None, filter='',
+               partition_names=None):
+        """向量相似度搜索，data为查询向量列表，partition_names限定只搜索指定的分区"""
+
+    @abstractmethod
+    def has_partition(self, collection_name, partition_name):
+        """分区是否存在"""
+
+    @abstractmethod
+    def create_partition(self, collection_name, partition_name):
+        """创建分区"""
+
+    def close(self):
+        """释放后端资源"""
+
+
+# ---------------------------------------------------------------------------
+# 过滤表达式
+# ---------------------------------------------------------------------------
+
+_TOKEN_RE = re.compile(r'''\s*(?:
+    (?P<string>"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*') |
+    (?P<number>-?\d+(?:\.\d+)?) |
+    (?P<op>==|!=|>=|<=|&&|\|\||>|<|\(|\)|\[|\]|,) |
+    (?P<name>[A-Za-z_][A-Za-z0-9_]*)
+)''', re.VERBOSE)
+
+_COMPARATORS = {
+    '==': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+    '>': lambda a, b: a is not None and a > b,
+    '>=': lambda a, b: a is not None and a >= b,
+    '<': lambda a, b: a is not None and a < b,
+    '<=': lambda a, b: a is not None and a <= b,
+}
+
+
+def _tokenize(expr):
+    tokens = []
+    position = 0
+    expr = expr.rstrip()
+    while position < len(expr):
+        match = _TOKEN_RE.match(expr, position)
+        if not match or match.end() == position:
+            raise ValueError(f"无法解析过滤表达式: {expr}")
+        kind = match.lastgroup
+        tokens.append((kind, match.group(kind)))
+        position = match.end()
+    return tokens
+
+
+def _like_pattern(pattern):
+    """把like模式（%匹配任意个字符，_匹配单个字符）转换为正则表达式"""
+    regex = ''.join(
+        '.*' if char == '%' else '.' if char == '_' else re.escape(char)
+        for char in pattern
+    )
+    return re.compile(regex, re.DOTALL)
+
+
+class _FilterParser:
+    """
+    Milvus布尔表达式子集的解析器，支持比较运算（== != > >= < <=）、in / not in、
+    字符串的like匹配、and / or / not（及 && / ||）和括号；
+    不支持算术运算、JSON/数组字段的函数（如json_contains、array_length）
+    """
+
+    def __init__(self, expr):
+        self.tokens = _tokenize(expr)
+        self.position = 0
+
+    def parse(self):
+        predicate = self._or()
+        if self.position != len(self.tokens):
+            raise ValueError(f"过滤表达式中有多余的内容: {self.tokens[self.position][1]}")
+        return predicate
+
+    def _peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def _take(self, expected=None):
+        kind, value = self._peek()
+        if kind is None or (expected is not None and value != expected):
+            raise ValueError(f"过滤表达式不完整，期望 {expected or '更多内容'}")
+        self.position += 1
+        return kind, value
+
+    def _or(self):
+        left = self._and()
+        while self._peek()[1] in ('or', '||'):
+            self._take()
+            right = self._and()
+            left = (lambda l, r: lambda row: l(row) or r(row))(left, right)
+        return left
+
+    def _and(self):
+        left = self._not()
+        while self._peek()[1] in ('and', '&&'):
+            self._take()
+            right = self._not()
+            left = (lambda l, r: lambda row: l(row) and r(row))(left, right)
+        return left
+
+    def _not(self):
+        if self._peek()[1] == 'not':
+            self._take()
+            inner = self._not()
+            return lambda row: not inner(row)
+        if self._peek()[1] == '(':
+            self._take('(')
+            inner = self._or()
+            self._take(')')
+            return inner
+        return self._comparison()
+
+    def _comparison(self):
+        kind, field = self._take()
+        if kind != 'name':
+            raise ValueError(f"过滤表达式中应为字段名: {field}")
+
+        negate = False
+        if self._peek()[1] == 'not':
+            self._take()
+            negate = True
+        if self._peek()[1] == 'in':
+            self._take()
+            values = set(self._list())
+            if negate:
+                return lambda row: row.get(field) not in values
+            return lambda row: row.get(field) in values
+        if negate:
+            raise ValueError("not之后应为in")
+        if self._peek()[1] == 'like':
+            self._take()
+            kind, value = self._take()
+            if kind != 'string':
+                raise ValueError(f"like之后应为字符串: {value}")
+            pattern = _like_pattern(ast.literal_eval(value))
+            return lambda row: isinstance(row.get(field), str) and pattern.fullmatch(row[field]) is not None
+
+        _, op = self._take()
+        if op not in _COMPARATORS:
+            raise ValueError(f"不支持的比较运算符: {op}")
+        value = self._value()
+        compare = _COMPARATORS[op]
+        return lambda row: compare(row.get(field), value)
+
+    def _list(self):
+        self._take('[')
+        values = []
+        while self._peek()[1] != ']':
+            values.append(self._value())
+            if self._peek()[1] == ',':
+                self._take(',')
+        self._take(']')
+        return values
+
+    def _value(self):
+        kind, value = self._take()
+        if kind in ('string', 'number'):
+            return ast.literal_eval(value)
+        if kind == 'name' and value.lower() in ('true', 'false'):
+            return value.lower() == 'true'
+        raise ValueError(f"过滤表达式中应为常量: {value}")
+
+
+def _remove_file(path):
+    """删除文件，文件不存在或仍被占用时忽略（下次加载集合时会再次清理）"""
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def compile_filter(expr):
+    """将过滤表达式编译为 row -> bool 函数，空表达式匹配所有行"""
+    if not expr or not expr.strip():
+        return None
+    return _FilterParser(expr).parse()
+
+
+def _partition_predicate(partition_names):
+    """匹配属于指定分区的行"""
+    partitions = set(partition_names)
+    return lambda row: row.get(PARTITION_FIELD, DEFAULT_PARTITION) in partitions
+
+
+def _scope_predicate(expr, partition_names=None):
+    """过滤表达式和分区列表共同决定的行匹配函数，两者都为空时返回None"""
+    predicate = compile_filter(expr)
+    if not partition_names:
+        return predicate
+    in_partitions = _partition_predicate(partition_names)
+    if predicate is None:
+        return in_partitions
+    return lambda row: in_partitions(row) and predicate(row)
+
+
+# ---------------------------------------------------------------------------
+# 本地后端
+# ---------------------------------------------------------------------------
+
+# 与Milvus一致，集合创建时自带默认分区
+DEFAULT_PARTITION = '_default'
+# 行所属分区在本地后端中以该隐藏字段保存
+PARTITION_FIELD = '_partition'
+
+
+class _LocalCollection:
+    """
+    单个本地集合
+    向量以float32矩阵追加写入内存映射文件，标量字段和删除记录写入追加日志。
+    压缩时写入新一代的向量、日志文件，再通过原子替换meta.json切换到新一代，
+    任何时刻中断都能从meta.json记录的那一代文件恢复。
+    """
+
+    # 分块计算相似度时每块的行数，限制临时矩阵的内存占用
+    BLOCK_ROWS = 65536
+
+    def __init__(self, directory, meta):
+        self.directory = directory
+        self.meta = meta
+        self.dimension = meta['dimension']
+        self.metric_type = meta['metric_type'].upper()
+        self.rows = []
+        self.alive = np.zeros(0, dtype=bool)
+        self.id_to_slot = {}
+        self._memmap = None
+        self._norms = None
+        self._centroids = None
+        self._assignments = None
+        self._lists = None
+        self._index_built_at = 0
+
+    # ---- 文件 ----
+
+    # 各代数据文件名，第0代不带代号（与旧版本的目录兼容），之后为如vectors.3.f32
+    DATA_FILES = ('vectors.f32', 'rows.jsonl', 'ivf.npz')
+    _DATA_FILE_RE = re.compile(r'^(vectors|rows|ivf)(\.\d+)?\.(f32|jsonl|npz)(\.tmp)?$')
+
+    def _data_path(self, name, generation=None):
+        if generation is None:
+            generation = self.meta.get('generation', 0)
+        if generation:
+            stem, extension = os.path.splitext(name)
+            name = f"{stem}.{generation}{extension}"
+        return os.path.join(self.directory, name)
+
+    @property
+    def _meta_path(self):
+        return os.path.join(self.directory, 'meta.json')
+
+    @property
+    def _vectors_path(self):
+        return self._data_path('vectors.f32')
+
+    @property
+    def _log_path(self):
+        return self._data_path('rows.jsonl')
+
+    @property
+    def _index_path(self):
+        return self._data_path('ivf.npz')
+
+    @classmethod
+    def create(cls, directory, dimension, metric_type, index_type='FLAT', nlist=128):
+        os.makedirs(directory, exist_ok=True)
+        meta = {
+            "dimension": dimension,
+            "metric_type": metric_type,
+            "index_type": index_type.upper(),
+            "nlist": nlist,
+            "partitions": [DEFAULT_PARTITION],
+        }
+        collection = cls(directory, meta)
+        collection._save_meta()
+        open(collection._vectors_path, 'wb').close()
+        open(collection._log_path, 'w').close()
+        return collection
+
+    @classmethod
+    def load(cls, directory):
+        with open(os.path.join(directory, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+        collection = cls(directory, meta)
+        collection._remove_stale_files()
+        collection._replay_log()
+        collection._load_index()
+        return collection
+
+    def _save_meta(self, meta=None):
+        """原子地写入meta.json，meta不为None时同时替换内存中的元数据"""
+        meta = self.meta if meta is None else meta
+        with open(self._meta_path + '.tmp', 'w') as f:
+            json.dump(meta, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self._meta_path + '.tmp', self._meta_path)
+        self.meta = meta
+
+    def _remove_stale_files(self):
+        """删除不属于当前一代的数据文件（压缩中断留下的新文件或切换后未删除的旧文件）"""
+        current = {os.path.basename(self._data_path(name)) for name in self.DATA_FILES}
+        for name in os.listdir(self.directory):
+            if self._DATA_FILE_RE.match(name) and name not in current:
+                _remove_file(os.path.join(self.directory, name))
+
+    def _replay_log(self):
+        alive = []
+        # 最后一行可能是写入中断留下的不完整记录，丢弃并截断；之前的行损坏则无法恢复
+        offset = 0
+        torn_at = torn_line = None
+        missing_newline = False
+        with open(self._log_path, 'rb') as f:
+            for number, line in enumerate(f, 1):
+                if not line.strip():
+                    offset += len(line)
+                    continue
+                if torn_at is not None:
+                    raise ValueError(f"日志 {self._log_path} 第 {torn_line} 行损坏")
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    torn_at, torn_line = offset, number
+                    continue
+                offset += len(line)
+                missing_newline = not line.endswith(b'\n')
+                if record['op'] == 'insert':
+                    row = record['row']
+                    self._mark_deleted(alive, [row['id']])
+                    self.id_to_slot[row['id']] = len(self.rows)
+                    self.rows.append(row)
+                    alive.append(True)
+                else:
+                    self._mark_deleted(alive, record['ids'])
+        if torn_at is not None:
+            with open(self._log_path, 'r+b') as f:
+                f.truncate(torn_at)
+        elif missing_newline:
+            # 记录完整但换行符未写入，补上换行符，之后追加的记录才不会接在同一行
+            with open(self._log_path, 'ab') as f:
+                f.write(b'\n')
+
+        self.alive = np.array(alive, dtype=bool)
+        
+        # 写入中断时向量文件和日志可能不一致：向量先于日志写入，多出的向量直接截断
+        row_bytes = 4 * self.dimension
+        stored = os.path.getsize(self._vectors_path) // row_bytes
+        if stored > len(self.rows):
+            with open(self._vectors_path, 'r+b') as f:
+                f.truncate(len(self.rows) * row_bytes)
+        elif stored < len(self.rows):
+            # 日志中多出的行没有对应的向量，先丢弃这些行，再只按已有的向量重写
+            self.rows = self.rows[:stored]
+            self.alive = self.alive[:stored]
+            self._rewrite(np.nonzero(self.alive)[0])
+
+    def _mark_deleted(self, alive, ids):
+        for row_id in ids:
+            slot = self.id_to_slot.pop(row_id, None)
+            if slot is not None:
+                alive[slot] = False
+
+    def _append_log(self, records):
+        with open(self._log_path, 'a', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    # ---- 向量 ----
+
+    def _vectors(self):
+        """返回所有向量的只读内存映射（含已删除的行）"""
+        if self._memmap is None or self._memmap.shape[0] != len(self.rows):
+            if not self.rows:
+                return np.zeros((0, self.dimension), dtype=np.float32)
+            self._memmap = np.memmap(self._vectors_path, dtype=np.float32, mode='r',
+                                     shape=(len(self.rows), self.dimension))
+        return self._memmap
+
+    def _row_norms(self):
+        """L2度量需要的向量平方范数，按需计算并随插入追加"""
+        vectors = self._vectors()
+        if self._norms is None or len(self._norms) != len(vectors):
+            start = 0 if self._norms is None else len(self._norms)
+            tail = np.einsum('ij,ij->i', vectors[start:], vectors[start:])
+            self._norms = tail if self._norms is None else np.concatenate([self._norms, tail])
+        return self._norms
+
+    def _prepare_vectors(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dimension)
+        if self.metric_type == 'COSINE':
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors = vectors / np.where(norms == 0, 1, norms)
+        return vectors
+
+    # ---- 写入 ----
+
+    def insert(self, data, partition_name=None):
+        if not data:
+            return 0
+        vectors = self._prepare_vectors([row['vector'] for row in data])
+        rows = [{key: value for key, value in row.items() if key != 'vector'} for row in data]
+        if partition_name and partition_name != DEFAULT_PARTITION:
+            # 分区名作为隐藏字段保存在行中，未标记的行属于默认分区
+            for row in rows:
+                row[PARTITION_FIELD] = partition_name
+
+        # 相同ID视为覆盖，先标记旧行为删除
+        replaced = [row['id'] for row in rows if row['id'] in self.id_to_slot]
+        records = []
+        if replaced:
+            records.append({"op": "delete", "ids": replaced})
+        records.extend({"op": "insert", "row": row} for row in rows)
+
+        with open(self._vectors_path, 'ab') as f:
+            f.write(vectors.tobytes())
+        self._append_log(records)
+
+        self._mark_deleted(self.alive, replaced)
+        for row in rows:
+            self.id_to_slot[row['id']] = len(self.rows)
+            self.rows.append(row)
+        self.alive = np.concatenate([self.alive, np.ones(len(rows), dtype=bool)])
+
+        if self._lists is not None:
+            self._assign_to_lists(vectors, len(self.rows) - len(rows))
+        return len(rows)
+
+    def delete(self, ids):
+        ids = [row_id for row_id in ids if row_id in self.id_to_slot]
+        if not ids:
+            return 0
+        self._append_log([{"op": "delete", "ids": ids}])
+        for row_id in ids:
+            self.alive[self.id_to_slot.pop(row_id)] = False
+        self._maybe_compact()
+        return len(ids)
+
+    def _maybe_compact(self):
+        """已删除的行过多时重写文件以回收空间"""
+        dead = len(self.rows) - int(self.alive.sum())
+        if dead < 1024 or dead < len(self.rows) * 0.3:
+            return
+        self._rewrite(np.nonzero(self.alive)[0])
+
+    def _rewrite(self, slots):
+        """
+        只保留指定的行，写入新一代的向量文件和日志
+        新文件落盘后才通过meta.json切换代号，切换前中断时仍使用旧文件，切换后旧文件被删除
+        """
+        vectors = np.array(self._vectors()[slots]) if len(slots) else np.zeros((0, self.dimension), dtype=np.float32)
+        rows = [self.rows[slot] for slot in slots]
+
+        generation = self.meta.get('generation', 0) + 1
+        with open(self._data_path('vectors.f32', generation), 'wb') as f:
+            f.write(vectors.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        with open(self._data_path('rows.jsonl', generation), 'w', encoding='utf-8') as f:
+            for row in rows:
+                f.write(json.dumps({"op": "insert", "row": row}, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+        old_paths = [self._data_path(name) for name in self.DATA_FILES]
+        self._save_meta(dict(self.meta, generation=generation))
+        # 正在进行的检索仍持有旧向量文件的内存映射，删除文件不影响其读取
+        self._memmap = None
+        for path in old_paths:
+            _remove_file(path)
+
+        self.rows = rows
+        self.alive = np.ones(len(rows), dtype=bool)
+        self.id_to_slot = {row['id']: slot for slot, row in enumerate(rows)}
+        self._norms = None
+        self._drop_index()
+
+    # ---- 分区 ----
+
+    @property
+    def partitions(self):
+        return self.meta.get('partitions', [DEFAULT_PARTITION])
+
+    def create_partition(self, partition_name):
+        if partition_name in self.partitions:
+            raise ValueError(f"分区 {partition_name} 已存在")
+        self.meta['partitions'] = [*self.partitions, partition_name]
+        self._save_meta()
+
+    def drop_partition(self, partition_name):
+        if partition_name == DEFAULT_PARTITION:
+            raise ValueError("默认分区不能删除")
+        self.check_partitions([partition_name])
+        self.delete([self.rows[slot]['id'] for slot in self.matching_slots(_partition_predicate([partition_name]))])
+        self.meta['partitions'] = [name for name in self.partitions if name != partition_name]
+        self._save_meta()
+
+    def check_partitions(self, partition_names):
+        for partition_name in partition_names or []:
+            if partition_name not in self.partitions:
+                raise ValueError(f"分区 {partition_name} 不存在")
+
+    # ---- 读取 ----
+
+    def matching_slots(self, predicate):
+        slots = np.nonzero(self.alive)[0]
+        if predicate is None:
+            return slots
+        return np.array([slot for slot in slots if predicate(self.rows[slot])], dtype=np.int64)
+
+    def entity(self, slot, output_fields):
+        row = self.rows[slot]
+        if output_fields is None:
+            return {key: value for key, value in row.items() if key != PARTITION_FIELD}
+        entity = {}
+        for field in output_fields:
+            if field == 'vector':
+                entity['vector'] = self._vectors()[slot].tolist()
+            elif field in row:
+                entity[field] = row[field]
+        return entity
+
+    def search_snapshot(self, queries, predicate=None, nprobe=None):
+        """
+        确定候选行并获取当前数据的快照，需在持有存储锁时调用
+        返回的快照在锁外计算相似度和top-k，期间的写入和压缩不影响它的结果
+        """
+        queries = self._prepare_vectors(queries)
+        candidates = None if predicate is None or not self.rows else self.matching_slots(predicate)
+        if self.rows and self.meta.get('index_type') == 'IVF_FLAT' and self._ensure_index():
+            probes = [self._probe(query, nprobe, candidates) for query in queries]
+        else:
+            probes = None
+        return _SearchSnapshot(self, queries, candidates, probes)
+
+    # ---- IVF索引 ----
+
+    def _ensure_index(self):
+        """按需构建IVF索引；数据量太小时直接使用精确搜索"""
+        nlist = self.meta.get('nlist', 128)
+        alive_count = int(self.alive.sum())
+        if alive_count < nlist * 39:
+            return False
+        if self._lists is None or alive_count > 2 * self._index_built_at:
+            self.build_index()
+        return True
+
+    def build_index(self, iterations=10, sample_size=65536):
+        """用k-means训练聚类中心并把所有向量分配到倒排列表"""
+        nlist = self.meta.get('nlist', 128)
+        slots = np.nonzero(self.alive)[0]
+        rng = np.random.default_rng(0)
+        sample = self._prepare_vectors(self._vectors()[rng.choice(slots, min(sample_size, len(slots)), replace=False)])
+
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(iterations):
+            labels = self._nearest_centroids(sample, centroids)
+            for cluster in range(nlist):
+                members = sample[labels == cluster]
+                if len(members):
+                    centroids[cluster] = members.mean(axis=0)
+
+        self._centroids = centroids
+        self._assignments = np.zeros(0, dtype=np.int32)
+        self._lists = [[] for _ in range(nlist)]
+        self._assign_to_lists(self._vectors(), 0)
+        self._index_built_at = len(slots)
+        np.savez(self._index_path, centroids=self._centroids, assignments=self._assignments,
+                 built_at=np.array([self._index_built_at]))
+
+    def _nearest_centroids(self, vectors, centroids):
+        labels = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), self.BLOCK_ROWS):
+            block = np.asarray(vectors[start:start + self.BLOCK_ROWS], dtype=np.float32)
+            if self.metric_type == 'L2':
+                distances = (block ** 2).sum(1)[:, None] - 2 * block @ centroids.T + (centroids ** 2).sum(1)[None, :]
+                labels[start:start + len(block)] = distances.argmin(axis=1)
+            else:
+                labels[start:start + len(block)] = (block @ centroids.T).argmax(axis=1)
+        return labels
+
+    def _assign_to_lists(self, vectors, first_slot):
+        labels = self._nearest_centroids(vectors, self._centroids)
+        self._assignments = np.concatenate([self._assignments, labels])
+        for offset, label in enumerate(labels):
+            self._lists[label].append(first_slot + offset)
+
+    def _probe(self, query, nprobe, candidates=None):
+        """返回查询最近的nprobe个倒排列表中的候选行"""
+        nprobe = min(nprobe or 8, len(self._centroids))
+        if self.metric_type == 'L2':
+            scores = -((self._centroids - query) ** 2).sum(axis=1)
+        else:
+            scores = self._centroids @ query
+        clusters = np.argpartition(-scores, nprobe - 1)[:nprobe]
+        slots = np.concatenate([np.asarray(self._lists[c], dtype=np.int64) for c in clusters])
+        if candidates is not None:
+            slots = np.intersect1d(slots, candidates)
+        return np.sort(slots)
+
+    def _load_index(self):
+        if not os.path.exists(self._index_path):
+            return
+        with np.load(self._index_path) as index:
+            self._centroids = index['centroids']
+            assignments = index['assignments'][:len(self.rows)]
+            self._index_built_at = int(index['built_at'][0])
+        self._assignments = assignments
+        self._lists = [[] for _ in range(len(self._centroids))]
+        for slot, label in enumerate(assignments):
+            self._lists[label].append(slot)
+        if len(assignments) < len(self.rows):
+            self._assign_to_lists(self._vectors()[len(assignments):], len(assignments))
+
+    def _drop_index(self):
+        self._centroids = None
+        self._assignments = None
+        self._lists = None
+        self._index_built_at = 0
+        if os.path.exists(self._index_path):
+            os.remove(self._index_path)
+
+
+class _SearchSnapshot:
+    """
+    一次检索用到的集合数据快照
+    行列表只会追加或被整体替换，向量文件的内存映射在压缩后仍指向旧文件，
+    因此只需复制删除标记即可在不持锁的情况下读取
+    """
+
+    def __init__(self, collection, queries, candidates, probes):
+        self.queries = queries
+        self.candidates = candidates
+        self.probes = probes
+        self.rows = collection.rows
+        self.alive = collection.alive.copy()
+        self.vectors = collection._vectors()
+        self.norms = collection._row_norms() if collection.metric_type == 'L2' else None
+        self.metric_type = collection.metric_type
+        self.block_rows = collection.BLOCK_ROWS
+
+    def search(self, limit, output_fields=None):
+        if not len(self.alive):
+            return [[] for _ in range(len(self.queries))]
+        if self.probes is not None:
+            results = [
+                self._search_slots(query[None, :], limit, probe)[0]
+                for query, probe in zip(self.queries, self.probes)
+            ]
+        else:
+            results = self._search_slots(self.queries, limit, self.candidates)
+
+        return [
+            [
+                {"id": self.rows[slot]['id'], "distance": self._to_distance(score),
+                 "entity": self._entity(slot, output_fields)}
+                for slot, score in hits
+            ]
+            for hits in results
+        ]
+
+    def _entity(self, slot, output_fields):
+        row = self.rows[slot]
+        entity = {}
+        for field in output_fields or []:
+            if field == 'vector':
+                entity['vector'] = self.vectors[slot].tolist()
+            elif field in row:
+                entity[field] = row[field]
+        return entity
+
+    def _scores(self, queries, vectors, slots):
+        """计算查询与指定行向量的得分，得分越高越相似"""
+        scores = queries @ vectors.T
+        if self.metric_type == 'L2':
+            norms = self.norms[slots]
+            scores = 2 * scores - norms[None, :] - np.einsum('ij,ij->i', queries, queries)[:, None]
+        return scores
+
+    def _to_distance(self, score):
+        # Milvus的L2度量返回平方距离，越小越相似
+        return float(-score) if self.metric_type == 'L2' else float(score)
+
+    def _search_slots(self, queries, limit, slots=None):
+        """精确计算top-k：分块矩阵乘法，逐块合并候选"""
+        vectors = self.vectors
+        nq = len(queries)
+        best_scores = np.full((nq, 0), -np.inf, dtype=np.float32)
+        best_slots = np.zeros((nq, 0), dtype=np.int64)
+
+        if slots is None:
+            blocks = (
+                (np.arange(start, min(start + self.block_rows, len(vectors))), slice(start, start + self.block_rows))
+                for start in range(0, len(vectors), self.block_rows)
+            )
+        else:
+            blocks = (
+                (slots[start:start + self.block_rows], slots[start:start + self.block_rows])
+                for start in range(0, len(slots), self.block_rows)
+            )
+
+        for block_slots, selector in blocks:
+            if not len(block_slots):
+                continue
+            scores = self._scores(queries, np.asarray(vectors[selector]), block_slots)
+            scores[:, ~self.alive[block_slots]] = -np.inf
+
+            scores = np.concatenate([best_scores, scores], axis=1)
+            all_slots = np.concatenate([best_slots, np.broadcast_to(block_slots, (nq, len(block_slots)))], axis=1)
+            k = min(limit, scores.shape[1])
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            best_scores = np.take_along_axis(scores, top, axis=1)
+            best_slots = np.take_along_axis(all_slots, top, axis=1)
+
+        results = []
+        for scores, found in zip(best_scores, best_slots):
+            order = np.argsort(-scores)
+            results.append([(int(found[i]), float(scores[i])) for i in order if np.isfinite(scores[i])])
+        return results
+
+
+class LocalVectorStore(VectorStore):
+    """
+    进程内向量存储后端
+    每个集合是一个目录，向量保存在内存映射的float32矩阵文件中，通过分块矩阵乘法
+    精确计算top-k；数据量较大时可选IVF_FLAT索引只搜索最近的nprobe个聚类。
+    无需外部服务，中小规模集合的检索在微秒到毫秒级完成。
+    """
+
+    def __init__(self, path='local_index', index_type='FLAT', nlist=128, nprobe=8):
+        """
+        Args:
+            path: 数据目录
+            index_type: 新建集合的索引类型，FLAT（精确搜索）或IVF_FLAT
+            nlist: IVF聚类中心数
+            nprobe: IVF默认搜索的聚类数
+        """
+        self.path = path
+        self.index_type = index_type.upper()
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self._collections = {}
+        self._lock = threading.RLock()
+        os.makedirs(path, exist_ok=True)
+
+    def _directory(self, collection_name):
+        return os.path.join(self.path, collection_name)
+
+    def _collection(self, collection_name):
+        collection = self._collections.get(collection_name)
+        if collection is None:
+            if not self.has_collection(collection_name):
+                raise ValueError(f"集合 {collection_name} 不存在")
+            collection = _LocalCollection.load(self._directory(collection_name))
+            self._collections[collection_name] = collection
+        return collection
+
+    def has_collection(self, collection_name):
+        return os.path.exists(os.path.join(self._directory(collection_name), 'meta.json'))
+
+    def list_collections(self):
+        return sorted(name for name in os.listdir(self.path) if self.has_collection(name))
+
+    def create_collection(self, collection_name, dimension, metric_type='IP', **kwargs):
+        with self._lock:
+            if self.has_collection(collection_name):
+                raise ValueError(f"集合 {collection_name} 已存在")
+            self._collections[collection_name] = _LocalCollection.create(
+                self._directory(collection_name), dimension, metric_type,
+                index_type=kwargs.get('index_type', self.index_type),
+                nlist=kwargs.get('nlist', self.nlist)
+            )
+
+    def drop_collection(self, collection_name):
+        with self._lock:
+            self._collections.pop(collection_name, None)
+            shutil.rmtree(self._directory(collection_name), ignore_errors=True)
+
+    def get_collection_stats(self, collection_name):
+        with self._lock:
+            return {"row_count": int(self._collection(collection_name).alive.sum())}
+
+    def insert(self, collection_name, data, partition_name=None):
+        with self._lock:
+            collection = self._collection(collection_name)
+            collection.check_partitions([partition_name] if partition_name else None)
+            count = collection.insert(list(data), partition_name)
+        return {"insert_count": count}
+
+    def upsert(self, collection_name, data, partition_name=None):
+        with self._lock:
+            collection = self._collection(collection_name)
+            collection.check_partitions([partition_name] if partition_name else None)
+            count = collection.insert(list(data), partition_name)
+        return {"upsert_count": count}
+
+    def delete(self, collection_name, ids=None, filter=None):
+        with self._lock:
+            collection = self._collection(collection_name)
+            if ids is None:
+                predicate = compile_filter(filter)
+                ids = [collection.rows[slot]['id'] for slot in collection.matching_slots(predicate)]
+            elif not isinstance(ids, (list, tuple, set)):
+                ids = [ids]
+            count = collection.delete(list(ids))
+        return {"delete_count": count}
+
+    def query(self, collection_name, filter='', output_fields=None, limit=None, ids=None, partition_names=None):
+        with self._lock:
+            collection = self._collection(collection_name)
+            collection.check_partitions(partition_names)
+            if ids is not None:
+                slots = [collection.id_to_slot[row_id] for row_id in ids if row_id in collection.id_to_slot]
+                if partition_names:
+                    in_partitions = _partition_predicate(partition_names)
+                    slots = [slot for slot in slots if in_partitions(collection.rows[slot])]
+            else:
+                slots = collection.matching_slots(_scope_predicate(filter, partition_names))
+            if limit is not None:
+                slots = slots[:limit]
+            fields = None if output_fields is None else ['id', *output_fields]
+            return [collection.entity(slot, fields) for slot in slots]
+
+    def query_iterator(self, collection_name, batch_size=1000, filter='', output_fields=None, partition_names=None):
+        rows = self.query(collection_name, filter=filter, output_fields=output_fields, partition_names=partition_names)
+        return _ListIterator(rows, batch_size)
+
+    def search(self, collection_name, data, limit=10, search_params=None, output_fields=None, filter='',
+               partition_names=None, **kwargs):
+        params = (search_params or {}).get('params') or {}
+        with self._lock:
+            collection = self._collection(collection_name)
+            collection.check_partitions(partition_names)
+            snapshot = collection.search_snapshot(
+                data,
+                predicate=_scope_predicate(filter, partition_names),
+                nprobe=params.get('nprobe', self.nprobe)
+            )
+        # 矩阵乘法和top-k在锁外进行，不阻塞并发的检索和写入
+        return snapshot.search(limit, output_fields)
+
+    def has_partition(self, collection_name, partition_name):
+        with self._lock:
+            return partition_name in self._collection(collection_name).partitions
+
+    def list_partitions(self, collection_name):
+        with self._lock:
+            return list(self._collection(collection_name).partitions)
+
+    def create_partition(self, collection_name, partition_name):
+        with self._lock:
+            self._collection(collection_name).create_partition(partition_name)
+
+    def drop_partition(self, collection_name, partition_name):
+        """删除分区及其中的所有数据"""
+        with self._lock:
+            self._collection(collection_name).drop_partition(partition_name)
+
+    def build_index(self, collection_name):
+        """立即为集合构建IVF索引"""
+        with self._lock:
+            self._collection(collection_name).build_index()
+
+
+class _ListIterator:
+    """按批次返回查询结果，接口与pymilvus的QueryIterator一致"""
+
+    def __init__(self, rows, batch_size):
+        self._rows = rows
+        self._batch_size = batch_size
+        self._position = 0
+
+    def next(self):
+        batch = self._rows[self._position:self._position + self._batch_size]
+        self._position += len(batch)
+        return batch
+
+    def close(self):
+        self._rows = []
+
+
+def create_vector_store(rag_config, milvus_params=None):
+    """
+    根据配置创建向量存储后端
+
+    Args:
+        rag_config: 配置文件中的rag部分
+        milvus_params: Milvus连接参数（使用Milvus后端时）
+
+    Returns:
+        VectorStore或MilvusClient实例
+    """
+    backend = rag_config.get('vector_store', {}).get('backend', 'milvus')
+    if backend == 'local':
+        local_config = rag_config.get('local_index', {})
+        return LocalVectorStore(
+            path=local_config.get('path', 'local_index'),
+            index_type=local_config.get('index_type', 'FLAT'),
+            nlist=local_config.get('nlist', 128),
+            nprobe=local_config.get('nprobe', 8)
+        )
+    if backend == 'milvus':
+        from pymilvus import MilvusClient
+        return MilvusClient(**(milvus_params or {}))
+    raise ValueError(f"不支持的向量存储后端: {backend}")